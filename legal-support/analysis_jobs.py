@@ -0,0 +1,210 @@
+'''
+This file contains a background job queue for case analyses.
+Submitting an analysis returns a job id immediately; a bounded pool of worker
+threads runs the LLM calls outside of the request threads. Finished jobs are
+handed to a persistence callback so they can still be fetched after a page
+reload or from another instance.
+'''
+# import packages
+import collections
+import queue
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# how many finished jobs are kept in memory, older ones are only in storage
+MAX_FINISHED_JOBS = 500
+# how many recent wait times are used for the wait time stats
+WAIT_SAMPLES = 200
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class AnalysisJob:
+
+    def __init__(self, user, messages, meta=None):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.messages = messages
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.text = ""
+        self.error = None
+        # notified whenever text grows or the job finishes
+        self.changed = threading.Condition()
+
+    def append(self, delta):
+        with self.changed:
+            self.text += delta
+            self.changed.notify_all()
+
+    def finish(self, status, error=None):
+        with self.changed:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+            self.changed.notify_all()
+
+    def update_meta(self, **values):
+        # the worker changes meta while status polls read it, both under the job's lock
+        with self.changed:
+            self.meta.update(values)
+
+    def pop_meta(self, key, default=None):
+        with self.changed:
+            return self.meta.pop(key, default)
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def wait_for_change(self, offset, timeout):
+        '''Block until there is text past offset or the job finished'''
+        with self.changed:
+            if len(self.text) <= offset and not self.finished:
+                self.changed.wait(timeout)
+            return self.text[offset:], self.finished
+
+    def to_dict(self, include_text=True):
+        with self.changed:
+            meta = dict(self.meta)
+        record = {
+            "job_id": self.id,
+            "user": self.user,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "meta": meta,
+        }
+        if self.started_at is None:
+            record["wait_time"] = time.time() - self.created_at
+        else:
+            record["wait_time"] = self.started_at - self.created_at
+        if self.finished_at is not None and self.started_at is not None:
+            record["run_time"] = self.finished_at - self.started_at
+        if include_text:
+            record["reply"] = self.text
+        return record
+
+
+class AnalysisQueue:
+    '''
+    runner(job, on_delta) performs one analysis from job.messages, calling
+    on_delta with each piece of text as it is produced.
+    on_finished(record) is called with the job's dict once it is done or failed.
+    '''
+
+    def __init__(self, runner, workers=4, max_queued=100, on_finished=None):
+        self.runner = runner
+        self.workers = workers
+        self.on_finished = on_finished
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._finished = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._wait_times = collections.deque(maxlen=WAIT_SAMPLES)
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _start_workers(self):
+        # workers are started on first use so forking servers don't inherit threads
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"analysis-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, user, messages, meta=None):
+        self._start_workers()
+        job = AnalysisJob(user, messages, meta)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFullError("Too many analyses queued, please retry shortly")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, user):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.user == user]
+
+    def position(self, job):
+        # 1-based position among queued jobs, 0 if no longer queued
+        if job.status != QUEUED:
+            return 0
+        with self._lock:
+            queued = [j for j in self._jobs.values() if j.status == QUEUED]
+        queued.sort(key=lambda j: j.created_at)
+        return queued.index(job) + 1 if job in queued else 0
+
+    def stats(self):
+        with self._lock:
+            waits = list(self._wait_times)
+            stats = {
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "max_queued": self._queue.maxsize,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+            oldest = min((j.created_at for j in self._jobs.values() if j.status == QUEUED), default=None)
+        waits.sort()
+        stats["wait_time_avg"] = sum(waits) / len(waits) if waits else 0.0
+        stats["wait_time_p95"] = waits[int(len(waits) * 0.95) - 1] if waits else 0.0
+        stats["wait_time_max"] = waits[-1] if waits else 0.0
+        stats["oldest_queued_age"] = time.time() - oldest if oldest else 0.0
+        return stats
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.started_at = time.time()
+            with self._lock:
+                self._running += 1
+                self._wait_times.append(job.started_at - job.created_at)
+            job.status = RUNNING
+            try:
+                self.runner(job, job.append)
+                job.finish(DONE)
+            except Exception as e:
+                job.finish(FAILED, str(e))
+            with self._lock:
+                self._running -= 1
+                if job.status == DONE:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._finished[job.id] = job
+                while len(self._finished) > MAX_FINISHED_JOBS:
+                    old_id, _ = self._finished.popitem(last=False)
+                    self._jobs.pop(old_id, None)
+            if self.on_finished:
+                try:
+                    self.on_finished(job.to_dict())
+                except Exception:
+                    pass
+            self._queue.task_done()
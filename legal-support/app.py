@@ -1,22 +1,44 @@
-from flask import Flask, jsonify, send_from_directory, request, session
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, session
 from flask_cors import CORS
-import pandas as pd
 import os
 import json
+import threading
+import time
+from datetime import datetime, timezone
+import analysis_jobs
+import batch_analysis
+import case_analytics
+import case_documents
+import case_export
+import case_manifest
+import case_search
+import conversation_store
+import json_responses
+import llm_cache
+import object_cache
+import prompt_builder
+import upload_queue
+import user_store
 import google_storage_utility
-from google_storage_utility import download_cs_file, upload_cs_file, list_cs_files, delete_cs_file
+import questionnaire_registry
+import request_timing
+import static_assets
+import storage_codec
+import summary_renderer
+from google_storage_utility import download_cs_file, upload_cs_file, delete_cs_file
+from google.api_core.exceptions import NotFound
 from werkzeug.security import generate_password_hash, check_password_hash
-import openai
 
-# store last compiled summary for use in chat
-LAST_SUMMARY = None
-
-app = Flask(__name__)
-CORS(app, supports_credentials=True)  # Enable CORS
-app.secret_key = os.environ.get("SECRET_KEY", "randomstring")
+# every route lives on this blueprint, create_app() registers it on the Flask app
+api = Blueprint("api", __name__)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+CHAT_MODEL = "gpt-4.1"
+# maximum number of chat responses this process streams at the same time
+CHAT_STREAM_SLOTS = threading.BoundedSemaphore(int(os.environ.get("CHAT_STREAM_SLOTS", "8")))
+# default input token budget of an analysis or chat call, overridable per request with max_input_tokens
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "16000"))
+TOKEN_STATS = prompt_builder.TokenStats()
 
 # Google Cloud Storage configuration
 BUCKET_NAME = "michele_test_bucket_unique"
@@ -32,163 +54,141 @@ USERS_FILE = "users.json"
 #DEFAULT_USERS = {"admin": "20legal25", "michele": "20legal25", "lauren": "20legal25"}
 
 
-def load_users():
-    try:
-        download_cs_file(BUCKET_NAME, f"{GCS_PREFIX}/users.json", USERS_FILE)
-    except Exception:
-        pass
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE) as f:
-            return json.load(f)
-    return {}  # Return empty dict instead of None
-
-
-
-
-
-
-
-
+# one record per user, cached in memory; the old users.json is only read to migrate accounts
+USER_STORE = user_store.UserStore(
+    BUCKET_NAME,
+    GCS_PREFIX,
+    legacy_object=f"{GCS_PREFIX}/{USERS_FILE}",
+    ttl=int(os.environ.get("USER_CACHE_TTL", "300")),
+    # short, a user who just signed up on another instance must be able to log in here
+    negative_ttl=float(os.environ.get("USER_CACHE_NEGATIVE_TTL", "2")),
+)
 
+EXCEL_FILE = "questions.xlsx"
+# the built React app, indexed once with its precompressed variants
+STATIC_ASSETS = static_assets.StaticAssets(os.path.join(os.getcwd(), "client", "dist"))
+# questionnaire types, one folder per type with its questions.xlsx; no type means EXCEL_FILE
+QUESTIONNAIRES = questionnaire_registry.QuestionnaireIndex(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "questionnaires"),
+    default_path=EXCEL_FILE,
+)
+USER_DATA_DIR = "user_data"
+# keep a per-user _manifest.json so listing cases is a single small read
+USE_CASE_MANIFEST = os.environ.get("USE_CASE_MANIFEST") == "1"
+# local copies of user objects, only re-downloaded when their GCS generation changes
+OBJECT_CACHE = object_cache.ObjectCache(
+    BUCKET_NAME,
+    max_bytes=int(os.environ.get("OBJECT_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    revalidate_after=float(os.environ.get("OBJECT_CACHE_REVALIDATE_AFTER", "0")),
+)
+
+
+# chat history per (user, case); with CONVERSATION_SPILL=1 it is also kept in GCS so any instance can continue it
+CONVERSATIONS = conversation_store.ConversationStore(
+    max_entries=int(os.environ.get("CONVERSATION_MAX_ENTRIES", "1000")),
+    max_bytes=int(os.environ.get("CONVERSATION_MAX_MB", "64")) * 1024 * 1024,
+    ttl=int(os.environ.get("CONVERSATION_TTL", str(24 * 3600))),
+    spill_bucket=BUCKET_NAME if os.environ.get("CONVERSATION_SPILL") == "1" else None,
+    spill_prefix=f"{GCS_PREFIX}/conversations",
+)
+
+
+_openai_client = None
+_openai_lock = threading.Lock()
+
+
+def openai_client():
+    # openai is slow to import, so the client is created on first use (or by warm_up)
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                import openai
+                _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+
+def create_completion(**kwargs):
+    # every OpenAI call goes through here so it is timed as one phase
+    with request_timing.phase("chat.completions.create"):
+        return openai_client().chat.completions.create(model=CHAT_MODEL, **kwargs)
+
+
+def user_object_name(username, name):
+    return f"{GCS_PREFIX}/user_data/{username}/{name}"
+
+
+def on_object_uploaded(object_name, local_path, generation, metadata, sequence):
+    # runs on the uploader thread once the newest local write is in GCS; a write
+    # made since the upload was queued keeps the copy pinned
+    current = OBJECT_CACHE.record_write(object_name, local_path, generation, sequence)
+    if not case_manifest.is_case_object(object_name):
+        return
+    updated = datetime.now(timezone.utc).isoformat()
+    if USE_CASE_MANIFEST:
+        prefix = object_name.rsplit("/", 1)[0] + "/"
+        entry = case_manifest.case_entry(object_name, os.path.getsize(local_path), updated,
+                                         (metadata or {}).get("client_name"), generation)
+        case_manifest.record_case(BUCKET_NAME, prefix, entry)
+    if current:
+        # the indexed copy is the uploaded one, so loading the index need not read it again
+        username, name = object_name.rsplit("/", 2)[-2:]
+        SEARCH.uploaded(username, name[:-len(".json")], generation, updated)
+
+
+def on_object_conflict(object_name, local_path, metadata):
+    # a case was written on another instance after this one read it; its write is dropped,
+    # the stored case is read again and the client gets a 409 on its next save
+    OBJECT_CACHE.invalidate(object_name)
+    username, name = object_name.rsplit("/", 2)[-2:]
+    filename = name[:-len(".json")]
+    CASES.lost(username, filename)
+    document = read_case(username, filename)
+    if document is None:
+        SEARCH.remove(username, filename)
+        ANALYTICS.remove(username, filename)
+    else:
+        SEARCH.update(username, filename, document)
+        ANALYTICS.update(username, filename, document)
 
 
+# saves return after the local write; this uploads to GCS in the background
+UPLOADER = upload_queue.WriteBehindUploader(BUCKET_NAME, on_uploaded=on_object_uploaded,
+                                            base_generation=OBJECT_CACHE.base_generation,
+                                            on_conflict=on_object_conflict)
+UPLOADER.register_shutdown_flush()
 
-def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f)
+@request_timing.timed("load_questionnaire")
+def load_questionnaire(questionnaire_type=None):
+    # parsed once per workbook version, see questionnaire_registry
     try:
-        upload_cs_file(BUCKET_NAME, USERS_FILE, f"{GCS_PREFIX}/users.json")
-    except Exception:
-        pass
+        return QUESTIONNAIRES.get(questionnaire_type).sections_payload()
+    except (KeyError, FileNotFoundError):
+        return {"error": f"Questionnaire not found: {questionnaire_type or EXCEL_FILE}"}, 404
 
-USERS = load_users()
 
-EXCEL_FILE = "questions.xlsx"
-USER_DATA_DIR = "user_data"
+def summary_template(questionnaire_type):
+    # "personal_injury_case" -> the "personal_injury" summary template
+    qid = questionnaire_registry.questionnaire_id(questionnaire_type or summary_renderer.DEFAULT_TEMPLATE)
+    return qid[:-len("_case")] if qid.endswith("_case") else qid
 
-def load_questionnaire():
-    if not os.path.exists(EXCEL_FILE):
-        return {"error": "questions.xlsx not found"}, 404
-
-    sections_df = pd.read_excel(EXCEL_FILE, sheet_name="Sections")
-    questions_df = pd.read_excel(EXCEL_FILE, sheet_name="Questions")
-
-    # find nested level of conditional questions
-    # cond_questions = questions_df.loc[~questions_df["Conditional on question"].isna()]
-    # for _, row in cond_questions.iterrows():
-    #     this_id = row["Id"]
-    #     parent = row["Conditional on question"]
-    #     parent_id = parent.split(',')[0]
-    #     parent_row = questions_df[questions_df.Id == parent_id].values[0]
-    #     level = 1
-    #     while(parent_row is not None):
-    #         this_id = parent_row.Id
-    #         this_id = parent.split(',')[0]
-    #         parent = row["Conditional on question"]
-
-        
-
-
-    sections = []
-    for _, section in sections_df.iterrows():
-        sec_num = section["Section number"]
-        section_questions = questions_df[questions_df["Section"] == sec_num].sort_values(by="Question number")
-
-        questions = []
-        for _, q in section_questions.iterrows():
-            q = {
-                "id": q["Id"],
-                "label": q["Label"],
-                "type": q["Type"].lower().strip(),
-                "parameters": eval(q["Parameters"]) if pd.notna(q["Parameters"]) else None,
-                "conditional_on": str(q["Conditional on question"]) if pd.notna(q["Conditional on question"]) else None,
-                "mandatory": str(q["Mandatory"]).strip().lower() == "yes",
-                "slider": str(q["Needs a slider"]).strip().lower() == "yes",
-                "default_slider_value": float(q["Default value of slider"]) if pd.notna(q["Default value of slider"]) else None,
-                "level" : 1
-            }
-
-            questions.append(q)
-
-        sections.append({
-            "section_number": sec_num,
-            "title": section["Title"],
-            "questions": questions
-        })
-
-    return {"sections": sections}
-
-
-def compile_summary(answers, username=None):
-    html_parts = []
+
+def compile_summary(answers, username=None, template=None, fmt="html", questionnaire_type=None):
+    profile_text = ""
     if username:
         profile_path = os.path.join(USER_DATA_DIR, username, "profile.txt")
-        profile_text = ""
-        if os.path.exists(profile_path):
-            with open(profile_path) as pf:
-                profile_text = pf.read().strip()
-        if profile_text:
-            html_parts.append(f"<h2>Profile</h2><p>{profile_text}</p>")
-
-    html_parts.append("<ul>")
-    html_parts.append("<li>I need to evaluate a discrimination case. Together with the client, the lawyer filled out a questionnarie that describes the case</li>")
-    html_parts.append("<li>We are in the state of New York</li>")
-    html_parts.append("<li>The table below reports the answers to the questionnaire. The columns are as follows:</li>")
-    html_parts.append("<ul>")
-    html_parts.append("<li>Section: the name of the section in the questionnaire</li>")
-    html_parts.append("<li>Question: the question asked</li>")
-    html_parts.append("<li>Answer: the answer</li>")
-    html_parts.append("<li>Impact value: a number from 0 to 1 that indicates how favorable the answer to this question is in the context of obtaining a settlement, with 0 being very unfavorable, 0.5 neutral, and 1 being very favorable. This field is optional and a value of 0.5 indicates that the lawyer did not provide a value, possibly expressing an opinion of neutrality</li>")
-    html_parts.append("<li>Impact reason: the reason why the impact value is the one selected by the lawyer. This field is optional</li>")
-    html_parts.append("</ul>")
-    html_parts.append("</ul>")
-
-    data = load_questionnaire()
-    if isinstance(data, tuple):
-        data = data[0]
-    headers = ['Section','Question','Answer','Impact Value','Impact Reason'] #section title, label, answer, and text with an explanation of impact
-    dataset = [] # list of lists
-    for section in data.get("sections", []):
-        
-        # for each question in the section
-        for q in section.get("questions", []):
-            curq = []
-            curq.append(f"{section['title']}")
-            qid = str(q.get("id"))
-            if qid not in answers:
-                continue # exclude the empty answers from the table
-
-            curq.append(f"{q['label']}") #Question
-            curq.append(f'{answers[qid]}') #Answer
-
-            if "slider" in q and f"{qid}_slider" in answers:
-                slider_val = float(answers.get(f"{qid}_slider"))
-                curq.append(slider_val) #Impact Value
-            else:
-                curq.append(0.5)
-            
-            explanation = answers.get(f"{qid}_explanation")
-            if explanation:
-                curq.append(f"{explanation}") # Impact reason
-            else:
-                curq.append('')
-            
-            dataset.append(curq)
-            
-
-    df = pd.DataFrame(columns=headers,data=dataset) 
-    html_parts.append(df.to_html(index=False))
-    html_parts.append("Your output should be: ")
-    html_parts.append("<ol>") 
-    html_parts.append("<li>Summary of the case and assessment with citations to prior cases</li>")
-    html_parts.append("<li>Which statutes is this claim under, which common law cases is it under</li>")
-    html_parts.append("<li>Listing the weaknesses and strengths</li>")
-    html_parts.append("<li>Breakdown of the computation of the damages</li>")
-    html_parts.append("<li>Settlement recommendation</li>")
-    html_parts.append("<li>What court or agency (eg, human right agency)</li>")
-    html_parts.append("</ol>")
-    html_parts.append("IMPORTANT: Just produce the document, without anything else, like \"certainly! Here it is\" etc")
-    return "\n".join(html_parts)
+        content = OBJECT_CACHE.fetch(user_object_name(username, "profile.txt"), profile_path)
+        profile_text = storage_codec.decode_text(content).strip() if content is not None else ""
+
+    with request_timing.phase("load_questionnaire"):
+        compiled = QUESTIONNAIRES.get(questionnaire_type)
+    # answers left behind by questions that are hidden now are not part of the case
+    answers = compiled.graph.visible_answers(answers)
+    template = template or summary_template(questionnaire_type)
+    if fmt == "prompt":
+        # compact encoding sent to the model
+        return prompt_builder.case_prompt(compiled, answers, template, profile_text)
+    return summary_renderer.render(compiled, answers, template, profile_text, fmt)
 
 def compile_summary2(answers):
     data = load_questionnaire()
@@ -212,107 +212,665 @@ def compile_summary2(answers):
         html_parts.append("</ul>")
     return "\n".join(html_parts)
 
-@app.route("/api/questions", methods=["GET"])
+@api.route("/api/questions", methods=["GET"])
 def get_questions():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
-    return jsonify(load_questionnaire())
+    questionnaire_type = request.args.get("questionnaire_type")
+    try:
+        with request_timing.phase("load_questionnaire"):
+            compiled = QUESTIONNAIRES.get(questionnaire_type)
+    except KeyError:
+        return jsonify({"error": f"Questionnaire not found: {questionnaire_type or EXCEL_FILE}"}), 404
+    # encoded once per workbook version, a client with the current ETag gets a 304
+    etag = json_responses.versioned_etag(compiled.version, questionnaire_registry.PAYLOAD_VERSION, "sections")
+    return json_responses.cached_json(compiled.encoded, "sections", etag, compiled.sections_payload)
+
+
+@api.route("/api/questions/evaluate", methods=["POST"])
+def evaluate_questions():
+    '''Visible questions and missing mandatory answers for a set of answers, in one pass'''
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json() or {}
+    questionnaire_type = data.get("questionnaire_type")
+    try:
+        with request_timing.phase("load_questionnaire"):
+            compiled = QUESTIONNAIRES.get(questionnaire_type)
+    except KeyError:
+        return jsonify({"error": f"Questionnaire not found: {questionnaire_type or EXCEL_FILE}"}), 404
+    visible, missing = compiled.graph.evaluate(data.get("answers") or {})
+    return jsonify({
+        "visible": visible,
+        "missing_mandatory": missing,
+        "complete": not missing,
+        "levels": {qid: compiled.graph.level(qid) for qid in visible},
+    })
+
+
+# the questionnaire routes below were served by a separate app without a login, and still need none
+@api.route("/api/questionnaires", methods=["GET"])
+def get_questionnaires():
+    """Get list of available questionnaires"""
+    return jsonify({
+        'success': True,
+        'questionnaires': QUESTIONNAIRES.list()
+    })
+
+
+@api.route("/api/questionnaire/<questionnaire_type>", methods=["GET"])
+def get_questionnaire(questionnaire_type):
+    """Get questions from a specific questionnaire Excel file"""
+    try:
+        with request_timing.phase("load_questionnaire"):
+            compiled = QUESTIONNAIRES.get(questionnaire_type)
+    except KeyError:
+        return jsonify({
+            'success': False,
+            'error': f'Questionnaire not found: {questionnaire_type}'
+        }), 404
+    # ?shape=slim leaves out "sections", which repeats every question grouped by section
+    slim = request.args.get("shape") == "slim"
+
+    def build():
+        payload = {
+            'success': True,
+            'questionnaire_type': questionnaire_type,
+            'questions': compiled.questions,
+        }
+        if not slim:
+            payload['sections'] = compiled.sections_by_number
+        return payload
+
+    shape = "slim" if slim else "full"
+    etag = json_responses.versioned_etag(compiled.version, questionnaire_registry.PAYLOAD_VERSION, shape,
+                                         questionnaire_type)
+    return json_responses.cached_json(compiled.encoded, (shape, questionnaire_type), etag, build)
+
+
+@api.route("/api/submit-assessment", methods=["POST"])
+def submit_assessment():
+    """Submit completed case assessment"""
+    data = request.get_json() or {}
+    answers = data.get('answers') or {}
 
+    # Calculate some basic statistics
+    completed = sum(1 for a in answers.values() if isinstance(a, dict) and a.get('answer'))
+    total = len(answers)
 
-@app.route("/api/login", methods=["POST"])
+    return jsonify({
+        'success': True,
+        'message': 'Assessment submitted successfully',
+        'assessment_id': 'ASSESS-' + str(abs(hash(str(answers))))[:8],
+        'stats': {
+            'completed': completed,
+            'total': total,
+            'completion_rate': round((completed / total * 100), 1) if total > 0 else 0
+        }
+    })
+
+
+@api.route("/api/login", methods=["POST"])
 def login():
     data = request.get_json() or {}
     username = data.get("username")
     password = data.get("password")
-    hashed = USERS.get(username)
-    if hashed and check_password_hash(hashed, password):
+    if not isinstance(username, str) or not isinstance(password, str):
+        return jsonify({"success": False, "error": "Username and password must be strings"}), 400
+    try:
+        hashed = USER_STORE.password_hash(username)
+    except Exception:
+        return jsonify({"success": False, "error": "User store unavailable, please retry"}), 503
+    with request_timing.phase("check_password_hash"):
+        valid = bool(hashed) and check_password_hash(hashed, password)
+    if valid:
         session["user"] = username
         return jsonify({"success": True})
     return jsonify({"success": False, "error": "Invalid credentials"}), 401
 
 
-@app.route("/api/signup", methods=["POST"])
+@api.route("/api/signup", methods=["POST"])
 def signup():
     data = request.get_json() or {}
     username = data.get("username")
     password = data.get("password")
     if not username or not password:
         return jsonify({"error": "Username and password required"}), 400
-    if username in USERS:
+    if not isinstance(username, str) or not isinstance(password, str):
+        return jsonify({"error": "Username and password must be strings"}), 400
+    try:
+        with request_timing.phase("generate_password_hash"):
+            password_hash = generate_password_hash(password)
+        USER_STORE.create(username, password_hash)
+    except user_store.UserExistsError:
         return jsonify({"error": "User already exists"}), 400
-    USERS[username] = generate_password_hash(password)
-    save_users(USERS)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
     os.makedirs(os.path.join(USER_DATA_DIR, username), exist_ok=True)
     session["user"] = username
     return jsonify({"success": True})
 
 
-@app.route("/api/logout", methods=["POST"])
+@api.route("/api/logout", methods=["POST"])
 def logout():
     session.pop("user", None)
     return jsonify({"success": True})
 
 
-@app.route("/api/check_login", methods=["GET"])
+@api.route("/api/check_login", methods=["GET"])
 def check_login():
     return jsonify({"logged_in": "user" in session, "user": session.get("user")})
 
-@app.route("/api/config", methods=["GET"])
+@api.route("/api/config", methods=["GET"])
 def get_config():
-    return jsonify({"debug": app.config.get("DEBUG", False)})
+    return jsonify({"debug": current_app.config.get("DEBUG", False)})
 
 
-@app.route("/api/compile_summary", methods=["POST"])
+@api.route("/api/compile_summary", methods=["POST"])
 def compile_summary_route():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
     data = request.get_json() or {}
     answers = data.get("answers", {})
-    html = compile_summary(answers, session.get("user"))
-    global LAST_SUMMARY
-    LAST_SUMMARY = html
-    return jsonify({"html": html})
+    fmt = "text" if data.get("format") == "text" else "html"
+    questionnaire_type = data.get("questionnaire_type")
+    try:
+        summary = compile_summary(answers, session.get("user"), fmt=fmt, questionnaire_type=questionnaire_type)
+    except KeyError:
+        return jsonify({"error": f"Questionnaire not found: {questionnaire_type}"}), 404
+    # the chat of this case starts from the compact prompt
+    try:
+        prompt = compile_summary(answers, session["user"], fmt="prompt", questionnaire_type=questionnaire_type)
+        CONVERSATIONS.start(session["user"], data.get("case"), prompt)
+    except Exception:
+        current_app.logger.exception("could not start the conversation")
+    return jsonify({fmt: summary})
+
+
+# identical analyses (same model and messages) are answered from here
+LLM_CACHE = llm_cache.LLMCache(
+    max_entries=int(os.environ.get("LLM_CACHE_ENTRIES", "256")),
+    max_bytes=int(os.environ.get("LLM_CACHE_BYTES", str(32 * 1024 * 1024))),
+    ttl=int(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+    persist_dir=USER_DATA_DIR if os.environ.get("LLM_CACHE_PERSIST") == "1" else None,
+)
+
+
+def use_llm_cache(data):
+    # per-request bypass: {"cache": false} or Cache-Control: no-cache
+    return data.get("cache", True) is not False and "no-cache" not in request.headers.get("Cache-Control", "")
+
+
+def sse_event(data, event=None):
+    # format one Server-Sent Events message
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def completion_deltas(upstream, usage=None):
+    # text pieces of a streamed chat completion; the token counts of the
+    # final chunk are copied into usage
+    for chunk in upstream:
+        if usage is not None and getattr(chunk, "usage", None):
+            usage.update(usage_dict(chunk.usage))
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
 
 
-@app.route("/api/chat", methods=["POST"])
+def usage_dict(usage):
+    if usage is None:
+        return {}
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+
+def token_budget(data):
+    try:
+        return max(int(data.get("max_input_tokens") or PROMPT_TOKEN_BUDGET), 1)
+    except (TypeError, ValueError):
+        return PROMPT_TOKEN_BUDGET
+
+
+def fit_prompt(messages, data):
+    # compact the conversation into the request's token budget; returns (messages, report)
+    return prompt_builder.fit_messages(messages, token_budget(data), CHAT_MODEL)
+
+
+def token_report(report, usage):
+    # what is returned to the client about one call
+    TOKEN_STATS.record(report, usage)
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", report["prompt_tokens_estimate"]),
+        "completion_tokens": usage.get("completion_tokens"),
+        "original_prompt_tokens": report["original_prompt_tokens"],
+        "condensed_messages": report["condensed_messages"],
+        "truncated_messages": report["truncated_messages"],
+        "budget": report["budget"],
+    }
+
+
+def wants_stream(data):
+    return "text/event-stream" in request.headers.get("Accept", "") or bool(data.get("stream"))
+
+
+def stream_chat(messages, cache_key, use_cache, report, on_reply=None):
+    username = session["user"]
+    cached = LLM_CACHE.get(cache_key, username) if use_cache else None
+    if cached is not None:
+        if on_reply:
+            on_reply(cached)
+        events = [sse_event({"delta": cached, "cached": True}),
+                  sse_event({"done": True, "usage": token_report(report, {"prompt_tokens": 0, "completion_tokens": 0})},
+                            event="done")]
+        return Response(events, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    if not CHAT_STREAM_SLOTS.acquire(blocking=False):
+        return jsonify({"error": "Too many analyses in progress, please retry shortly"}), 503
+    try:
+        upstream = create_completion(
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+    except Exception as e:
+        CHAT_STREAM_SLOTS.release()
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        parts = []
+        usage = {}
+        try:
+            for delta in completion_deltas(upstream, usage):
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+            # only complete replies are cached and kept, not ones cut short by a disconnect
+            LLM_CACHE.put(cache_key, "".join(parts), username)
+            if on_reply:
+                on_reply("".join(parts))
+            yield sse_event({"done": True, "usage": token_report(report, usage)}, event="done")
+        except Exception as e:
+            yield sse_event({"error": str(e)}, event="error")
+
+    def close_upstream():
+        # called by the WSGI server when the response ends or the client goes away
+        try:
+            upstream.close()
+        finally:
+            CHAT_STREAM_SLOTS.release()
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(close_upstream)
+    return response
+
+
+@api.route("/api/chat", methods=["POST"])
 def chat():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
     data = request.get_json() or {}
+    username = session["user"]
+    case = data.get("case")
     messages = data.get("messages", [])
-    global LAST_SUMMARY
-    if not messages and LAST_SUMMARY:
-        messages = [{"role": "user", "content": LAST_SUMMARY}]
+    on_reply = None
+    if not messages:
+        # the history is kept on the server, the client sends only the new message
+        history = CONVERSATIONS.get(username, case)
+        if not history:
+            return jsonify({"error": "No summary compiled for this case"}), 400
+        message = (data.get("message") or "").strip()
+        # an empty message (re)runs the analysis of the case prompt
+        turn = [{"role": "user", "content": message}] if message else []
+        messages = history + turn if message else history[:1]
+
+        def on_reply(reply):
+            try:
+                CONVERSATIONS.append(username, case, turn + [{"role": "assistant", "content": reply}],
+                                     restart=not message)
+            except Exception:
+                current_app.logger.exception("could not save the conversation")
+
+    messages, report = fit_prompt(messages, data)
+    key = llm_cache.cache_key(CHAT_MODEL, messages)
+    use_cache = use_llm_cache(data)
+    if wants_stream(data):
+        return stream_chat(messages, key, use_cache, report, on_reply)
+    cached = LLM_CACHE.get(key, username) if use_cache else None
+    if cached is not None:
+        if on_reply:
+            on_reply(cached)
+        usage = token_report(report, {"prompt_tokens": 0, "completion_tokens": 0})
+        return jsonify({"reply": cached, "cached": True, "usage": usage})
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4.1",
+        completion = create_completion(
             messages=messages,
         )
         reply = completion.choices[0].message.content
-        return jsonify({"reply": reply})
+        LLM_CACHE.put(key, reply, username)
+        if on_reply:
+            on_reply(reply)
+        return jsonify({"reply": reply, "usage": token_report(report, usage_dict(completion.usage))})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/profile", methods=["GET"])
+def run_analysis(job, on_delta):
+    # runs on an analysis worker thread
+    key = llm_cache.cache_key(CHAT_MODEL, job.messages)
+    cached = LLM_CACHE.get(key, job.user) if job.meta.get("cache", True) else None
+    report = job.pop_meta("prompt_report")
+    if cached is not None:
+        job.update_meta(cached=True)
+        if report:
+            job.update_meta(usage=token_report(report, {"prompt_tokens": 0, "completion_tokens": 0}))
+        on_delta(cached)
+        return
+    upstream = create_completion(
+        messages=job.messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parts = []
+    usage = {}
+    try:
+        for delta in completion_deltas(upstream, usage):
+            parts.append(delta)
+            on_delta(delta)
+    finally:
+        upstream.close()
+    if report:
+        job.update_meta(usage=token_report(report, usage))
+    LLM_CACHE.put(key, "".join(parts), job.user)
+
+
+def job_record_path(username, job_id):
+    return os.path.join(USER_DATA_DIR, username, "jobs", f"{job_id}.json")
+
+
+def save_job_record(record):
+    # finished jobs are kept outside the user_data prefix so they don't show up in list_answers
+    file_path = job_record_path(record["user"], record["job_id"])
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump(record, f)
+    try:
+        upload_cs_file(BUCKET_NAME, file_path, f"{GCS_PREFIX}/jobs/{record['user']}/{record['job_id']}.json")
+    except Exception:
+        pass
+
+
+def load_job_record(username, job_id):
+    if not all(c in "0123456789abcdef" for c in job_id):
+        return None
+    file_path = job_record_path(username, job_id)
+    if not os.path.exists(file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        try:
+            download_cs_file(BUCKET_NAME, f"{GCS_PREFIX}/jobs/{username}/{job_id}.json", file_path)
+        except Exception:
+            return None
+    with open(file_path) as f:
+        return json.load(f)
+
+
+ANALYSIS_QUEUE = analysis_jobs.AnalysisQueue(
+    run_analysis,
+    workers=int(os.environ.get("ANALYSIS_WORKERS", "4")),
+    max_queued=int(os.environ.get("ANALYSIS_MAX_QUEUED", "100")),
+    on_finished=save_job_record,
+)
+
+
+# batch analyses share one cap on concurrent model calls and one rate limit (calls per second)
+BATCHES = batch_analysis.BatchRunner(
+    model_concurrency=int(os.environ.get("BATCH_MODEL_CONCURRENCY", "4")),
+    rate=float(os.environ.get("BATCH_MODEL_RATE", "2")),
+    burst=int(os.environ.get("BATCH_MODEL_BURST", "4")),
+    load_workers=int(os.environ.get("BATCH_LOAD_WORKERS", "16")),
+    max_cases=int(os.environ.get("BATCH_MAX_CASES", "200")),
+)
+
+
+@api.route("/api/batch_analysis", methods=["POST"])
+def batch_analysis_route():
+    '''
+    Analyse a list of saved cases. The results are streamed as Server-Sent
+    Events: one "case" event per case as it finishes (status, reply or error,
+    timing, usage), then a "done" event with the counts.
+    '''
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json() or {}
+    filenames = data.get("filenames")
+    if not isinstance(filenames, list) or not filenames or not all(isinstance(f, str) and f for f in filenames):
+        return jsonify({"error": "Filenames required"}), 400
+    if len(filenames) > BATCHES.max_cases:
+        return jsonify({"error": f"At most {BATCHES.max_cases} cases per batch"}), 400
+    questionnaire_type = data.get("questionnaire_type")
+    try:
+        QUESTIONNAIRES.get(questionnaire_type)
+    except KeyError:
+        return jsonify({"error": f"Questionnaire not found: {questionnaire_type}"}), 404
+    try:
+        concurrency = int(data["concurrency"]) if data.get("concurrency") else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "concurrency must be a number"}), 400
+    username = session["user"]
+    use_cache = use_llm_cache(data)
+
+    def analyse(case):
+        # runs on a batch thread, outside the request context
+        with case.phase("load"):
+            document = read_case(username, case.name)
+        if document is None:
+            raise LookupError("File not found")
+        answers, client_info = document["answers"], document["clientInfo"]
+        with case.phase("compile"):
+            prompt = compile_summary(answers, username, fmt="prompt", questionnaire_type=questionnaire_type)
+            messages, report = fit_prompt([{"role": "user", "content": prompt}], data)
+        key = llm_cache.cache_key(CHAT_MODEL, messages)
+        reply = LLM_CACHE.get(key, username) if use_cache else None
+        result = {"client_name": (client_info or {}).get("clientName")}
+        if reply is not None:
+            result["cached"] = True
+            usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        else:
+            with case.model_call():
+                completion = create_completion(messages=messages)
+            reply = completion.choices[0].message.content
+            usage = usage_dict(completion.usage)
+            LLM_CACHE.put(key, reply, username)
+        result["reply"] = reply
+        result["usage"] = token_report(report, usage)
+        return result
+
+    cancelled = threading.Event()
+
+    def generate():
+        started = time.perf_counter()
+        counts = {}
+        results = BATCHES.run(filenames, analyse, concurrency, cancelled)
+        try:
+            for result in results:
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+                yield sse_event(result, event="case")
+        finally:
+            results.close()
+        yield sse_event({"done": True, "cases": counts, "elapsed": round(time.perf_counter() - started, 4)},
+                        event="done")
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    # cases not started yet are skipped when the client goes away
+    response.call_on_close(cancelled.set)
+    return response
+
+
+@api.route("/api/batch_analysis/stats", methods=["GET"])
+def batch_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(BATCHES.stats())
+
+
+@api.route("/api/llm_cache/stats", methods=["GET"])
+def llm_cache_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(LLM_CACHE.stats())
+
+
+@api.route("/api/prompt/stats", methods=["GET"])
+def prompt_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(TOKEN_STATS.to_dict())
+
+
+@api.route("/api/conversations/stats", methods=["GET"])
+def conversation_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(CONVERSATIONS.stats())
+
+
+@api.route("/api/storage/stats", methods=["GET"])
+def storage_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(google_storage_utility.get_stats())
+
+
+@api.route("/api/object_cache/stats", methods=["GET"])
+def object_cache_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(OBJECT_CACHE.stats())
+
+
+@api.route("/api/uploads/stats", methods=["GET"])
+def upload_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(UPLOADER.stats())
+
+
+@api.route("/api/jobs", methods=["POST"])
+def submit_job():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json() or {}
+    messages = data.get("messages") or []
+    if not messages and data.get("answers"):
+        try:
+            prompt = compile_summary(data["answers"], session["user"], fmt="prompt",
+                                     questionnaire_type=data.get("questionnaire_type"))
+        except KeyError:
+            return jsonify({"error": f"Questionnaire not found: {data.get('questionnaire_type')}"}), 404
+        messages = [{"role": "user", "content": prompt}]
+    if not messages:
+        history = CONVERSATIONS.get(session["user"], data.get("case"))
+        messages = history[:1] if history else []
+    if not messages:
+        return jsonify({"error": "Nothing to analyse"}), 400
+    messages, report = fit_prompt(messages, data)
+    try:
+        meta = {"filename": data.get("filename"), "cache": use_llm_cache(data), "prompt_report": report}
+        job = ANALYSIS_QUEUE.submit(session["user"], messages, meta)
+    except analysis_jobs.QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"job_id": job.id, "status": job.status, "position": ANALYSIS_QUEUE.position(job)}), 202
+
+
+@api.route("/api/jobs", methods=["GET"])
+def list_jobs():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    jobs = sorted(ANALYSIS_QUEUE.jobs_for(session["user"]), key=lambda j: j.created_at, reverse=True)
+    return jsonify({"jobs": [job.to_dict(include_text=False) for job in jobs]})
+
+
+@api.route("/api/jobs/stats", methods=["GET"])
+def job_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(ANALYSIS_QUEUE.stats())
+
+
+@api.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    job = ANALYSIS_QUEUE.get(job_id)
+    if job is None or job.user != session["user"]:
+        record = load_job_record(session["user"], job_id)
+        if record is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(record)
+    record = job.to_dict()
+    record["position"] = ANALYSIS_QUEUE.position(job)
+    return jsonify(record)
+
+
+@api.route("/api/jobs/<job_id>/stream", methods=["GET"])
+def stream_job(job_id):
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    # resume from the last received character offset after a reconnect
+    offset = request.headers.get("Last-Event-ID") or request.args.get("offset") or 0
+    try:
+        offset = int(offset)
+    except ValueError:
+        offset = 0
+    job = ANALYSIS_QUEUE.get(job_id)
+    if job is None or job.user != session["user"]:
+        record = load_job_record(session["user"], job_id)
+        if record is None:
+            return jsonify({"error": "Job not found"}), 404
+        text = record.get("reply", "")[offset:]
+        events = []
+        if text:
+            events.append(f"id: {offset + len(text)}\n" + sse_event({"delta": text}))
+        events.append(sse_event({"status": record["status"], "error": record.get("error")}, event="done"))
+        return Response(events, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    def generate():
+        position = offset
+        while True:
+            text, finished = job.wait_for_change(position, timeout=15)
+            if text:
+                position += len(text)
+                yield f"id: {position}\n" + sse_event({"delta": text})
+            elif finished:
+                yield sse_event({"status": job.status, "error": job.error}, event="done")
+                return
+            else:
+                # keep-alive comment while the job is queued or slow
+                yield ": waiting\n\n"
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@api.route("/api/profile", methods=["GET"])
 def get_profile():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
     user_dir = os.path.join(USER_DATA_DIR, session["user"])
     os.makedirs(user_dir, exist_ok=True)
     file_path = os.path.join(user_dir, "profile.txt")
-    try:
-        download_cs_file(BUCKET_NAME, f"{GCS_PREFIX}/user_data/{session['user']}/profile.txt", file_path)
-    except Exception:
-        pass
-    profile_text = ""
-    if os.path.exists(file_path):
-        with open(file_path) as f:
-            profile_text = f.read()
+    content = OBJECT_CACHE.fetch(user_object_name(session["user"], "profile.txt"), file_path)
+    profile_text = storage_codec.decode_text(content) if content is not None else ""
     return jsonify({"profile": profile_text})
 
 
-@app.route("/api/profile", methods=["POST"])
+@api.route("/api/profile", methods=["POST"])
 def save_profile():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
@@ -321,16 +879,52 @@ def save_profile():
     user_dir = os.path.join(USER_DATA_DIR, session["user"])
     os.makedirs(user_dir, exist_ok=True)
     file_path = os.path.join(user_dir, "profile.txt")
-    with open(file_path, "w") as f:
-        f.write(text)
-    try:
-        upload_cs_file(BUCKET_NAME, file_path, f"{GCS_PREFIX}/user_data/{session['user']}/profile.txt")
-    except Exception:
-        pass
+    content, encoding = storage_codec.encode_text(text)
+    object_name = user_object_name(session["user"], "profile.txt")
+    # pinned until the uploader reports the new generation
+    with OBJECT_CACHE.local_write(object_name, file_path) as sequence:
+        upload_queue.durable_write(file_path, content)
+    UPLOADER.enqueue(object_name, file_path, content_encoding=encoding, sequence=sequence)
     return jsonify({"success": True})
 
 
-@app.route("/api/save_answers", methods=["POST"])
+# seconds during which saves of the same case are uploaded to GCS as one object write
+SAVE_COALESCE_SECONDS = float(os.environ.get("SAVE_COALESCE_SECONDS", "2"))
+
+
+def read_saved_case(username, filename):
+    # stored data of a case in any of its formats, None if there is no such case
+    user_dir = os.path.join(USER_DATA_DIR, username)
+    os.makedirs(user_dir, exist_ok=True)
+    file_path = os.path.join(user_dir, f"{filename}.json")
+    content = OBJECT_CACHE.fetch(user_object_name(username, f"{filename}.json"), file_path)
+    # compressed or not, see storage_codec
+    return storage_codec.decode_json(content) if content is not None else None
+
+
+def write_saved_case(username, filename, document, conditional=False):
+    user_dir = os.path.join(USER_DATA_DIR, username)
+    os.makedirs(user_dir, exist_ok=True)
+    file_path = os.path.join(user_dir, f"{filename}.json")
+    content, encoding = storage_codec.encode_json(document)
+    client_name = (document.get("clientInfo") or {}).get("clientName") or ""
+    object_name = user_object_name(username, f"{filename}.json")
+    # pinned until the uploader reports the new generation
+    with OBJECT_CACHE.local_write(object_name, file_path) as sequence:
+        upload_queue.durable_write(file_path, content)
+    # rapid edits of a case are coalesced into one upload per window; a versioned write only replaces
+    # the generation it was based on, see on_object_conflict
+    UPLOADER.enqueue(object_name, file_path, metadata={"client_name": client_name}, delay=SAVE_COALESCE_SECONDS,
+                     content_encoding=encoding, sequence=sequence, conditional=conditional)
+    SEARCH.update(username, filename, document)
+    ANALYTICS.update(username, filename, document)
+
+
+# versioned case documents, saved whole or patched
+CASES = case_documents.CaseDocuments(read_saved_case, write_saved_case)
+
+
+@api.route("/api/save_answers", methods=["POST"])
 def save_answers():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
@@ -340,68 +934,290 @@ def save_answers():
     client_info = data.get("clientInfo")
     if not filename:
         return jsonify({"error": "Filename required"}), 400
-    user_dir = os.path.join(USER_DATA_DIR, session["user"])
-    os.makedirs(user_dir, exist_ok=True)
-    file_path = os.path.join(user_dir, f"{filename}.json")
-    # Save both answers and client info
-    save_data = {
-        "answers": answers,
-        "clientInfo": client_info
-    }
-    with open(file_path, "w") as f:
-        json.dump(save_data, f)
+    # without a version the save overwrites whatever is stored
     try:
-        upload_cs_file(BUCKET_NAME, file_path, f"{GCS_PREFIX}/user_data/{session['user']}/{filename}.json")
-    except Exception:
-        pass
-    return jsonify({"success": True})
+        document = CASES.save(session["user"], filename, answers, client_info, data.get("version"))
+    except case_documents.VersionConflict as e:
+        return jsonify({"error": str(e), "version": e.version}), 409
+    except (TypeError, ValueError):
+        return jsonify({"error": "version must be a number"}), 400
+    return jsonify({"success": True, "version": document["version"]})
+
+
+@api.route("/api/answers", methods=["PATCH"])
+def patch_answers():
+    '''
+    Apply JSON-patch style operations to a saved case, e.g.
+    {"filename": "smith", "version": 3, "ops": [{"op": "replace", "path": "/answers/q1", "value": "Yes"}]}.
+    Answers 409 with the current version if the case is no longer at "version".
+    '''
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json() or {}
+    filename = data.get("filename")
+    if not filename:
+        return jsonify({"error": "Filename required"}), 400
+    if "version" not in data:
+        return jsonify({"error": "version required"}), 400
+    try:
+        document = CASES.patch(session["user"], filename, data["version"], data.get("ops"))
+    except case_documents.VersionConflict as e:
+        return jsonify({"error": str(e), "version": e.version}), 409
+    except LookupError:
+        return jsonify({"error": "File not found"}), 404
+    except case_documents.PatchError as e:
+        return jsonify({"error": str(e)}), 400
+    except (TypeError, ValueError):
+        return jsonify({"error": "version must be a number"}), 400
+    return jsonify({"success": True, "version": document["version"]})
+
+
+@api.route("/api/answers/stats", methods=["GET"])
+def answer_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(CASES.stats())
 
 
-@app.route("/api/list_answers", methods=["GET"])
+@api.route("/api/list_answers", methods=["GET"])
 def list_answers():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
     prefix = f"{GCS_PREFIX}/user_data/{session['user']}/"
+    page_size = request.args.get("page_size", 100, type=int)
+    page_token = request.args.get("page_token")
     try:
-        all_files = list_cs_files(BUCKET_NAME)
+        cases, next_page_token = case_manifest.list_cases(BUCKET_NAME, prefix, page_size, page_token,
+                                                          use_manifest=USE_CASE_MANIFEST)
     except Exception:
-        all_files = []
-    files = [os.path.splitext(os.path.basename(f))[0] for f in all_files if f.startswith(prefix)]
-    return jsonify({"files": files})
+        cases, next_page_token = [], None
+    return jsonify({
+        "files": [case["name"] for case in cases],
+        "cases": cases,
+        "next_page_token": next_page_token,
+    })
+
+
+def read_case(username, filename):
+    '''The {"answers", "clientInfo", "version"} document of a saved case, None if there is no such case'''
+    return CASES.load(username, filename)
 
 
-@app.route("/api/load_answers", methods=["GET"])
+@api.route("/api/load_answers", methods=["GET"])
 def load_answers():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
     filename = request.args.get("filename")
     if not filename:
         return jsonify({"error": "Filename required"}), 400
-    user_dir = os.path.join(USER_DATA_DIR, session["user"])
-    os.makedirs(user_dir, exist_ok=True)
-    file_path = os.path.join(user_dir, f"{filename}.json")
+    document = read_case(session["user"], filename)
+    if document is None:
+        return jsonify({"error": "File not found"}), 404
+    return jsonify({
+        "answers": document["answers"],
+        "clientInfo": document["clientInfo"],
+        "version": document["version"]
+    })
+
+
+# saved cases read at the same time by one export
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "8"))
+
+
+def read_case_uncached(username, filename):
+    # straight from GCS without a local copy, or from the local file while an upload of it is pending
+    object_name = user_object_name(username, f"{filename}.json")
+    if UPLOADER.is_pending(object_name):
+        file_path = os.path.join(USER_DATA_DIR, username, f"{filename}.json")
+        with open(file_path, "rb") as f:
+            content = f.read()
+    else:
+        try:
+            content, _ = google_storage_utility.read_cs_object(BUCKET_NAME, object_name)
+        except NotFound:
+            return None
+    return case_documents.normalise(storage_codec.decode_json(content))
+
+
+def case_listing(username):
+    # every saved case of a user ({"name", "size", "updated", "client_name"}), one listing page at a time
+    prefix = f"{GCS_PREFIX}/user_data/{username}/"
+    page_token = None
+    while True:
+        cases, page_token = case_manifest.list_cases(BUCKET_NAME, prefix, 100, page_token,
+                                                     use_manifest=USE_CASE_MANIFEST)
+        yield from cases
+        if not page_token:
+            return
+
+
+def case_names(username):
+    return (case["name"] for case in case_listing(username))
+
+
+SEARCH_INDEX_NAME = "_search_index.json"
+
+
+def load_search_index(username):
+    file_path = os.path.join(USER_DATA_DIR, username, SEARCH_INDEX_NAME)
+    content = OBJECT_CACHE.fetch(user_object_name(username, SEARCH_INDEX_NAME), file_path)
+    return storage_codec.decode_json(content) if content is not None else None
+
+
+def save_search_index(username, data):
+    file_path = os.path.join(USER_DATA_DIR, username, SEARCH_INDEX_NAME)
+    content, encoding = storage_codec.encode_json(data)
+    object_name = user_object_name(username, SEARCH_INDEX_NAME)
+    with OBJECT_CACHE.local_write(object_name, file_path) as sequence:
+        upload_queue.durable_write(file_path, content)
+    UPLOADER.enqueue(object_name, file_path, content_encoding=encoding, sequence=sequence)
+
+
+# per-user full-text index of the saved cases, loaded on a user's first search
+SEARCH = case_search.CaseSearch(
+    load_search_index,
+    save_search_index,
+    case_listing,
+    read_case_uncached,
+    persist_delay=float(os.environ.get("SEARCH_PERSIST_SECONDS", "30")),
+    max_users=int(os.environ.get("SEARCH_MAX_USERS", "200")),
+    # seconds after which a loaded index is reconciled with the listing again, for saves on other instances
+    reconcile_after=float(os.environ.get("SEARCH_RECONCILE_SECONDS", "60")),
+)
+
+
+@api.route("/api/search", methods=["GET"])
+def search_cases():
+    '''Saved cases matching ?q=, best first, with a snippet of the matching text'''
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        return jsonify({"error": "q required"}), 400
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    started = time.perf_counter()
     try:
-        download_cs_file(BUCKET_NAME, f"{GCS_PREFIX}/user_data/{session['user']}/{filename}.json", file_path)
-    except Exception:
-        if not os.path.exists(file_path):
-            return jsonify({"error": "File not found"}), 404
-    with open(file_path) as f:
-        data = json.load(f)
-    # Handle both old format (just answers) and new format (with clientInfo)
-    if isinstance(data, dict) and "answers" in data:
-        return jsonify({
-            "answers": data.get("answers", {}),
-            "clientInfo": data.get("clientInfo")
-        })
+        results = SEARCH.search(session["user"], query, limit)
+    except Exception as e:
+        current_app.logger.exception("search failed")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({
+        "query": query,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+@api.route("/api/search/rebuild", methods=["POST"])
+def rebuild_search_index():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"success": True, "cases": SEARCH.rebuild(session["user"])})
+
+
+@api.route("/api/search/stats", methods=["GET"])
+def search_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(SEARCH.stats())
+
+
+@api.route("/api/export", methods=["GET"])
+def export_cases():
+    '''
+    Every saved case of the user as a ZIP archive (?format=zip, the default)
+    or as NDJSON (?format=ndjson), streamed while the cases are read.
+    ?summary=html or ?summary=text adds the compiled summary of each case.
+    '''
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    fmt = request.args.get("format", "zip")
+    if fmt not in case_export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(case_export.FORMATS)}"}), 400
+    summary_format = request.args.get("summary")
+    if summary_format not in (None, "", "html", "text"):
+        return jsonify({"error": "summary must be html or text"}), 400
+    questionnaire_type = request.args.get("questionnaire_type")
+    try:
+        QUESTIONNAIRES.get(questionnaire_type)
+    except KeyError:
+        return jsonify({"error": f"Questionnaire not found: {questionnaire_type}"}), 404
+    username = session["user"]
+
+    summarise = None
+    if summary_format:
+        def summarise(document):
+            return compile_summary(document["answers"], username, fmt=summary_format,
+                                   questionnaire_type=questionnaire_type)
+
+    records = case_export.export_records(case_names(username), lambda name: read_case_uncached(username, name),
+                                         workers=EXPORT_WORKERS, summarise=summarise)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    if fmt == "zip":
+        body = case_export.zip_stream(case_export.zip_entries(records, "txt" if summary_format == "text" else "html"))
+        mimetype, extension = "application/zip", "zip"
     else:
-        # Old format - just answers
-        return jsonify({
-            "answers": data,
-            "clientInfo": None
-        })
+        body = case_export.ndjson_stream(records)
+        mimetype, extension = "application/x-ndjson", "ndjson"
+    response = Response(body, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="cases-{stamp}.{extension}"'
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def read_cases(username, names):
+    # (name, document or None) of the cases, read concurrently and yielded in order
+    for name, document, error in case_export.ordered_map(lambda n: read_case_uncached(username, n), names,
+                                                         EXPORT_WORKERS):
+        yield name, document if error is None else None
+
+
+# impact values and answers of every case as NumPy columns, per user and questionnaire
+ANALYTICS = case_analytics.CaseAnalytics(
+    case_listing,
+    read_cases,
+    max_users=int(os.environ.get("ANALYTICS_MAX_USERS", "100")),
+)
+
+
+@api.route("/api/analytics", methods=["GET"])
+def analytics():
+    '''
+    Aggregates over the user's saved cases for a questionnaire: impact
+    distributions, answer frequencies and, with ?outcome=<slider question> or
+    ?outcome=<question>=<answer>, their relation to that outcome.
+    ?questions=a,b limits the questions, ?filter=<question>=<answer> (repeatable)
+    the cases, ?bins= sets the histogram size.
+    '''
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    questionnaire_type = request.args.get("questionnaire_type")
+    try:
+        compiled = QUESTIONNAIRES.get(questionnaire_type)
+    except KeyError:
+        return jsonify({"error": f"Questionnaire not found: {questionnaire_type or EXCEL_FILE}"}), 404
+    questions = [q for q in (request.args.get("questions") or "").split(",") if q.strip()]
+    bins = max(1, min(request.args.get("bins", 10, type=int), 100))
+    started = time.perf_counter()
+    try:
+        result = ANALYTICS.aggregate(session["user"], compiled, questions=[q.strip() for q in questions],
+                                     outcome=request.args.get("outcome") or None,
+                                     filters=request.args.getlist("filter"), bins=bins)
+    except case_analytics.AnalyticsError as e:
+        return jsonify({"error": str(e)}), 400
+    result["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(result)
 
 
-@app.route("/api/delete_answers", methods=["POST"])
+@api.route("/api/analytics/stats", methods=["GET"])
+def analytics_stats():
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(ANALYTICS.stats())
+
+
+@api.route("/api/delete_answers", methods=["POST"])
 def delete_answers():
     if "user" not in session:
         return jsonify({"error": "Unauthorized"}), 401
@@ -411,31 +1227,99 @@ def delete_answers():
         return jsonify({"error": "Filename required"}), 400
     user_dir = os.path.join(USER_DATA_DIR, session["user"])
     file_path = os.path.join(user_dir, f"{filename}.json")
+    prefix = f"{GCS_PREFIX}/user_data/{session['user']}/"
+    UPLOADER.cancel(f"{prefix}{filename}.json")
     try:
-        delete_cs_file(BUCKET_NAME, f"{GCS_PREFIX}/user_data/{session['user']}/{filename}.json")
+        delete_cs_file(BUCKET_NAME, f"{prefix}{filename}.json")
+    except Exception:
+        pass
+    if USE_CASE_MANIFEST:
+        try:
+            case_manifest.forget_case(BUCKET_NAME, prefix, filename)
+        except Exception:
+            pass
+    OBJECT_CACHE.invalidate(f"{prefix}{filename}.json", file_path)
+    SEARCH.remove(session["user"], filename)
+    ANALYTICS.remove(session["user"], filename)
+    try:
+        CONVERSATIONS.forget(session["user"], filename)
     except Exception:
         pass
-    if os.path.exists(file_path):
-        os.remove(file_path)
     return jsonify({"success": True})
 
-@app.route("/", defaults={"path": ""})
-@app.route("/<path:path>")
+@api.route("/", defaults={"path": ""})
+@api.route("/<path:path>")
 def serve_react(path):
-    static_folder = os.path.join(os.getcwd(), "client", "dist")
-    file_path = os.path.join(static_folder, path)
-
-    if path != "" and os.path.exists(file_path):
-        return send_from_directory(static_folder, path)
-    elif os.path.exists(os.path.join(static_folder, "index.html")):
-        return send_from_directory(static_folder, "index.html")
-    else:
+    response = STATIC_ASSETS.response(path)
+    if response is None:
         return "React frontend not found. Did you run 'npm run build'?", 404
+    return response
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def handle_404(e):
     return serve_react("")
 
+
+def warm_up():
+    '''
+    Create everything that is otherwise created on first use: the OpenAI and
+    storage clients, the parsed questionnaires, the legacy user list and the
+    tokenizer. Returns the milliseconds each step took.
+    '''
+    steps = [
+        ("openai", openai_client),
+        ("storage", google_storage_utility.get_client),
+        ("questionnaires", lambda: [QUESTIONNAIRES.get(q["id"]) for q in QUESTIONNAIRES.list()] + [QUESTIONNAIRES.get()]),
+        ("users", USER_STORE.warm),
+        ("tokenizer", lambda: prompt_builder.count_tokens("warm up", CHAT_MODEL)),
+    ]
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+            timings[name] = round((time.perf_counter() - start) * 1000, 1)
+        except Exception:
+            current_app.logger.exception("warm-up step %s failed", name)
+            timings[name] = "failed"
+    return timings
+
+
+@api.route("/_ah/warmup", methods=["GET"])
+def warmup_route():
+    # warm-up request, e.g. from a startup probe, before real traffic arrives
+    return jsonify(warm_up())
+
+
+def create_app(warm_up_mode=None):
+    '''
+    Build the Flask app. Nothing slow happens here; the heavy dependencies are
+    initialised on first use. WARM_UP=background (or warm_up_mode) runs
+    warm_up() on a thread as soon as the app is created, WARM_UP=sync runs it
+    before returning, which is what the module-level setup used to do.
+    '''
+    app = Flask(__name__)
+    CORS(app, supports_credentials=True)  # Enable CORS
+    app.secret_key = os.environ.get("SECRET_KEY", "randomstring")
+    app.register_blueprint(api)
+    # Server-Timing headers and /metrics, only with REQUEST_TIMING=1
+    request_timing.init_app(app, google_storage_utility)
+    app.after_request(json_responses.compress_response)
+
+    warm_up_mode = warm_up_mode or os.environ.get("WARM_UP", "")
+    if warm_up_mode == "sync":
+        with app.app_context():
+            warm_up()
+    elif warm_up_mode == "background":
+        def run():
+            with app.app_context():
+                warm_up()
+        threading.Thread(target=run, name="warm-up", daemon=True).start()
+    return app
+
+
+app = create_app()
+
 # extra comment
 if __name__ == "__main__":
     #app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
@@ -0,0 +1,163 @@
+'''
+This file contains the batch runner for analysing many saved cases at once,
+e.g. re-scoring a docket after the prompt changed. The cases of a batch are
+loaded and compiled concurrently; the model calls of every batch in the
+process share one concurrency cap and one rate limit, so a large batch
+cannot starve the interactive chat of its OpenAI quota. Results are yielded
+as each case finishes, in completion order.
+'''
+# import packages
+import contextlib
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class RateLimiter:
+    '''
+    Token bucket allowing rate acquisitions per second on average and up to
+    burst at once. A rate of 0 or less means no limit.
+    '''
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cancelled=None):
+        '''Wait for a token; returns False if cancelled (an Event) was set first'''
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                delay = (1 - self._tokens) / self.rate
+            if cancelled is not None:
+                if cancelled.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+
+class BatchCase:
+    '''One case of a batch, passed to the process function'''
+
+    def __init__(self, name, runner, slots, cancelled):
+        self.name = name
+        # phase -> seconds
+        self.timing = {}
+        self._runner = runner
+        self._slots = slots
+        self._cancelled = cancelled
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing[name] = self.timing.get(name, 0.0) + time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def model_call(self):
+        '''Hold a model slot of the batch and of the process, within the rate limit'''
+        start = time.perf_counter()
+        with self._slots, self._runner.slots:
+            if not self._runner.limiter.acquire(self._cancelled):
+                raise BatchCancelled()
+            self.timing["queued"] = time.perf_counter() - start
+            with self.phase("model"):
+                yield
+
+
+class BatchCancelled(Exception):
+    pass
+
+
+class BatchRunner:
+    '''
+    model_concurrency and rate (calls per second) are shared by all batches;
+    load_workers is the number of cases of one batch processed at the same
+    time, most of them waiting for storage or for a model slot.
+    '''
+
+    def __init__(self, model_concurrency=4, rate=2.0, burst=4, load_workers=16, max_cases=200):
+        self.model_concurrency = model_concurrency
+        self.slots = threading.BoundedSemaphore(model_concurrency)
+        self.limiter = RateLimiter(rate, burst)
+        self.load_workers = load_workers
+        self.max_cases = max_cases
+        self._lock = threading.Lock()
+        self._running_batches = 0
+        self._finished = {DONE: 0, FAILED: 0, CANCELLED: 0}
+
+    def run(self, names, process, concurrency=None, cancelled=None):
+        '''
+        Yield one result per name as the cases finish. process(case) does the
+        work of one BatchCase, using case.phase() and case.model_call(), and
+        returns a dict merged into its result; an exception fails that case
+        only. Setting cancelled (an Event) skips the cases not started yet.
+        '''
+        cancelled = cancelled or threading.Event()
+        concurrency = min(concurrency or self.model_concurrency, self.model_concurrency)
+        # a batch asking for less concurrency than the process allows holds fewer model slots
+        batch_slots = threading.BoundedSemaphore(max(concurrency, 1))
+        names = list(dict.fromkeys(names))
+
+        def work(name):
+            case = BatchCase(name, self, batch_slots, cancelled)
+            start = time.perf_counter()
+            result = {"filename": name}
+            if cancelled.is_set():
+                result["status"] = CANCELLED
+                return result
+            try:
+                result.update(process(case) or {})
+                result["status"] = DONE
+            except BatchCancelled:
+                result["status"] = CANCELLED
+            except Exception as e:
+                result["status"] = FAILED
+                result["error"] = str(e)
+            case.timing["total"] = time.perf_counter() - start
+            result["timing"] = {k: round(v, 4) for k, v in case.timing.items()}
+            return result
+
+        with self._lock:
+            self._running_batches += 1
+        pool = ThreadPoolExecutor(max(min(self.load_workers, len(names)), 1), thread_name_prefix="batch-case")
+        try:
+            pending = {pool.submit(work, name) for name in names}
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    result = future.result()
+                    with self._lock:
+                        self._finished[result["status"]] += 1
+                    yield result
+        finally:
+            # the client went away: no new cases start, running ones finish their current call
+            cancelled.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            with self._lock:
+                self._running_batches -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running_batches": self._running_batches,
+                "model_concurrency": self.model_concurrency,
+                "rate": self.limiter.rate,
+                "cases": dict(self._finished),
+            }
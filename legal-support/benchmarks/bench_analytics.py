@@ -0,0 +1,153 @@
+'''
+Benchmark of the cross-case analytics: an aggregate query (impact
+distributions, answer frequencies and their relation to an outcome) over
+a user's cases, computed by looping over the case documents in Python
+against case_analytics' NumPy columns.
+
+The loop is timed twice: over documents already decoded in memory, and
+over the stored JSON, decoded for every query as it would be without a
+cache. For the columns, building them (ingesting every case), writing one
+saved case into its row and the vectorised query are timed separately.
+Both sides apply the questionnaire's visibility conditions, and the counts
+and means they return are checked to agree.
+
+Run from the legal-support directory:
+    python benchmarks/bench_analytics.py [--cases 10000] [--queries 20]
+'''
+import argparse
+import collections
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import case_analytics  # noqa: E402
+import questionnaire_registry  # noqa: E402
+from bench_storage import synthetic_case  # noqa: E402
+
+
+def analytics_case(compiled, rng, **kwargs):
+    # yes/no questions have no options in the workbook, answer them as the client does
+    document = synthetic_case(compiled, rng, **kwargs)
+    for section in compiled.sections:
+        for q in section["questions"]:
+            options = case_analytics._choice_options(q)
+            if options and document["answers"].get(q["id"]) not in options:
+                document["answers"][q["id"]] = rng.choice(options)
+    return document
+
+
+def naive_aggregate(compiled, slider_ids, choice_ids, documents, outcome, bins=10):
+    # the same aggregate, one case and one question at a time
+    question, _, expected = outcome.partition("=")
+    impacts = collections.defaultdict(list)
+    answers = collections.defaultdict(collections.Counter)
+    outcome_sums = collections.defaultdict(collections.Counter)
+    cases = 0
+    for document in documents:
+        visible = compiled.graph.visible_answers(document.get("answers") or {})
+        answered = False
+        y = None if visible.get(question) in (None, "") else float(str(visible[question]) == expected)
+        for qid in slider_ids:
+            value = visible.get(f"{qid}_slider")
+            if value is not None:
+                impacts[qid].append((float(value), y))
+                answered = True
+        for qid in choice_ids:
+            value = visible.get(qid)
+            if value not in (None, ""):
+                answers[qid][str(value)] += 1
+                if y is not None:
+                    outcome_sums[qid][str(value)] += y
+                answered = True
+        cases += answered
+    stats = {}
+    for qid, pairs in impacts.items():
+        values = sorted(v for v, _ in pairs)
+        mean = statistics.fmean(values)
+        histogram = [0] * bins
+        for v in values:
+            histogram[min(max(int(math.floor(v * bins)), 0), bins - 1)] += 1
+        known = [(v, y) for v, y in pairs if y is not None]
+        try:
+            correlation = statistics.correlation(*zip(*known))
+        except (statistics.StatisticsError, ValueError):
+            # fewer than two cases, or a constant column
+            correlation = None
+        stats[qid] = {"count": len(values), "mean": mean, "std": statistics.pstdev(values),
+                      "median": statistics.median(values), "histogram": histogram, "correlation": correlation}
+    frequencies = {qid: {value: (count, outcome_sums[qid][value] / count) for value, count in counter.items()}
+                   for qid, counter in answers.items()}
+    return {"cases": cases, "impact": stats, "answers": frequencies}
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    compiled = questionnaire_registry.get_questionnaire("questions.xlsx")
+    rng = random.Random(args.seed)
+    documents = [analytics_case(compiled, rng, explained_share=0.1, words=(10, 40)) for _ in range(args.cases)]
+    stored = [json.dumps(document) for document in documents]
+
+    start = time.perf_counter()
+    columns = case_analytics.CaseColumns(compiled)
+    for i, document in enumerate(documents):
+        columns.set(f"case-{i}", document["answers"])
+    build = time.perf_counter() - start
+    outcome = next(f"{qid}=Yes" for qid in columns.choice_ids if "Yes" in columns.codes[qid])
+
+    updates = []
+    for i in rng.sample(range(args.cases), min(200, args.cases)):
+        document = analytics_case(compiled, rng, explained_share=0.0)
+        start = time.perf_counter()
+        columns.set(f"case-{i}", document["answers"])
+        updates.append(time.perf_counter() - start)
+        documents[i] = document
+        stored[i] = json.dumps(document)
+
+    vectorised, vectorised_time = timed(lambda: columns.aggregate(outcome=outcome), args.queries)
+    naive, naive_time = timed(lambda: naive_aggregate(compiled, columns.slider_ids, columns.choice_ids,
+                                                       documents, outcome), max(args.queries // 5, 1))
+    _, decoded_time = timed(lambda: naive_aggregate(compiled, columns.slider_ids, columns.choice_ids,
+                                                     (json.loads(s) for s in stored), outcome),
+                            max(args.queries // 5, 1))
+
+    assert vectorised["cases"] == naive["cases"]
+    for qid, entry in naive["impact"].items():
+        assert vectorised["impact"][qid]["count"] == entry["count"], qid
+        assert abs(vectorised["impact"][qid]["mean"] - entry["mean"]) < 1e-4, qid
+    for qid, values in naive["answers"].items():
+        for value, (count, _) in values.items():
+            assert vectorised["answers"][qid]["counts"][value] == count, (qid, value)
+
+    nbytes = columns.impacts.nbytes + columns.choices.nbytes + columns.valid.nbytes
+    print(f"{args.cases} cases, {len(columns.slider_ids)} impact and {len(columns.choice_ids)} answer columns "
+          f"({nbytes / 1e6:.1f} MB), outcome {outcome}")
+    print(f"columns: build {build:.2f} s ({build / args.cases * 1e6:.0f} us/case), "
+          f"update {statistics.median(updates) * 1e6:.0f} us/case")
+    print(f"{'query':<24} {'time':>10} {'speedup':>8}")
+    for name, seconds in (("loop, stored JSON", decoded_time), ("loop, decoded", naive_time),
+                          ("columns, vectorised", vectorised_time)):
+        print(f"{name:<24} {seconds * 1e3:>7.1f} ms {decoded_time / seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+'''
+Benchmark of /api/chat time-to-first-byte, blocking vs Server-Sent Events,
+against the local fake OpenAI server. Also checks that closing a stream early
+cancels the upstream call. Requests bypass the LLM cache, which would
+otherwise replay the first reply; replies served from it are timed
+separately.
+
+Run from the legal-support directory:
+    python benchmarks/bench_chat_stream.py
+'''
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_openai  # noqa: E402
+
+fake_server, base_url = fake_openai.serve(token_delay=0.01, first_token_delay=0.2)
+os.environ["OPENAI_BASE_URL"] = base_url
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import app as legal_app  # noqa: E402
+
+
+def start_app():
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, legal_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_port
+
+
+def login_cookie():
+    with legal_app.app.test_request_context():
+        from flask import session
+        session["user"] = "bench"
+        resp = legal_app.app.make_response("")
+        legal_app.app.session_interface.save_session(legal_app.app, session, resp)
+        return resp.headers["Set-Cookie"].split(";")[0]
+
+
+def request_chat(port, cookie, stream, read_events=None, cache=False):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json", "Cookie": cookie}
+    if stream:
+        headers["Accept"] = "text/event-stream"
+    body = json.dumps({"messages": [{"role": "user", "content": "analyse this case"}], "cache": cache})
+    start = time.perf_counter()
+    conn.request("POST", "/api/chat", body=body, headers=headers)
+    resp = conn.getresponse()
+    resp.read(1)
+    ttfb = time.perf_counter() - start
+    if read_events is None:
+        resp.read()
+    else:
+        for _ in range(read_events):
+            resp.readline()
+    total = time.perf_counter() - start
+    conn.close()
+    return ttfb, total
+
+
+def main():
+    port = start_app()
+    cookie = login_cookie()
+    for label, stream in (("blocking", False), ("event-stream", True)):
+        ttfb, total = request_chat(port, cookie, stream)
+        print(f"{label:<21} ttfb {ttfb * 1e3:8.1f} ms   total {total * 1e3:8.1f} ms")
+    # stored by the first request, answered from the cache by the others
+    request_chat(port, cookie, False, cache=True)
+    for label, stream in (("blocking, cached", False), ("event-stream, cached", True)):
+        ttfb, total = request_chat(port, cookie, stream, cache=True)
+        print(f"{label:<21} ttfb {ttfb * 1e3:8.1f} ms   total {total * 1e3:8.1f} ms")
+
+    before = fake_server.stats["cancelled_streams"]
+    request_chat(port, cookie, True, read_events=4)
+    time.sleep(0.5)
+    cancelled = fake_server.stats["cancelled_streams"] - before
+    print(f"upstream calls cancelled after client disconnect: {cancelled}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+'''
+Load benchmark of app.py. The app runs on a threaded local server with GCS
+replaced by the in-process fake (fake_gcs) and OpenAI by the local fake
+server (fake_openai), so no bucket or API key is needed and the numbers
+only depend on the app and the configured backend latencies.
+
+Every route is driven on its own by --concurrency clients, each logged in as
+its own user, for --requests requests; a final "mixed" phase interleaves
+them. For each phase the p50/p95/p99 latency, throughput and errors are
+reported. --save writes the results as JSON and --baseline compares against
+such a file, so a regression shows up as a number.
+
+Run from the legal-support directory:
+    python benchmarks/bench_load.py --concurrency 16 --requests 400
+    python benchmarks/bench_load.py --save before.json
+    python benchmarks/bench_load.py --baseline before.json
+'''
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests  # noqa: E402
+
+import fake_gcs  # noqa: E402
+import fake_openai  # noqa: E402
+
+
+def percentile(values, q):
+    # nearest-rank percentile of a sorted list
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+def sample_answers(compiled):
+    answers = {}
+    for section in compiled.sections:
+        for i, q in enumerate(section["questions"]):
+            answers[str(q["id"])] = "Yes" if i % 2 else "A longer free text answer about the case"
+            if q.get("slider"):
+                answers[f"{q['id']}_slider"] = 0.7
+                answers[f"{q['id']}_explanation"] = "Supported by documents"
+    return answers
+
+
+class Client:
+    '''One logged-in user with its own HTTP session'''
+
+    def __init__(self, base_url, username, answers):
+        self.base_url = base_url
+        self.username = username
+        self.password = "bench-password"
+        self.answers = answers
+        self.http = requests.Session()
+        self.counter = 0
+
+    def get(self, path, **kwargs):
+        return self.http.get(self.base_url + path, **kwargs)
+
+    def post(self, path, body=None, **kwargs):
+        return self.http.post(self.base_url + path, json=body or {}, **kwargs)
+
+
+# route name -> function(client) returning a response
+ROUTES = {
+    "login": lambda c: c.post("/api/login", {"username": c.username, "password": c.password}),
+    "check_login": lambda c: c.get("/api/check_login"),
+    "questions": lambda c: c.get("/api/questions"),
+    "questionnaires": lambda c: c.get("/api/questionnaires"),
+    "questionnaire_type": lambda c: c.get("/api/questionnaire/personal_injury_case"),
+    "profile_get": lambda c: c.get("/api/profile"),
+    "profile_post": lambda c: c.post("/api/profile", {"profile": f"Law firm of {c.username}"}),
+    "save_answers": lambda c: c.post("/api/save_answers", {
+        "filename": f"case{c.counter % 10}", "answers": c.answers, "clientInfo": {"clientName": "Client"}}),
+    "list_answers": lambda c: c.get("/api/list_answers"),
+    "load_answers": lambda c: c.get("/api/load_answers", params={"filename": f"case{c.counter % 10}"}),
+    "compile_summary": lambda c: c.post("/api/compile_summary", {"answers": c.answers, "case": "case0"}),
+    "chat": lambda c: c.post("/api/chat", {"case": "case0", "message": f"question {c.counter}", "cache": False}),
+    "chat_stream": lambda c: c.post("/api/chat", {"case": "case0", "message": f"question {c.counter}",
+                                                  "cache": False, "stream": True}),
+    "submit_assessment": lambda c: c.post("/api/submit-assessment", {
+        "questionnaire_type": "discrimination_case", "answers": {"q1": {"answer": "Yes"}}}),
+    "delete_answers": lambda c: c.post("/api/delete_answers", {"filename": f"scratch{c.counter}"}),
+}
+
+# relative frequency of each route in the mixed phase
+MIX = {
+    "check_login": 5, "questions": 10, "save_answers": 20, "load_answers": 10, "list_answers": 10,
+    "compile_summary": 5, "chat": 3, "profile_get": 5, "login": 2, "questionnaires": 2,
+}
+
+
+def run_phase(clients, names, total):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    per_client = max(total // len(clients), 1)
+
+    def worker(client):
+        nonlocal errors
+        local = []
+        failed = 0
+        for _ in range(per_client):
+            name = random.choice(names)
+            client.counter += 1
+            start = time.perf_counter()
+            try:
+                response = ROUTES[name](client)
+                # read the whole body, streamed responses included
+                response.content
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            local.append(time.perf_counter() - start)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        list(pool.map(worker, clients))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p95_ms": percentile(latencies, 95) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def start_app(args):
+    fake_server, openai_url = fake_openai.serve(token_delay=args.token_delay,
+                                                first_token_delay=args.first_token_delay)
+    os.environ["OPENAI_BASE_URL"] = openai_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("CHAT_STREAM_SLOTS", str(args.concurrency * 2))
+
+    import app as legal_app
+    import case_manifest
+    storage = fake_gcs.install(latency=args.gcs_latency, modules=[legal_app, case_manifest])
+    # keep the local copies of user files out of the working tree
+    legal_app.USER_DATA_DIR = os.path.join(tempfile.mkdtemp(prefix="bench-load-"), "user_data")
+
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, legal_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return legal_app, storage, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per phase")
+    parser.add_argument("--gcs-latency", type=float, default=0.02, help="seconds per fake GCS call")
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--routes", help="comma separated subset of: " + ", ".join(ROUTES))
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --save")
+    args = parser.parse_args()
+
+    legal_app, storage, base_url = start_app(args)
+    answers = sample_answers(legal_app.QUESTIONNAIRES.get())
+    clients = []
+    for i in range(args.concurrency):
+        client = Client(base_url, f"bench{i}", answers)
+        client.post("/api/signup", {"username": client.username, "password": client.password}).raise_for_status()
+        # the first save, compile and profile give every route something to read
+        client.post("/api/save_answers", {"filename": "case0", "answers": answers}).raise_for_status()
+        client.post("/api/compile_summary", {"answers": answers, "case": "case0"}).raise_for_status()
+        clients.append(client)
+
+    names = args.routes.split(",") if args.routes else list(ROUTES)
+    results = {}
+    for name in names:
+        results[name] = run_phase(clients, [name], args.requests)
+    if not args.routes:
+        mixed = [name for name, weight in MIX.items() for _ in range(weight)]
+        results["mixed"] = run_phase(clients, mixed, args.requests)
+    legal_app.UPLOADER.flush(timeout=30)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print(f"concurrency {args.concurrency}, {args.requests} requests per phase, "
+          f"GCS latency {args.gcs_latency * 1e3:.0f} ms")
+    header = f"{'route':<20}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+    print(header + ("   p95 vs baseline" if baseline else ""))
+    for name, r in results.items():
+        line = (f"{name:<20}{r['requests']:>9}{r['errors']:>8}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+                f"{r['p99_ms']:>10.1f}{r['throughput']:>10.1f}")
+        if name in baseline and baseline[name]["p95_ms"]:
+            line += f"   {(r['p95_ms'] / baseline[name]['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+    print(f"fake GCS calls: {dict(sorted(storage.calls.items()))}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
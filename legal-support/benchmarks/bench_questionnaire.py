@@ -0,0 +1,45 @@
+'''
+Benchmark of the questionnaire parse cost per request.
+
+Compares parsing questions.xlsx on every call (what /api/questions and
+compile_summary used to do) with serving it from questionnaire_registry.
+
+Run from the legal-support directory:
+    python benchmarks/bench_questionnaire.py [iterations]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import questionnaire_registry  # noqa: E402
+
+WORKBOOKS = [
+    "questions.xlsx",
+    os.path.join("questionnaires", "Discrimination case", "questions.xlsx"),
+    os.path.join("questionnaires", "Personal injury case", "questions.xlsx"),
+]
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'workbook':<55} {'parse/request':>14} {'registry hit':>14} {'speedup':>10}")
+    for path in WORKBOOKS:
+        if not os.path.exists(path):
+            continue
+        uncached = timed(lambda: questionnaire_registry.compile_workbook(path), iterations)
+        questionnaire_registry.get_questionnaire(path)  # warm the cache
+        cached = timed(lambda: questionnaire_registry.get_questionnaire(path), iterations * 1000)
+        print(f"{path:<55} {uncached * 1e3:>11.2f} ms {cached * 1e6:>11.2f} us {uncached / cached:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
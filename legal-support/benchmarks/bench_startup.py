@@ -0,0 +1,76 @@
+'''
+Cold start benchmark of app.py. Every sample is a fresh Python process that
+imports the app and then serves its first requests through the test client:
+a trivial one (/api/check_login), the first questionnaire (/api/questions,
+which parses the workbook) and the first chat call, answered by the local
+fake OpenAI server.
+
+The WARM_UP modes are compared: "" (lazy, the default), "background" and
+"sync", which initialises everything before the app is returned as the old
+module-level setup did. GCS is not faked here, so the storage and user list
+warm-up steps fail fast without credentials.
+
+Run from the legal-support directory:
+    python benchmarks/bench_startup.py [samples]
+'''
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_openai  # noqa: E402
+
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, ".")
+import app as legal_app
+imported = time.perf_counter()
+heavy = [m for m in ("pandas", "openai", "google.cloud.storage") if m in sys.modules]
+client = legal_app.app.test_client()
+client.get("/api/check_login")
+first_response = time.perf_counter()
+with client.session_transaction() as s:
+    s["user"] = "bench"
+client.get("/api/questions")
+first_questions = time.perf_counter()
+client.post("/api/chat", json={"messages": [{"role": "user", "content": "hello"}], "cache": False})
+first_chat = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "first_response": first_response - start,
+    "first_questions": first_questions - start,
+    "first_chat": first_chat - start,
+    "heavy_at_import": heavy,
+}))
+'''
+
+
+def sample(mode, base_url):
+    env = dict(os.environ, WARM_UP=mode, OPENAI_API_KEY="fake", OPENAI_BASE_URL=base_url)
+    started = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - started
+    return result
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    server, base_url = fake_openai.serve()
+    columns = ("import", "first_response", "first_questions", "first_chat", "process")
+    print(f"{'WARM_UP':<12}" + "".join(f"{c:>17}" for c in columns))
+    for mode in ("", "background", "sync"):
+        results = [sample(mode, base_url) for _ in range(samples)]
+        medians = [statistics.median(r[c] for r in results) * 1e3 for c in columns]
+        print(f"{mode or 'lazy':<12}" + "".join(f"{m:>14.0f} ms" for m in medians))
+    print(f"heavy modules imported by 'import app' in lazy mode: {sample('', base_url)['heavy_at_import'] or 'none'}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
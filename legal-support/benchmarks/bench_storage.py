@@ -0,0 +1,107 @@
+'''
+Benchmark of the storage format of saved cases: bytes stored and load
+latency of the previous format (json.dumps, uncompressed) against
+storage_codec with each compression it supports.
+
+The cases answer every question of questions.xlsx, with free-text
+explanations of a few hundred words on a share of them, as long client
+narratives do. Load latency is what a cache miss costs: one GCS read, the
+transfer of the stored bytes at --bandwidth and decoding. The read latency
+and bandwidth are modelled, encoding and decoding are measured.
+
+Run from the legal-support directory:
+    python benchmarks/bench_storage.py [--cases 200] [--latency 0.03] [--bandwidth 20]
+'''
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import questionnaire_registry  # noqa: E402
+import storage_codec  # noqa: E402
+
+WORDS = ("the client was employer manager meeting told email complaint colleague after before because "
+         "weeks months promotion salary reduced hours dismissed warning doctor stress anxiety leave "
+         "witness written verbal said asked refused again never always office team report HR policy "
+         "pregnant disability race age grievance appeal contract notice pay holiday overtime shift").split()
+
+
+def narrative(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def synthetic_case(compiled, rng, explained_share=0.3, words=(40, 400)):
+    answers = {}
+    for section in compiled.sections:
+        for q in section["questions"]:
+            qid = q["id"]
+            options = q["parameters"] if isinstance(q["parameters"], list) else None
+            answers[qid] = rng.choice(options) if options else narrative(rng, rng.randint(3, 30))
+            if q["slider"]:
+                answers[f"{qid}_slider"] = round(rng.random(), 2)
+                if rng.random() < explained_share:
+                    answers[f"{qid}_explanation"] = narrative(rng, rng.randint(*words))
+    client_info = {"clientName": f"Client {rng.randint(1, 10 ** 6)}", "notes": narrative(rng, 300)}
+    return {"answers": answers, "clientInfo": client_info, "version": 1}
+
+
+def legacy_encode(document):
+    # how save_answers wrote cases before storage_codec
+    return json.dumps(document).encode("utf-8"), None
+
+
+def legacy_decode(data):
+    return json.loads(data)
+
+
+def formats():
+    yield "json (before)", legacy_encode, legacy_decode
+    yield "codec, none", lambda d: storage_codec.encode_json(d, "none"), storage_codec.decode_json
+    yield "codec, gzip", lambda d: storage_codec.encode_json(d, "gzip"), storage_codec.decode_json
+    if storage_codec._load_zstd():
+        yield "codec, zstd", lambda d: storage_codec.encode_json(d, "zstd"), storage_codec.decode_json
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds per GCS read")
+    parser.add_argument("--bandwidth", type=float, default=20.0, help="MB/s per GCS read")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    compiled = questionnaire_registry.get_questionnaire("questions.xlsx")
+    rng = random.Random(args.seed)
+    cases = [synthetic_case(compiled, rng) for _ in range(args.cases)]
+    print(f"{args.cases} cases, orjson {'on' if storage_codec._load_orjson() else 'off'}, "
+          f"zstandard {'on' if storage_codec._load_zstd() else 'off'}; "
+          f"read latency {args.latency * 1e3:.0f} ms, {args.bandwidth:.0f} MB/s")
+    print(f"{'format':<15} {'bytes/case':>11} {'ratio':>6} {'encode':>10} {'decode':>10} {'load p50':>10} {'load p95':>10}")
+    baseline = None
+    for name, encode, decode in formats():
+        sizes, encode_times, decode_times, loads = [], [], [], []
+        for document in cases:
+            start = time.perf_counter()
+            data, _ = encode(document)
+            encode_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            assert decode(data) == document
+            decoded = time.perf_counter() - start
+            decode_times.append(decoded)
+            sizes.append(len(data))
+            loads.append(args.latency + len(data) / (args.bandwidth * 1e6) + decoded)
+        mean_size = statistics.mean(sizes)
+        baseline = baseline or mean_size
+        loads.sort()
+        print(f"{name:<15} {mean_size:>11,.0f} {baseline / mean_size:>5.1f}x "
+              f"{statistics.mean(encode_times) * 1e6:>7.0f} us {statistics.mean(decode_times) * 1e6:>7.0f} us "
+              f"{loads[len(loads) // 2] * 1e3:>7.2f} ms {loads[int(len(loads) * 0.95) - 1] * 1e3:>7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+'''
+Micro-benchmark of the case summary: the previous pandas DataFrame.to_html
+path against summary_renderer, for the real questionnaire and for synthetic
+large ones.
+
+Run from the legal-support directory:
+    python benchmarks/bench_summary.py [iterations]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import questionnaire_registry  # noqa: E402
+import summary_renderer  # noqa: E402
+
+
+def legacy_table(compiled, answers):
+    # the answer table as compile_summary built it before summary_renderer
+    headers = ['Section', 'Question', 'Answer', 'Impact Value', 'Impact Reason']
+    dataset = []
+    for section in compiled.sections:
+        for q in section.get("questions", []):
+            qid = str(q.get("id"))
+            if qid not in answers:
+                continue
+            row = [f"{section['title']}", f"{q['label']}", f'{answers[qid]}']
+            if "slider" in q and f"{qid}_slider" in answers:
+                row.append(float(answers.get(f"{qid}_slider")))
+            else:
+                row.append(0.5)
+            explanation = answers.get(f"{qid}_explanation")
+            row.append(f"{explanation}" if explanation else '')
+            dataset.append(row)
+    return pd.DataFrame(columns=headers, data=dataset).to_html(index=False)
+
+
+def synthetic(sections, per_section):
+    secs = []
+    for s in range(sections):
+        questions = [{"id": f"q{s}_{i}", "label": f"Question {i} of section {s} <with markup>", "type": "text",
+                      "conditional_on": None, "mandatory": False, "slider": True}
+                     for i in range(per_section)]
+        secs.append({"section_number": s + 1, "title": f"Section {s}", "questions": questions})
+    # built like a parsed workbook, so the graph and the question levels are filled in
+    graph = questionnaire_registry._build_graph(secs, [])
+    return questionnaire_registry.CompiledQuestionnaire(
+        f"synthetic-{sections}x{per_section}", "v1", None, secs, [], {}, graph)
+
+
+def answers_for(compiled):
+    answers = {}
+    for section in compiled.sections:
+        for i, q in enumerate(section["questions"]):
+            answers[q["id"]] = "Yes" if i % 2 else "Long free text answer & more"
+            answers[f"{q['id']}_slider"] = 0.3
+            answers[f"{q['id']}_explanation"] = "Because of the documented history"
+    return answers
+
+
+def timed(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    cases = [("questions.xlsx", questionnaire_registry.get_questionnaire("questions.xlsx"))]
+    cases += [(f"synthetic {s}x{q}", synthetic(s, q)) for s, q in ((10, 50), (50, 100))]
+    print(f"{'questionnaire':<22} {'rows':>6} {'pandas':>11} {'html':>11} {'text':>11} {'speedup':>8}")
+    for name, compiled in cases:
+        answers = answers_for(compiled)
+        rows = sum(1 for _ in summary_renderer.answer_rows(compiled, answers))
+        legacy = timed(lambda: legacy_table(compiled, answers), iterations)
+        new_html = timed(lambda: summary_renderer.render_html(compiled, answers), iterations)
+        new_text = timed(lambda: summary_renderer.render_text(compiled, answers), iterations)
+        print(f"{name:<22} {rows:>6} {legacy * 1e3:>8.2f} ms {new_html * 1e3:>8.2f} ms "
+              f"{new_text * 1e3:>8.2f} ms {legacy / new_html:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+'''
+In-process fake of google_storage_utility, for benchmarks and manual testing
+without a bucket or credentials.
+
+Objects live in a dict keyed by name, with generations, custom metadata and
+the same NotFound / NotModified / PreconditionFailed behaviour as the real
+helpers. Every call sleeps for a configurable latency (plus random jitter),
+so code that makes many small requests looks as slow as it is.
+
+    import fake_gcs
+    storage = fake_gcs.install(latency=0.02, modules=[app, case_manifest])
+'''
+import random
+import threading
+import time
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+import google_storage_utility
+
+# function -> operation name in google_storage_utility's stats
+FUNCTIONS = {
+    "create_bucket": "create_bucket",
+    "upload_cs_file": "upload",
+    "upload_directory_to_cs": "upload_directory",
+    "list_cs_files": "list",
+    "list_cs_page": "list_page",
+    "read_cs_object": "read",
+    "write_cs_object": "write",
+    "download_cs_file": "download",
+    "delete_cs_file": "delete",
+}
+
+
+class FakeStorage:
+    '''
+    latency is seconds per call; jitter is the fraction of it added at random.
+    calls holds the number of calls per function.
+    '''
+
+    def __init__(self, latency=0.0, jitter=0.2):
+        self.latency = latency
+        self.jitter = jitter
+        # name -> (bytes, generation, metadata, updated)
+        self.objects = {}
+        self.calls = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency * (1 + random.random() * self.jitter))
+
+    def put(self, name, data, metadata=None, if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            current = self.objects.get(name)
+            if if_generation_match is not None and (current[1] if current else 0) != if_generation_match:
+                raise PreconditionFailed(f"{name} is not at generation {if_generation_match}")
+            self._generation += 1
+            updated = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+            self.objects[name] = (data, self._generation, dict(metadata or {}), updated)
+            return self._generation
+
+    def _get(self, name):
+        with self._lock:
+            entry = self.objects.get(name)
+        if entry is None:
+            raise NotFound(name)
+        return entry
+
+    # the functions of google_storage_utility; the bucket name is ignored
+
+    def create_bucket(self, bucket_name, storage_class="STANDARD", location="us-central1"):
+        self._call("create_bucket")
+        return f"Bucket {bucket_name} successfully created."
+
+    def upload_cs_file(self, bucket_name, source_file_name, destination_file_name, metadata=None,
+                       content_encoding=None, if_generation_match=None):
+        self._call("upload_cs_file")
+        with open(source_file_name, "rb") as f:
+            return self.put(destination_file_name, f.read(), metadata, if_generation_match=if_generation_match)
+
+    def upload_directory_to_cs(self, bucket_name, source_folder, destination_blob_prefix=""):
+        self._call("upload_directory_to_cs")
+
+    def list_cs_files(self, bucket_name):
+        self._call("list_cs_files")
+        with self._lock:
+            return sorted(self.objects)
+
+    def list_cs_page(self, bucket_name, prefix, delimiter="/", page_size=100, page_token=None):
+        self._call("list_cs_page")
+        with self._lock:
+            names = sorted(n for n in self.objects
+                           if n.startswith(prefix) and not (delimiter and delimiter in n[len(prefix):]))
+            page = [n for n in names if page_token is None or n > page_token][:page_size]
+            objects = [{"name": n, "size": len(self.objects[n][0]), "updated": self.objects[n][3],
+                        "generation": self.objects[n][1], "metadata": self.objects[n][2]} for n in page]
+        next_token = page[-1] if page and page[-1] != names[-1] else None
+        return objects, next_token
+
+    def read_cs_object(self, bucket_name, file_name, if_generation_not_match=None):
+        self._call("read_cs_object")
+        data, generation, _, _ = self._get(file_name)
+        if if_generation_not_match is not None and generation == if_generation_not_match:
+            return None, generation
+        return data, generation
+
+    def write_cs_object(self, bucket_name, file_name, data, content_type="application/json", if_generation_match=None):
+        self._call("write_cs_object")
+        return self.put(file_name, data, if_generation_match=if_generation_match)
+
+    def download_cs_file(self, bucket_name, file_name, destination_file_name):
+        self._call("download_cs_file")
+        data = self._get(file_name)[0]
+        with open(destination_file_name, "wb") as f:
+            f.write(data)
+
+    def delete_cs_file(self, bucket_name, file_name):
+        self._call("delete_cs_file")
+        with self._lock:
+            if self.objects.pop(file_name, None) is None:
+                raise NotFound(file_name)
+        return True
+
+    def get_client(self):
+        return self
+
+
+def install(latency=0.0, jitter=0.2, modules=()):
+    '''
+    Replace the functions of google_storage_utility with a new FakeStorage,
+    and the copies that modules imported with "from google_storage_utility
+    import ...". Calls are recorded in google_storage_utility's stats and
+    observers like the real ones. Returns the FakeStorage.
+    '''
+    storage = FakeStorage(latency, jitter)
+    replacements = {name: google_storage_utility._timed(operation)(getattr(storage, name))
+                    for name, operation in FUNCTIONS.items()}
+    replacements["get_client"] = storage.get_client
+    for module in (google_storage_utility,) + tuple(modules):
+        for name, fn in replacements.items():
+            if hasattr(module, name):
+                setattr(module, name, fn)
+    return storage
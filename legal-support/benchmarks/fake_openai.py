@@ -0,0 +1,160 @@
+'''
+Local fake of the OpenAI chat completions endpoint, for benchmarks and manual
+testing without an API key.
+
+Supports POST /v1/chat/completions with and without "stream": true, and the
+final usage chunk of stream_options.include_usage. The reply
+is a fixed canned analysis emitted one word per token with a configurable
+delay, so time-to-first-byte and total latency behave like the real model.
+
+Run standalone:
+    python benchmarks/fake_openai.py --port 8765 --token-delay 0.02
+and point the app at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python app.py
+'''
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = ("Summary of the case: the client alleges discrimination by the employer. "
+         "Strengths and weaknesses are listed below, followed by a damages breakdown "
+         "and a settlement recommendation. ") * 4
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # set by serve()
+    token_delay = 0.0
+    first_token_delay = 0.0
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, key):
+        with self.stats["lock"]:
+            self.stats[key] += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        self._count("requests")
+        tokens = REPLY.split(" ")
+        model = body.get("model", "fake")
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        time.sleep(self.first_token_delay)
+
+        if not body.get("stream"):
+            time.sleep(self.token_delay * len(tokens))
+            payload = json.dumps({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": REPLY},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                },
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": token + ("" if i == len(tokens) - 1 else " ")},
+                        "finish_reason": None,
+                    }],
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                time.sleep(self.token_delay)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(tokens),
+                        "total_tokens": prompt_tokens + len(tokens),
+                    },
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+            self._count("completed_streams")
+        except (BrokenPipeError, ConnectionResetError):
+            # the app closed the upstream call, e.g. because its client disconnected
+            self._count("cancelled_streams")
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients dropping pooled keep-alive connections is expected here
+        pass
+
+
+def serve(port=0, token_delay=0.0, first_token_delay=0.0):
+    '''
+    Start the fake server on a background thread. Returns (server, base_url);
+    server.stats holds request counters.
+    '''
+    stats = {"lock": threading.Lock(), "requests": 0, "completed_streams": 0, "cancelled_streams": 0}
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "token_delay": token_delay,
+        "first_token_delay": first_token_delay,
+        "stats": stats,
+    })
+    server = FakeOpenAIServer(("127.0.0.1", port), handler)
+    server.stats = stats
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    args = parser.parse_args()
+    server, url = serve(args.port, args.token_delay, args.first_token_delay)
+    print(f"fake OpenAI listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,417 @@
+'''
+This file contains the cross-case analytics of a user's saved cases.
+For each questionnaire the cases are kept as NumPy columns: one float
+column per impact slider (<qid>_slider, NaN when not set) and one integer
+column per yes/no or multiple-choice question (the index of the answer among the
+values seen, -1 when not answered). Answers of questions hidden by their
+conditions are left out, as in the summary. numpy is imported when the
+first columns are built, so it stays out of the app's cold start.
+
+Aggregates are computed over whole columns at once: impact distributions
+(percentiles and a histogram per question), answer frequencies, and how
+impacts and answers relate to an outcome, given as a slider question or
+as a question=value indicator. Cases are written into their row as they
+are saved or deleted; a user's columns are built on the first query.
+The columns of the least recently queried users are dropped beyond
+max_users, and built again on their next query.
+Saved cases do not record which questionnaire they were answered on, so
+each case goes into the columns of every questionnaire queried, and only
+cases that answer none of its questions are left out.
+'''
+# import packages
+import collections
+import threading
+import weakref
+
+MIN_CAPACITY = 64
+PERCENTILES = (0, 25, 50, 75, 100)
+# answers of a question that are not among its options get their own code up to this many, then count as OTHER
+MAX_EXTRA_VALUES = 32
+OTHER = "(other)"
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+YESNO_OPTIONS = ("Yes", "No")
+
+
+def _choice_options(question):
+    # the answers of a yes/no or multiple-choice question, None for any other type
+    kind = str(question.get("type", "")).lower()
+    if kind == "yesno":
+        return list(YESNO_OPTIONS)
+    parameters = question.get("parameters")
+    if kind == "label" or not isinstance(parameters, list):
+        return None
+    return [str(p) for p in parameters]
+
+
+class CaseColumns:
+    '''Columns of one user's cases for one questionnaire version'''
+
+    def __init__(self, compiled):
+        import numpy as np
+        self.version = compiled.version
+        self.graph = compiled.graph
+        questions = [q for section in compiled.sections for q in section["questions"]]
+        if not questions:
+            # workbooks without a Sections sheet only have the flat shape
+            questions = [{"id": q["id"], "type": q["type"], "slider": q["needsSlider"],
+                          "parameters": q["options"] or None} for q in compiled.questions]
+        # a workbook may list a question twice, it gets one column
+        self.slider_ids = list(dict.fromkeys(str(q["id"]) for q in questions if q.get("slider")))
+        self.slider_index = {qid: i for i, qid in enumerate(self.slider_ids)}
+        self.choice_ids = []
+        # question id -> {answer: code}, in the order the values were first seen (options first)
+        self.codes = {}
+        self._options = {}
+        for q in questions:
+            options = _choice_options(q)
+            if options and str(q["id"]) not in self.codes:
+                self.choice_ids.append(str(q["id"]))
+                self.codes[str(q["id"])] = {value: code for code, value in enumerate(dict.fromkeys(options))}
+                self._options[str(q["id"])] = len(self.codes[str(q["id"])])
+        self.choice_index = {qid: i for i, qid in enumerate(self.choice_ids)}
+
+        # case -> row
+        self.rows = {}
+        # unused rows, taken from the end
+        self._free = list(range(MIN_CAPACITY - 1, -1, -1))
+        self.impacts = np.full((MIN_CAPACITY, len(self.slider_ids)), np.nan, dtype=np.float32)
+        self.choices = np.full((MIN_CAPACITY, len(self.choice_ids)), -1, dtype=np.int32)
+        self.valid = np.zeros(MIN_CAPACITY, dtype=bool)
+
+    def _grow(self):
+        import numpy as np
+        capacity = len(self.valid) * 2
+        impacts = np.full((capacity, self.impacts.shape[1]), np.nan, dtype=np.float32)
+        impacts[:len(self.valid)] = self.impacts
+        choices = np.full((capacity, self.choices.shape[1]), -1, dtype=np.int32)
+        choices[:len(self.valid)] = self.choices
+        valid = np.zeros(capacity, dtype=bool)
+        valid[:len(self.valid)] = self.valid
+        self._free.extend(range(capacity - 1, len(self.valid) - 1, -1))
+        self.impacts, self.choices, self.valid = impacts, choices, valid
+
+    def set(self, name, answers):
+        '''Write the answers of a case into its row; cases answering nothing here are dropped'''
+        import numpy as np
+        answers = self.graph.visible_answers(answers)
+        impacts = np.full(len(self.slider_ids), np.nan, dtype=np.float32)
+        for qid, i in self.slider_index.items():
+            value = answers.get(f"{qid}_slider")
+            if value is not None:
+                try:
+                    impacts[i] = float(value)
+                except (TypeError, ValueError):
+                    pass
+        choices = np.full(len(self.choice_ids), -1, dtype=np.int32)
+        for qid, i in self.choice_index.items():
+            value = answers.get(qid)
+            if value is None or value == "":
+                continue
+            codes = self.codes[qid]
+            value = str(value)
+            code = codes.get(value)
+            if code is None:
+                # an answer that is not one of the options (edited workbook, free input)
+                if len(codes) - self._options[qid] >= MAX_EXTRA_VALUES:
+                    value = OTHER
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+            choices[i] = code
+        if np.isnan(impacts).all() and (choices < 0).all():
+            self.remove(name)
+            return
+
+        row = self.rows.get(name)
+        if row is None:
+            if not self._free:
+                self._grow()
+            row = self.rows[name] = self._free.pop()
+        self.impacts[row] = impacts
+        self.choices[row] = choices
+        self.valid[row] = True
+
+    def remove(self, name):
+        import numpy as np
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+        self.valid[row] = False
+        self.impacts[row] = np.nan
+        self.choices[row] = -1
+        self._free.append(row)
+
+    def _condition(self, spec):
+        # "qid=Value" -> (column index, code) of a yes/no or multiple-choice question
+        qid, sep, value = spec.partition("=")
+        if not sep or qid not in self.choice_index:
+            raise AnalyticsError(f"Not a condition on a yes/no or multiple-choice question: {spec}")
+        return self.choice_index[qid], self.codes[qid].get(value, -2)
+
+    def outcome(self, spec, rows):
+        '''Outcome per row: a slider value ("qid") or a 0/1 indicator ("qid=Value"), NaN when unknown'''
+        import numpy as np
+        if spec in self.slider_index:
+            return self.impacts[rows, self.slider_index[spec]].astype(np.float64)
+        column, code = self._condition(spec)
+        answered = self.choices[rows, column]
+        return np.where(answered >= 0, (answered == code).astype(np.float64), np.nan)
+
+    def aggregate(self, questions=None, outcome=None, filters=(), bins=10):
+        import numpy as np
+        rows = np.flatnonzero(self.valid)
+        for spec in filters:
+            column, code = self._condition(spec)
+            rows = rows[self.choices[rows, column] == code]
+        wanted = set(questions) if questions else None
+        sliders = [i for i, qid in enumerate(self.slider_ids) if wanted is None or qid in wanted]
+        choice_columns = [i for i, qid in enumerate(self.choice_ids) if wanted is None or qid in wanted]
+
+        impacts = self.impacts[np.ix_(rows, sliders)].astype(np.float64)
+        choices = self.choices[np.ix_(rows, choice_columns)]
+        y = self.outcome(outcome, rows) if outcome else None
+        result = {
+            "cases": int(len(rows)),
+            "impact": self._impact_stats(impacts, [self.slider_ids[i] for i in sliders], bins, y),
+            "answers": self._answer_stats(choices, [self.choice_ids[i] for i in choice_columns], y),
+        }
+        if outcome:
+            result["outcome"] = {"spec": outcome, "cases": int(np.count_nonzero(~np.isnan(y))),
+                                 "mean": _number(np.nanmean(y)) if np.any(~np.isnan(y)) else None}
+        return result
+
+    def _impact_stats(self, values, ids, bins, y):
+        import numpy as np
+        if not ids:
+            return {}
+        present = ~np.isnan(values)
+        counts = present.sum(axis=0)
+        filled = np.where(present, values, 0.0)
+        sums = filled.sum(axis=0)
+        squares = (filled * filled).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+            stds = np.sqrt(np.maximum(squares / counts - means * means, 0.0))
+        percentiles = np.full((len(PERCENTILES), len(ids)), np.nan)
+        answered = counts > 0
+        if answered.any():
+            percentiles[:, answered] = np.nanpercentile(values[:, answered], PERCENTILES, axis=0)
+
+        # one bincount for the histograms of every question, sliders are 0..1
+        bucket = np.clip(np.floor(filled * bins), 0, bins - 1).astype(np.int64)
+        flat = (bucket + np.arange(len(ids)) * bins)[present]
+        histograms = np.bincount(flat, minlength=len(ids) * bins).reshape(len(ids), bins)
+
+        correlations = _pearson(values, y) if y is not None else None
+        stats = {}
+        for i, qid in enumerate(ids):
+            if not counts[i]:
+                stats[qid] = {"count": 0}
+                continue
+            stats[qid] = {
+                "count": int(counts[i]),
+                "mean": _number(means[i]),
+                "std": _number(stds[i]),
+                "percentiles": {str(p): _number(percentiles[k, i]) for k, p in enumerate(PERCENTILES)},
+                "histogram": histograms[i].tolist(),
+            }
+            if correlations is not None:
+                stats[qid]["correlation"] = _number(correlations[i])
+        return stats
+
+    def _answer_stats(self, codes, ids, y):
+        import numpy as np
+        if not ids:
+            return {}
+        sizes = np.array([len(self.codes[qid]) for qid in ids], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        answered = codes >= 0
+        flat = (codes + offsets)[answered]
+        total = int(sizes.sum())
+        frequencies = np.bincount(flat, minlength=total)
+        if y is not None:
+            known = answered & ~np.isnan(y)[:, None]
+            outcome_flat = (codes + offsets)[known]
+            outcome_weights = np.broadcast_to(y[:, None], codes.shape)[known]
+            outcome_sums = np.bincount(outcome_flat, weights=outcome_weights, minlength=total)
+            outcome_counts = np.bincount(outcome_flat, minlength=total)
+        stats = {}
+        missing = (~answered).sum(axis=0)
+        for i, qid in enumerate(ids):
+            start = offsets[i]
+            values = list(self.codes[qid])
+            entry = {
+                "counts": {value: int(frequencies[start + code]) for code, value in enumerate(values)},
+                "missing": int(missing[i]),
+            }
+            if y is not None:
+                entry["outcome_mean"] = {
+                    value: _number(outcome_sums[start + code] / outcome_counts[start + code])
+                    for code, value in enumerate(values) if outcome_counts[start + code]
+                }
+            stats[qid] = entry
+        return stats
+
+
+def _pearson(values, y):
+    import numpy as np
+    # correlation of every column with y over the rows where both are known
+    mask = ~np.isnan(values) & ~np.isnan(y)[:, None]
+    n = mask.sum(axis=0)
+    x = np.where(mask, values, 0.0)
+    yy = np.where(mask, y[:, None], 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sx, sy = x.sum(axis=0), yy.sum(axis=0)
+        cov = (x * yy).sum(axis=0) - sx * sy / n
+        var_x = (x * x).sum(axis=0) - sx * sx / n
+        var_y = (yy * yy).sum(axis=0) - sy * sy / n
+        return cov / np.sqrt(var_x * var_y)
+
+
+def _number(value):
+    import numpy as np
+    value = float(value)
+    return None if np.isnan(value) or np.isinf(value) else round(value, 6)
+
+
+class CaseAnalytics:
+    '''
+    Columns per (user, questionnaire workbook), built on first use:
+    list_cases(user) -> iterable of {"name"}; read_cases(user, names) ->
+    iterable of (name, document or None), e.g. read concurrently.
+    The columns of at most max_users users are kept, the least recently
+    queried are dropped first. A user's columns are only written and
+    aggregated under that user's lock; the shared lock guards the maps.
+    '''
+
+    def __init__(self, list_cases, read_cases, max_users=100):
+        self.list_cases = list_cases
+        self.read_cases = read_cases
+        self.max_users = max_users
+        # user -> {workbook path: CaseColumns}, least recently used first
+        self._tables = collections.OrderedDict()
+        # user -> {case: True (saved) or False (deleted)} while columns of the user are being built
+        self._pending = {}
+        self._building = collections.Counter()
+        self._lock = threading.Lock()
+        self._user_locks = weakref.WeakValueDictionary()
+        self._build_locks = weakref.WeakValueDictionary()
+        self._counters = collections.Counter()
+
+    def _user_lock(self, user, locks=None):
+        # called with the lock held
+        locks = self._user_locks if locks is None else locks
+        lock = locks.get(user)
+        if lock is None:
+            lock = locks[user] = threading.Lock()
+        return lock
+
+    def _current(self, user, compiled):
+        # called with the lock held; (columns, user lock) if built for this version of the workbook
+        columns = self._tables.get(user, {}).get(compiled.path)
+        if columns is None or columns.version != compiled.version:
+            return None
+        self._tables.move_to_end(user)
+        return columns, self._user_lock(user)
+
+    def _get(self, user, compiled):
+        '''(columns, user lock) of a user for a questionnaire, building them as needed'''
+        with self._lock:
+            current = self._current(user, compiled)
+            if current is not None:
+                return current
+            build_lock = self._user_lock(user, self._build_locks)
+        # one build per user at a time, other users are not held up
+        with build_lock:
+            with self._lock:
+                current = self._current(user, compiled)
+                if current is not None:
+                    return current
+                self._building[user] += 1
+            try:
+                columns = CaseColumns(compiled)
+                names = [case["name"] for case in self.list_cases(user)]
+                for name, document in self.read_cases(user, names):
+                    if document is not None:
+                        columns.set(name, document.get("answers") or {})
+                # cases saved or deleted meanwhile; the columns are published once there are none left
+                while True:
+                    with self._lock:
+                        pending = self._pending.pop(user, {})
+                        if not pending:
+                            self._tables.setdefault(user, {})[compiled.path] = columns
+                            self._tables.move_to_end(user)
+                            self._counters["builds"] += 1
+                            self._evict()
+                            user_lock = self._user_lock(user)
+                            break
+                    saved = [name for name, is_saved in pending.items() if is_saved]
+                    for name in pending:
+                        columns.remove(name)
+                    for name, document in self.read_cases(user, saved):
+                        if document is not None:
+                            columns.set(name, document.get("answers") or {})
+            finally:
+                with self._lock:
+                    self._building[user] -= 1
+                    if not self._building[user]:
+                        del self._building[user]
+                        self._pending.pop(user, None)
+            return columns, user_lock
+
+    def _evict(self):
+        # called with the lock held: the least recently used users beyond max_users are dropped
+        while len(self._tables) > self.max_users:
+            self._tables.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _change(self, user, name, saved):
+        # (tables, user lock) a save or delete is written into; during a build it is also queued for it
+        with self._lock:
+            if user in self._building:
+                self._pending.setdefault(user, {})[name] = saved
+            tables = list(self._tables.get(user, {}).values())
+            if not tables:
+                return [], None
+            self._counters["updates"] += len(tables)
+            return tables, self._user_lock(user)
+
+    def update(self, user, name, document):
+        tables, user_lock = self._change(user, name, True)
+        if tables:
+            with user_lock:
+                for columns in tables:
+                    columns.set(name, document.get("answers") or {})
+
+    def remove(self, user, name):
+        tables, user_lock = self._change(user, name, False)
+        if tables:
+            with user_lock:
+                for columns in tables:
+                    columns.remove(name)
+
+    def aggregate(self, user, compiled, **query):
+        '''CaseColumns.aggregate over the user's cases for a questionnaire'''
+        columns, user_lock = self._get(user, compiled)
+        with self._lock:
+            self._counters["queries"] += 1
+        with user_lock:
+            return columns.aggregate(**query)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["users"] = len(self._tables)
+            stats["max_users"] = self.max_users
+            tables = [columns for user_tables in self._tables.values() for columns in user_tables.values()]
+        # approximate: the columns are read without their users' locks
+        stats["tables"] = len(tables)
+        stats["cases"] = sum(len(columns.rows) for columns in tables)
+        stats["bytes"] = sum(columns.impacts.nbytes + columns.choices.nbytes + columns.valid.nbytes
+                             for columns in tables)
+        return stats
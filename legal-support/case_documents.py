@@ -0,0 +1,242 @@
+'''
+This file contains the versioned saved-answer documents and their
+incremental updates. A document is {"answers", "clientInfo", "version"};
+every save or patch increments the version, and a patch or save made
+against an older version is rejected instead of overwriting the newer one
+(e.g. two tabs editing the same case). Patches are JSON-patch style
+operations on the current document, applied under a per-case lock; the
+merged document is written as a whole snapshot, so loading a case never has
+to replay changes.
+
+The version check runs against this instance's copy, so versioned writes
+are stored conditionally. When the upload of one is refused because another
+instance wrote the case in between, lost() is called, and the next
+versioned save or patch of the case gets a VersionConflict, so the client
+reloads instead of building on a document that was never stored. A save
+without a version overwrites whatever is stored, on every instance.
+'''
+# import packages
+import copy
+import threading
+import weakref
+
+# top-level members of a document that patches may change
+PATCHABLE = ("answers", "clientInfo")
+MAX_OPS = 1000
+OPS = ("add", "replace", "remove", "test")
+
+
+class PatchError(ValueError):
+    pass
+
+
+class VersionConflict(Exception):
+
+    def __init__(self, version):
+        super().__init__(f"The case was changed elsewhere (now at version {version})")
+        self.version = version
+
+
+def normalise(data):
+    '''Document of a saved file in any of its formats (bare answers, without a version)'''
+    if isinstance(data, dict) and "answers" in data:
+        return {
+            "answers": data.get("answers") or {},
+            "clientInfo": data.get("clientInfo"),
+            "version": int(data.get("version") or 0),
+        }
+    # Old format - just answers
+    return {"answers": data or {}, "clientInfo": None, "version": 0}
+
+
+def _pointer(path):
+    # "/answers/q~1a" -> ["answers", "q/a"]
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"Invalid path: {path!r}")
+    parts = [p.replace("~1", "/").replace("~0", "~") for p in path[1:].split("/")]
+    if parts[0] not in PATCHABLE:
+        raise PatchError(f"Path outside of {', '.join(PATCHABLE)}: {path}")
+    return parts
+
+
+def _container(document, parts, create):
+    # parent of the last part of the path
+    node = document
+    for part in parts[:-1]:
+        if isinstance(node, list):
+            try:
+                node = node[int(part)]
+            except (ValueError, IndexError):
+                raise PatchError(f"No element {part} in /{'/'.join(parts)}")
+            continue
+        child = node.get(part) if isinstance(node, dict) else None
+        if child is None:
+            if not create or not isinstance(node, dict):
+                raise PatchError(f"No member {part} in /{'/'.join(parts)}")
+            child = node[part] = {}
+        node = child
+    if not isinstance(node, (dict, list)):
+        raise PatchError(f"Cannot change a member of a value: /{'/'.join(parts)}")
+    return node
+
+
+def _list_index(node, part, parts, adding):
+    if adding and part == "-":
+        return len(node)
+    try:
+        index = int(part)
+    except ValueError:
+        raise PatchError(f"Invalid list index in /{'/'.join(parts)}")
+    if not 0 <= index < len(node) + (1 if adding else 0):
+        raise PatchError(f"List index out of range in /{'/'.join(parts)}")
+    return index
+
+
+def apply_patch(document, ops):
+    '''
+    New document with ops applied in order; document itself is not changed.
+    Raises PatchError if any op is invalid, in which case nothing is applied.
+    Missing objects on the way to an added member are created, so
+    {"op": "add", "path": "/clientInfo/clientName"} works on a case saved
+    without client info.
+    '''
+    if not isinstance(ops, list):
+        raise PatchError("ops must be a list")
+    if len(ops) > MAX_OPS:
+        raise PatchError(f"At most {MAX_OPS} operations per patch")
+    document = {key: copy.deepcopy(document.get(key)) for key in PATCHABLE}
+    for op in ops:
+        if not isinstance(op, dict) or op.get("op") not in OPS:
+            raise PatchError(f"Invalid operation: {op!r}")
+        kind = op["op"]
+        parts = _pointer(op.get("path"))
+        if kind != "remove" and "value" not in op:
+            raise PatchError(f"{kind} needs a value: {op['path']}")
+        value = op.get("value")
+
+        if len(parts) == 1:
+            # a whole top-level member
+            if kind == "test":
+                if document[parts[0]] != value:
+                    raise PatchError(f"Test failed: {op['path']}")
+            elif kind == "remove":
+                document[parts[0]] = {} if parts[0] == "answers" else None
+            else:
+                document[parts[0]] = value
+            continue
+
+        node = _container(document, parts, create=kind == "add")
+        last = parts[-1]
+        if isinstance(node, list):
+            index = _list_index(node, last, parts, adding=kind == "add")
+            if kind == "add":
+                node.insert(index, value)
+            elif kind == "replace":
+                node[index] = value
+            elif kind == "remove":
+                del node[index]
+            elif node[index] != value:
+                raise PatchError(f"Test failed: {op['path']}")
+            continue
+        if kind == "add":
+            node[last] = value
+        elif last not in node:
+            raise PatchError(f"No member {last} in {op['path']}")
+        elif kind == "replace":
+            node[last] = value
+        elif kind == "remove":
+            del node[last]
+        elif node[last] != value:
+            raise PatchError(f"Test failed: {op['path']}")
+    return document
+
+
+class CaseDocuments:
+    '''
+    read(user, filename) returns the stored data of a case (any format) or
+    None; write(user, filename, document, conditional) stores a whole
+    document, conditional writes only over the copy this instance read.
+    Updates of one case are serialised by a lock per case, so a version is
+    never handed out twice by this process.
+    '''
+
+    def __init__(self, read, write):
+        self.read = read
+        self.write = write
+        self._locks = weakref.WeakValueDictionary()
+        self._locks_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._patches = 0
+        self._saves = 0
+        self._conflicts = 0
+        # (user, filename) of cases whose last write was refused in storage
+        self._lost = set()
+
+    def _lock(self, user, filename):
+        with self._locks_lock:
+            lock = self._locks.get((user, filename))
+            if lock is None:
+                lock = self._locks[(user, filename)] = threading.Lock()
+            return lock
+
+    def load(self, user, filename):
+        data = self.read(user, filename)
+        return normalise(data) if data is not None else None
+
+    def lost(self, user, filename):
+        '''Record that the last write of a case lost against a write made elsewhere'''
+        with self._stats_lock:
+            self._lost.add((user, filename))
+
+    def _take_lost(self, user, filename):
+        with self._stats_lock:
+            if (user, filename) in self._lost:
+                self._lost.discard((user, filename))
+                return True
+            return False
+
+    def _conflict(self, version):
+        with self._stats_lock:
+            self._conflicts += 1
+        raise VersionConflict(version)
+
+    def save(self, user, filename, answers, client_info, base_version=None):
+        '''
+        Replace the whole document. With base_version, raises VersionConflict
+        if the stored document is at another version. Returns the new document.
+        '''
+        with self._lock(user, filename):
+            current = self.load(user, filename)
+            version = current["version"] if current else 0
+            # an unversioned save replaces a lost write as well
+            lost = self._take_lost(user, filename)
+            if base_version is not None and (lost or int(base_version) != version):
+                self._conflict(version)
+            document = {"answers": answers, "clientInfo": client_info, "version": version + 1}
+            self.write(user, filename, document, base_version is not None)
+        with self._stats_lock:
+            self._saves += 1
+        return document
+
+    def patch(self, user, filename, base_version, ops):
+        '''
+        Apply ops to the document at base_version. Raises LookupError if the
+        case does not exist, VersionConflict if it is at another version and
+        PatchError for invalid ops. Returns the new document.
+        '''
+        with self._lock(user, filename):
+            current = self.load(user, filename)
+            if current is None:
+                raise LookupError(filename)
+            if self._take_lost(user, filename) or int(base_version) != current["version"]:
+                self._conflict(current["version"])
+            document = apply_patch(current, ops)
+            document["version"] = current["version"] + 1
+            self.write(user, filename, document, True)
+        with self._stats_lock:
+            self._patches += 1
+        return document
+
+    def stats(self):
+        with self._stats_lock:
+            return {"saves": self._saves, "patches": self._patches, "conflicts": self._conflicts}
@@ -0,0 +1,129 @@
+'''
+This file contains the streaming export of a user's saved cases as a ZIP
+archive or as NDJSON (one JSON document per line). Cases are read a few at
+a time on a small thread pool and written to the response in listing order
+as soon as they arrive; at most a fixed window of cases is held in memory,
+however many the user has. The ZIP is written without seeking (sizes and
+checksums follow each entry), so it can be sent while it is being built;
+only its central directory, a few dozen bytes per case, grows with the
+number of cases.
+'''
+# import packages
+import json
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+FORMATS = ("zip", "ndjson")
+
+
+def ordered_map(fn, items, workers=8, window=None):
+    '''
+    Yield (item, result, error) for every item in order, computing fn(item)
+    on up to workers threads with at most window items in flight.
+    '''
+    window = window or workers * 2
+    pool = ThreadPoolExecutor(workers, thread_name_prefix="case-export")
+    pending = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            pending.append((item, pool.submit(fn, item)))
+            if len(pending) >= window:
+                yield _result(*pending.popleft())
+        while pending:
+            yield _result(*pending.popleft())
+    finally:
+        # the client went away: queued reads are dropped, running ones finish in the background
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _result(item, future):
+    try:
+        return item, future.result(), None
+    except Exception as e:
+        return item, None, e
+
+
+class _ChunkSink:
+    '''Write-only file object handing what was written to the response'''
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_stream(entries):
+    '''
+    Bytes of a ZIP archive of entries, (name, bytes) pairs, yielded entry by
+    entry.
+    '''
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, data)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
+
+
+def ndjson_stream(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def export_records(names, read_case, workers=8, summarise=None):
+    '''
+    Export record of every case name, in order: {"filename", "answers",
+    "clientInfo", "version"} plus "summary" when summarise(document) is given,
+    or {"filename", "error"} for a case that could not be read.
+    '''
+    def load(name):
+        document = read_case(name)
+        if document is None:
+            raise LookupError("File not found")
+        record = {"filename": name}
+        record.update(document)
+        if summarise is not None:
+            record["summary"] = summarise(document)
+        return record
+
+    for name, record, error in ordered_map(load, names, workers):
+        yield record if error is None else {"filename": name, "error": str(error)}
+
+
+def zip_entries(records, summary_extension="html"):
+    # one <case>.json per case, its summary next to it, failures in errors.json at the end
+    errors = []
+    for record in records:
+        name = record["filename"]
+        if "error" in record:
+            errors.append(record)
+            continue
+        summary = record.pop("summary", None)
+        yield f"{name}.json", json.dumps(record, ensure_ascii=False, indent=2).encode("utf-8")
+        if summary is not None:
+            yield f"{name}.summary.{summary_extension}", summary.encode("utf-8")
+    if errors:
+        yield "errors.json", json.dumps(errors, indent=2).encode("utf-8")
+
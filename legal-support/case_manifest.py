@@ -0,0 +1,137 @@
+'''
+This file contains the listing of a user's saved cases.
+Cases are listed with a prefix- and delimiter-scoped query, so the cost
+depends on the user's own cases rather than the whole bucket. Optionally a
+per-user manifest object (_manifest.json) keeps the listing metadata in one
+small object that is updated on save and delete.
+'''
+# import packages
+import json
+import os
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from google_storage_utility import list_cs_page, read_cs_object, write_cs_object
+
+MANIFEST_NAME = "_manifest.json"
+MAX_PAGE_SIZE = 1000
+# attempts at a read-modify-write of the manifest when another writer races us
+MANIFEST_RETRIES = 5
+
+
+def is_case_object(name):
+    # saved cases are the .json files directly in the user folder; other
+    # objects (profile.txt, the manifest) are not cases
+    base = os.path.basename(name)
+    return base.endswith(".json") and not base.startswith("_")
+
+
+def case_entry(name, size, updated, client_name, generation=None):
+    return {
+        "name": os.path.splitext(os.path.basename(name))[0],
+        "size": size,
+        "updated": updated,
+        "client_name": client_name,
+        # identifies the stored version of the case; missing in manifests written before it was added
+        "generation": generation,
+    }
+
+
+def list_cases(bucket_name, prefix, page_size=100, page_token=None, use_manifest=False):
+    '''
+    Return (cases, next_page_token) for the cases under prefix, which must end
+    with "/". Cases are sorted by name.
+    '''
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    if use_manifest:
+        manifest = read_manifest(bucket_name, prefix)
+        if manifest is None:
+            manifest = (build_manifest(bucket_name, prefix), 0)
+        return _page_from_manifest(manifest[0], page_size, page_token)
+
+    cases = []
+    # a page can contain non-case objects, keep reading until it is full
+    while True:
+        objects, page_token = list_cs_page(bucket_name, prefix, page_size=page_size - len(cases),
+                                           page_token=page_token)
+        for obj in objects:
+            if is_case_object(obj["name"]):
+                cases.append(case_entry(obj["name"], obj["size"], obj["updated"],
+                                        obj["metadata"].get("client_name"), obj["generation"]))
+        if len(cases) >= page_size or not page_token:
+            return cases, page_token
+
+
+def _list_all(bucket_name, prefix):
+    cases = {}
+    page_token = None
+    while True:
+        entries, page_token = list_cases(bucket_name, prefix, MAX_PAGE_SIZE, page_token)
+        for entry in entries:
+            cases[entry["name"]] = entry
+        if not page_token:
+            return cases
+
+
+def build_manifest(bucket_name, prefix):
+    '''Create the manifest from a full listing of the user's folder'''
+    manifest = {"cases": _list_all(bucket_name, prefix)}
+    try:
+        write_cs_object(bucket_name, prefix + MANIFEST_NAME, json.dumps(manifest), if_generation_match=0)
+    except PreconditionFailed:
+        # created concurrently by another request, ours is equally valid to serve
+        pass
+    return manifest
+
+
+def _page_from_manifest(manifest, page_size, page_token):
+    names = sorted(manifest["cases"])
+    start = 0
+    if page_token:
+        # the token is the last name of the previous page
+        start = next((i for i, name in enumerate(names) if name > page_token), len(names))
+    page = names[start:start + page_size]
+    next_token = page[-1] if start + page_size < len(names) else None
+    return [manifest["cases"][name] for name in page], next_token
+
+
+def read_manifest(bucket_name, prefix):
+    '''Return (manifest, generation) or None if the user has no manifest'''
+    try:
+        content, generation = read_cs_object(bucket_name, prefix + MANIFEST_NAME)
+    except NotFound:
+        return None
+    return json.loads(content), generation
+
+
+def _update_manifest(bucket_name, prefix, change):
+    for _ in range(MANIFEST_RETRIES):
+        current = read_manifest(bucket_name, prefix)
+        if current is None:
+            # no manifest yet: start from the cases already stored, not an empty list
+            manifest, generation = {"cases": _list_all(bucket_name, prefix)}, 0
+        else:
+            manifest, generation = current
+        change(manifest["cases"])
+        try:
+            write_cs_object(bucket_name, prefix + MANIFEST_NAME, json.dumps(manifest),
+                            if_generation_match=generation)
+            return True
+        except PreconditionFailed:
+            # somebody else updated the manifest in between, re-read and retry
+            continue
+    return False
+
+
+def record_case(bucket_name, prefix, entry):
+    '''Add or replace a case in the user's manifest'''
+    def change(cases):
+        cases[entry["name"]] = entry
+    return _update_manifest(bucket_name, prefix, change)
+
+
+def forget_case(bucket_name, prefix, name):
+    '''Remove a case from the user's manifest'''
+    def change(cases):
+        cases.pop(name, None)
+    return _update_manifest(bucket_name, prefix, change)
@@ -0,0 +1,453 @@
+'''
+This file contains the full-text search over a user's saved cases.
+Each user has an inverted index (term -> case -> term frequency) over the
+text of the answers, the explanations and the client info, ranked with
+BM25. The index is kept in memory once loaded, updated on every save and
+delete, and persisted as one object next to the user's cases
+(_search_index.json). Writing it is deferred by persist_delay seconds so a
+burst of saves is persisted once; losing the last write is harmless, as a
+stored index is reconciled with the cases when it is loaded.
+
+An index is loaded on the first search of a user. It is then reconciled
+with the listing of the user's cases: cases that are new or changed since
+they were indexed are read and indexed again, deleted ones are dropped. A
+case is up to date when it was indexed at the generation in the listing
+(or, for listings without generations, the same timestamp); cases indexed
+on save get theirs when their upload lands. Saves and deletes made while no
+index is loaded are not kept, the listing covers them when it is loaded;
+ones made during the load are applied before the index is used. A case
+whose upload lands after that listing makes the next search reconcile
+again. A loaded index is reconciled again every reconcile_after seconds, to
+pick up saves made on other instances, and at most max_users indexes are
+kept in memory, the least recently searched ones are dropped first.
+'''
+# import packages
+import collections
+import logging
+import math
+import re
+import threading
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i in is it its of on or she that the their "
+    "they this to was were which who with you".split())
+SNIPPET_CHARS = 160
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokens(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def document_fields(document):
+    '''(field, text) pairs of a case document that are searched'''
+    fields = []
+    for key, value in (document.get("answers") or {}).items():
+        if key.endswith("_slider"):
+            continue
+        if isinstance(value, list):
+            value = ", ".join(str(v) for v in value)
+        if isinstance(value, str) and value.strip():
+            fields.append((key, value))
+    for key, value in (document.get("clientInfo") or {}).items():
+        if isinstance(value, str) and value.strip():
+            fields.append((f"clientInfo.{key}", value))
+    return fields
+
+
+class CaseIndex:
+    '''Inverted index of one user's cases'''
+
+    def __init__(self):
+        # case -> {"fields", "terms", "length", "generation", "updated"}
+        self.docs = {}
+        # term -> {case: frequency}
+        self.postings = collections.defaultdict(dict)
+        self.total_length = 0
+
+    def update(self, name, document, generation=None, updated=None):
+        self.remove(name)
+        fields = document_fields(document)
+        counts = collections.Counter()
+        for _, text in fields:
+            counts.update(tokens(text))
+        self._add(name, fields, dict(counts), generation, updated)
+
+    def _add(self, name, fields, terms, generation, updated):
+        length = sum(terms.values())
+        self.docs[name] = {"fields": fields, "terms": terms, "length": length, "generation": generation,
+                           "updated": updated}
+        self.total_length += length
+        for term, frequency in terms.items():
+            self.postings[term][name] = frequency
+
+    def remove(self, name):
+        doc = self.docs.pop(name, None)
+        if doc is None:
+            return False
+        self.total_length -= doc["length"]
+        for term in doc["terms"]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(name, None)
+                if not postings:
+                    del self.postings[term]
+        return True
+
+    def is_current(self, name, case):
+        '''Was the case indexed at the version in its listing entry'''
+        doc = self.docs.get(name)
+        if doc is None:
+            return False
+        if case.get("generation") is not None:
+            return doc["generation"] == case["generation"]
+        return doc["updated"] is not None and doc["updated"] == case.get("updated")
+
+    def search(self, query, limit=20):
+        '''[(case, score, matched terms)] for the best matches, best first'''
+        terms = list(dict.fromkeys(tokens(query)))
+        if not terms or not self.docs:
+            return []
+        count = len(self.docs)
+        average = self.total_length / count or 1
+        scores = collections.defaultdict(float)
+        matched = collections.defaultdict(list)
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for name, frequency in postings.items():
+                length = self.docs[name]["length"]
+                scores[name] += idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average))
+                matched[name].append(term)
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(name, score, matched[name]) for name, score in best]
+
+    def snippet(self, name, terms):
+        '''(field, text around the first match) of a case, or (None, "")'''
+        wanted = set(terms)
+        for field, text in self.docs[name]["fields"]:
+            for match in TOKEN_RE.finditer(text):
+                if match.group().lower() in wanted:
+                    start = max(match.start() - SNIPPET_CHARS // 3, 0)
+                    end = min(start + SNIPPET_CHARS, len(text))
+                    # cut at word boundaries
+                    if start > 0:
+                        space = text.find(" ", start)
+                        start = space + 1 if 0 <= space < match.start() else start
+                    if end < len(text):
+                        space = text.rfind(" ", match.end(), end)
+                        end = space if space > 0 else end
+                    prefix = "…" if start > 0 else ""
+                    suffix = "…" if end < len(text) else ""
+                    return field, prefix + text[start:end].strip() + suffix
+        return None, ""
+
+    def to_dict(self):
+        return {
+            "format": FORMAT,
+            "docs": {name: {"fields": doc["fields"], "terms": doc["terms"], "generation": doc["generation"],
+                            "updated": doc["updated"]}
+                     for name, doc in self.docs.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        if not isinstance(data, dict) or data.get("format") != FORMAT:
+            return index
+        for name, doc in data.get("docs", {}).items():
+            index._add(name, [tuple(f) for f in doc["fields"]], doc["terms"], doc.get("generation"),
+                       doc.get("updated"))
+        return index
+
+
+class CaseSearch:
+    '''
+    The indexes of all users, loaded on first use:
+    load_index(user) -> stored index dict or None;
+    save_index(user, index dict) persists it;
+    list_cases(user) -> iterable of {"name", "generation", "updated"};
+    read_case(user, name) -> case document or None.
+    An index is only changed and searched under its user's lock; the shared
+    lock guards the maps of indexes and pending changes.
+    '''
+
+    def __init__(self, load_index, save_index, list_cases, read_case, persist_delay=30.0, max_users=200,
+                 reconcile_after=60.0):
+        self.load_index = load_index
+        self.save_index = save_index
+        self.list_cases = list_cases
+        self.read_case = read_case
+        self.persist_delay = persist_delay
+        self.max_users = max_users
+        self.reconcile_after = reconcile_after
+        # user -> CaseIndex, least recently used first
+        self._indexes = collections.OrderedDict()
+        # user -> time the index was last reconciled with the listing
+        self._checked = {}
+        # users whose index changed since it was last persisted
+        self._dirty = set()
+        # users whose index is being loaded
+        self._loading = set()
+        # user -> {case: True (saved) or False (deleted)}, changes made while the index was being loaded
+        self._pending = {}
+        # user -> cases saved or deleted while a loaded index is being reconciled
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._user_locks = weakref.WeakValueDictionary()
+        self._counters = collections.Counter()
+
+    def _user_lock(self, user):
+        # called with the lock held
+        lock = self._user_locks.get(user)
+        if lock is None:
+            lock = self._user_locks[user] = threading.Lock()
+        return lock
+
+    def _index(self, user, fresh=False):
+        '''(index, user lock) of a user, loading or reconciling the index as needed'''
+        with self._lock:
+            index = self._indexes.get(user)
+            user_lock = self._user_lock(user)
+            if index is not None:
+                self._indexes.move_to_end(user)
+                stale = time.time() - self._checked.get(user, 0) >= self.reconcile_after
+        if index is not None:
+            if stale:
+                self._refresh(user, index, user_lock)
+            return index, user_lock
+        with user_lock:
+            index = self._indexes.get(user)
+            if index is not None:
+                return index, user_lock
+            with self._lock:
+                self._loading.add(user)
+            try:
+                index = CaseIndex() if fresh else CaseIndex.from_dict(self.load_index(user))
+                changed = self._reconcile(user, index)
+                # saves and deletes that happened meanwhile; the index is published once there are none left
+                while True:
+                    with self._lock:
+                        pending = self._pending.pop(user, {})
+                        if not pending:
+                            self._indexes[user] = index
+                            self._checked[user] = time.time()
+                            self._counters["loads"] += 1
+                            self._evict()
+                            break
+                    for name, saved in pending.items():
+                        document = self.read_case(user, name) if saved else None
+                        if document is None:
+                            index.remove(name)
+                        else:
+                            index.update(name, document)
+                        changed += 1
+            finally:
+                with self._lock:
+                    self._loading.discard(user)
+                    self._pending.pop(user, None)
+        if changed:
+            self._persist(user)
+        return index, user_lock
+
+    def _stale_cases(self, user, index):
+        # (listed names, [(name, listing entry)] of cases the index does not have at their listed version)
+        listed = set()
+        stale = []
+        for case in self.list_cases(user):
+            listed.add(case["name"])
+            if not index.is_current(case["name"], case):
+                stale.append((case["name"], case))
+        return listed, stale
+
+    def _reconcile(self, user, index):
+        # bring an index that is not published yet up to date with the cases in storage
+        listed, stale = self._stale_cases(user, index)
+        changed = 0
+        for name, case in stale:
+            document = self.read_case(user, name)
+            if document is None:
+                continue
+            index.update(name, document, case.get("generation"), case.get("updated"))
+            changed += 1
+        for name in set(index.docs) - listed:
+            index.remove(name)
+            changed += 1
+        with self._lock:
+            self._counters["reindexed"] += changed
+        return changed
+
+    def _refresh(self, user, index, user_lock):
+        # reconcile a published index; storage is read without the user's lock, and cases saved
+        # or deleted on this instance in the meantime are left as they are
+        with self._lock:
+            if user in self._touched:
+                # another request is at it
+                return
+            self._touched[user] = set()
+            self._checked[user] = time.time()
+        changed = 0
+        try:
+            with user_lock:
+                # is_current reads the index
+                listed, stale = self._stale_cases(user, index)
+            documents = [(name, case, self.read_case(user, name)) for name, case in stale]
+            with user_lock:
+                with self._lock:
+                    touched = set(self._touched.get(user, ()))
+                for name, case, document in documents:
+                    if document is not None and name not in touched:
+                        index.update(name, document, case.get("generation"), case.get("updated"))
+                        changed += 1
+                for name in set(index.docs) - listed - touched:
+                    doc = index.docs[name]
+                    # cases indexed on save and not uploaded yet are not listed either
+                    if doc["generation"] is not None or doc["updated"] is not None:
+                        index.remove(name)
+                        changed += 1
+        finally:
+            with self._lock:
+                self._touched.pop(user, None)
+                self._counters["refreshes"] += 1
+                self._counters["reindexed"] += changed
+        if changed:
+            self._persist(user)
+
+    def _evict(self):
+        # called with the lock held: least recently used indexes beyond max_users are dropped,
+        # ones with changes that are not persisted yet stay until they are
+        for user in list(self._indexes):
+            if len(self._indexes) <= self.max_users:
+                break
+            if user in self._dirty:
+                continue
+            del self._indexes[user]
+            self._checked.pop(user, None)
+            self._counters["evictions"] += 1
+
+    def _persist(self, user):
+        if self.persist_delay <= 0:
+            self._flush(user, force=True)
+            return
+        with self._lock:
+            if user in self._dirty:
+                return
+            self._dirty.add(user)
+        timer = threading.Timer(self.persist_delay, self._flush, args=(user,))
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self, user, force=False):
+        with self._lock:
+            if user not in self._dirty and not force:
+                return
+            self._dirty.discard(user)
+            index = self._indexes.get(user)
+            user_lock = self._user_lock(user)
+        if index is None:
+            return
+        # encoded under the user's lock only, other users are not held up
+        with user_lock:
+            data = index.to_dict()
+        try:
+            self.save_index(user, data)
+            with self._lock:
+                self._counters["persisted"] += 1
+        except Exception:
+            logger.exception("could not persist the search index of %s", user)
+
+    def _change(self, user, name, saved):
+        # (index, user lock) to apply a save or delete to, or None if it was queued for the load
+        with self._lock:
+            index = self._indexes.get(user)
+            if index is None:
+                # nothing to do until the index is loaded, which reconciles it with the listing; during
+                # the load only the name is kept, and the case is read again before the index is published
+                if user in self._loading:
+                    self._pending.setdefault(user, {})[name] = saved
+                return None
+            if user in self._touched:
+                self._touched[user].add(name)
+            self._counters["updates"] += 1
+            return index, self._user_lock(user)
+
+    def update(self, user, name, document):
+        '''Index a saved case'''
+        target = self._change(user, name, True)
+        if target is None:
+            return
+        index, user_lock = target
+        with user_lock:
+            index.update(name, document)
+        self._persist(user)
+
+    def uploaded(self, user, name, generation, updated):
+        '''Record the generation a case indexed on save was stored at'''
+        with self._lock:
+            index = self._indexes.get(user)
+            if index is None:
+                return
+            user_lock = self._user_lock(user)
+        with user_lock:
+            doc = index.docs.get(name)
+            if doc is None:
+                # saved before the index was loaded and not listed then; the next search reconciles
+                with self._lock:
+                    self._checked[user] = 0
+                return
+            doc["generation"] = generation
+            doc["updated"] = updated
+        self._persist(user)
+
+    def remove(self, user, name):
+        target = self._change(user, name, False)
+        if target is None:
+            return
+        index, user_lock = target
+        with user_lock:
+            index.remove(name)
+        self._persist(user)
+
+    def search(self, user, query, limit=20):
+        '''[{"filename", "score", "field", "snippet", "matched"}], best first'''
+        index, user_lock = self._index(user)
+        with user_lock:
+            results = []
+            for name, score, matched in index.search(query, limit):
+                field, snippet = index.snippet(name, matched)
+                results.append({"filename": name, "score": round(score, 4), "field": field,
+                                "snippet": snippet, "matched": matched})
+        with self._lock:
+            self._counters["searches"] += 1
+        return results
+
+    def rebuild(self, user):
+        '''Drop the user's index and build it again from storage'''
+        with self._lock:
+            self._indexes.pop(user, None)
+        index, user_lock = self._index(user, fresh=True)
+        self._persist(user)
+        with user_lock:
+            return len(index.docs)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["users"] = len(self._indexes)
+            stats["max_users"] = self.max_users
+            stats["pending_users"] = len(self._pending)
+            indexes = list(self._indexes.values())
+        # approximate: the indexes are read without their locks
+        stats["cases"] = sum(len(index.docs) for index in indexes)
+        stats["terms"] = sum(len(index.postings) for index in indexes)
+        return stats
@@ -0,0 +1,33 @@
+// Writes .br and .gz copies of the built files in dist/ next to the originals,
+// so the server can send them without compressing on every request.
+import { readdirSync, readFileSync, statSync, writeFileSync } from 'node:fs'
+import { join, extname } from 'node:path'
+import { brotliCompressSync, gzipSync, constants } from 'node:zlib'
+import { fileURLToPath } from 'node:url'
+
+const DIST = fileURLToPath(new URL('../dist/', import.meta.url))
+const COMPRESSIBLE = new Set(['.html', '.js', '.mjs', '.css', '.json', '.svg', '.txt', '.map', '.xml', '.ico'])
+// below this size the headers cost more than compression saves
+const MIN_SIZE = 1024
+
+function walk(dir) {
+  return readdirSync(dir).flatMap(name => {
+    const path = join(dir, name)
+    return statSync(path).isDirectory() ? walk(path) : [path]
+  })
+}
+
+let written = 0
+for (const path of walk(DIST)) {
+  if (!COMPRESSIBLE.has(extname(path))) continue
+  const content = readFileSync(path)
+  if (content.length < MIN_SIZE) continue
+  const br = brotliCompressSync(content, {
+    params: { [constants.BROTLI_PARAM_QUALITY]: constants.BROTLI_MAX_QUALITY, [constants.BROTLI_PARAM_SIZE_HINT]: content.length }
+  })
+  const gz = gzipSync(content, { level: 9 })
+  // keep a variant only if it is actually smaller
+  if (br.length < content.length) { writeFileSync(`${path}.br`, br); written++ }
+  if (gz.length < content.length) { writeFileSync(`${path}.gz`, gz); written++ }
+}
+console.log(`precompress: wrote ${written} compressed files in ${DIST}`)
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import Questionnaire from './components/Questionnaire'
 import FileSelection from './components/FileSelection'
 import ClientInfo from './components/ClientInfo'
@@ -17,6 +17,8 @@ function App() {
   const [fileName, setFileName] = useState('')
   const [page, setPage] = useState('file-selection')
   const [currentNav, setCurrentNav] = useState('CASES')
+  // last saved state of the open case, later saves only send what changed since
+  const savedRef = useRef(null)
 
   useEffect(() => {
     axios.get(`${API_URL}/api/check_login`)
@@ -24,9 +26,10 @@ function App() {
       .catch(() => setLoggedIn(false))
   }, [])
 
-  const handleFileSelected = (file, loadedAnswers, loadedClientInfo) => {
+  const handleFileSelected = (file, loadedAnswers, loadedClientInfo, version) => {
     setFileName(file)
     setAnswers(loadedAnswers)
+    savedRef.current = { fileName: file, answers: loadedAnswers, clientInfo: loadedClientInfo, version }
     if (loadedClientInfo) {
       setClientInfo(loadedClientInfo)
       setPage('questionnaire')
@@ -36,6 +39,7 @@ function App() {
   }
 
   const handleNewFile = () => {
+    savedRef.current = null
     setFileName('')
     setAnswers({})
     setClientInfo(null)
@@ -47,20 +51,56 @@ function App() {
     setPage('questionnaire')
   }
 
-  const handleSave = async () => {
-    if (!fileName) {
-      const name = prompt('Enter a file name to save:')
-      if (!name) return
-      setFileName(name)
+  // JSON-patch operations turning the last saved state into the current one
+  const changesSince = (saved) => {
+    const ops = []
+    const escape = key => key.replace(/~/g, '~0').replace(/\//g, '~1')
+    Object.keys(answers).forEach(key => {
+      const path = `/answers/${escape(key)}`
+      if (!(key in saved.answers)) {
+        ops.push({ op: 'add', path, value: answers[key] })
+      } else if (JSON.stringify(saved.answers[key]) !== JSON.stringify(answers[key])) {
+        ops.push({ op: 'replace', path, value: answers[key] })
+      }
+    })
+    Object.keys(saved.answers).forEach(key => {
+      if (!(key in answers)) ops.push({ op: 'remove', path: `/answers/${escape(key)}` })
+    })
+    if (JSON.stringify(saved.clientInfo ?? null) !== JSON.stringify(clientInfo ?? null)) {
+      ops.push({ op: 'replace', path: '/clientInfo', value: clientInfo })
     }
+    return ops
+  }
+
+  const handleSave = async () => {
+    const name = fileName || prompt('Enter a file name to save:')
+    if (!name) return
+    setFileName(name)
     try {
-      await axios.post(`${API_URL}/api/save_answers`, {
-        filename: fileName,
-        answers,
-        clientInfo: clientInfo
-      })
+      const saved = savedRef.current
+      let version
+      if (saved && saved.fileName === name && saved.version) {
+        const ops = changesSince(saved)
+        version = saved.version
+        if (ops.length > 0) {
+          const res = await axios.patch(`${API_URL}/api/answers`, { filename: name, version, ops })
+          version = res.data.version
+        }
+      } else {
+        const res = await axios.post(`${API_URL}/api/save_answers`, {
+          filename: name,
+          answers,
+          clientInfo: clientInfo
+        })
+        version = res.data.version
+      }
+      savedRef.current = { fileName: name, answers, clientInfo, version }
       alert('Saved successfully')
     } catch (err) {
+      if (err.response?.status === 409) {
+        alert('This case was changed in another tab or window. Load it again before saving.')
+        return
+      }
       console.error('Error saving', err)
       alert('Error saving file')
     }
@@ -125,7 +165,7 @@ function App() {
       <main className="app-main">
         {loggedIn ? (
           resultHtml ? (
-            <Result html={resultHtml} onBack={() => setResultHtml(null)} />
+            <Result html={resultHtml} caseName={fileName} onBack={() => setResultHtml(null)} />
           ) : (
             <>
               {page === 'profile' ? (
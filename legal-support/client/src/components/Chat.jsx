@@ -1,8 +1,7 @@
 import React, { useState, useEffect, useRef } from 'react'
-import axios from 'axios'
 import API_URL from '../api'
 
-function Chat({ debug }) {
+function Chat({ debug, caseName }) {
   const [messages, setMessages] = useState([])
   const [input, setInput] = useState('')
   const [loading, setLoading] = useState(false)
@@ -32,16 +31,51 @@ function Chat({ debug }) {
     }
   }, [debug])
 
+  // POST the new message to /api/chat (the server keeps the history of the case),
+  // read the reply as Server-Sent Events and call onDelta with the text received so far
+  const streamChat = async (message, onDelta) => {
+    const res = await fetch(`${API_URL}/api/chat`, {
+      method: 'POST',
+      credentials: 'include',
+      headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+      body: JSON.stringify({ message, case: caseName })
+    })
+    if (!res.ok || !res.body) {
+      throw new Error(`Chat request failed with status ${res.status}`)
+    }
+    const reader = res.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let reply = ''
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      const events = buffer.split('\n\n')
+      buffer = events.pop()
+      for (const event of events) {
+        const dataLine = event.split('\n').find(line => line.startsWith('data: '))
+        if (!dataLine) continue
+        const payload = JSON.parse(dataLine.slice(6))
+        if (payload.error) throw new Error(payload.error)
+        if (payload.delta) {
+          reply += payload.delta
+          onDelta(reply)
+        }
+      }
+    }
+    return reply
+  }
+
   const send = async (newMessage) => {
     const updated = [...messages, { role: 'user', content: newMessage }]
     setMessages(updated)
     try {
       setLoading(true)
       startTimer()
-      const res = await axios.post(`${API_URL}/api/chat`, { messages: updated })
-      const reply = res.data.reply
-      const htmlReply = markdownToHtml(reply)
-      setMessages([...updated, { role: 'assistant', content: htmlReply }])
+      await streamChat(newMessage, reply => {
+        setMessages([...updated, { role: 'assistant', content: markdownToHtml(reply) }])
+      })
     } catch (err) {
       console.error('Error sending message', err)
       alert('Error communicating with the server')
@@ -62,10 +96,9 @@ function Chat({ debug }) {
     try {
       setLoading(true)
       startTimer()
-      const res = await axios.post(`${API_URL}/api/chat`, { messages: [] })
-      const reply = res.data.reply
-      const htmlReply = markdownToHtml(reply)
-      setMessages([{ role: 'assistant', content: htmlReply }])
+      await streamChat('', reply => {
+        setMessages([{ role: 'assistant', content: markdownToHtml(reply) }])
+      })
     } catch (err) {
       console.error('Error sending initial prompt', err)
       alert('Error communicating with the server')
@@ -30,7 +30,7 @@ function FileSelection({ onSelectFile, onNewFile, onBack }) {
     }
     try {
       const loadRes = await axios.get(`${API_URL}/api/load_answers`, { params: { filename: selectedFile } })
-      onSelectFile(selectedFile, loadRes.data.answers || {}, loadRes.data.clientInfo)
+      onSelectFile(selectedFile, loadRes.data.answers || {}, loadRes.data.clientInfo, loadRes.data.version)
     } catch (err) {
       console.error('Error loading', err)
       alert('Error loading file')
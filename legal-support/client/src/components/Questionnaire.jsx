@@ -26,6 +26,7 @@ function Questionnaire({ onSubmit, answers, setAnswers, clientInfo, setClientInf
               ...q,
               sectionTitle: section.title,
               sectionNumber: section.section_number,
+              serverLevel: q.level,
               level: 0 // Will be calculated for nested questions
             })
           })
@@ -43,38 +44,39 @@ function Questionnaire({ onSubmit, answers, setAnswers, clientInfo, setClientInf
   }
 
   // Calculate visible questions based on conditionals and build question tree
+  // (same rules as the server: a question is shown only if its parent is shown)
   const { visibleQuestions, questionTree } = useMemo(() => {
     const visible = []
     const tree = []
+    const visibleIds = new Set()
     let questionIndex = 0
 
     allQuestions.forEach(q => {
       let shouldShow = true
       
-      // Check conditional logic
+      // Check conditional logic, as question_graph.evaluate does: "parent,'value'" needs
+      // that answer, a bare "parent" any non-empty answer
       if (q.conditional_on) {
-        const [depId, requiredValue] = q.conditional_on.split(',')
-        const actualValue = answers[depId?.trim()]
-        shouldShow = actualValue === requiredValue?.trim().replace(/['"]+/g, '')
+        const raw = String(q.conditional_on)
+        const comma = raw.indexOf(',')
+        const depId = (comma < 0 ? raw : raw.slice(0, comma)).trim()
+        const requiredValue = comma < 0 ? null : raw.slice(comma + 1).trim().replace(/^['"]+|['"]+$/g, '')
+        const actualValue = answers[depId]
+        const answered = actualValue !== undefined && actualValue !== null && String(actualValue).trim() !== ''
+        shouldShow = visibleIds.has(depId) && (requiredValue === null
+          ? answered
+          : actualValue !== undefined && actualValue !== null && String(actualValue).trim() === requiredValue)
       }
 
       if (shouldShow) {
-        // Calculate nesting level
-        let level = 0
-        if (q.conditional_on) {
-          const [depId] = q.conditional_on.split(',')
-          const parentIndex = visible.findIndex(vq => vq.id === depId?.trim())
-          if (parentIndex >= 0) {
-            level = visible[parentIndex].level + 1
-          }
-        }
-
+        // Nesting level comes from the server's question graph (1 = top level)
         const questionWithLevel = {
           ...q,
-          level,
+          level: (q.serverLevel || 1) - 1,
           index: questionIndex++
         }
         visible.push(questionWithLevel)
+        visibleIds.add(q.id)
         tree.push(questionWithLevel)
       }
     })
@@ -127,7 +129,7 @@ function Questionnaire({ onSubmit, answers, setAnswers, clientInfo, setClientInf
   const handleSubmit = async (e) => {
     e.preventDefault()
     try {
-      const res = await axios.post(`${API_URL}/api/compile_summary`, { answers })
+      const res = await axios.post(`${API_URL}/api/compile_summary`, { answers, case: fileName })
       if (onSubmit) onSubmit(res.data.html)
     } catch (err) {
       console.error('Error submitting form:', err)
@@ -3,7 +3,7 @@ import Chat from './Chat'
 import axios from 'axios'
 import API_URL from '../api'
 
-function Result({ html, onBack }) {
+function Result({ html, caseName, onBack }) {
   const [debug, setDebug] = useState(false)
 
   useEffect(() => {
@@ -24,7 +24,7 @@ function Result({ html, onBack }) {
           <div dangerouslySetInnerHTML={{ __html: html }} />
         </>
       )}
-      <Chat debug={debug} />
+      <Chat debug={debug} caseName={caseName} />
     </div>
   )
 }
@@ -0,0 +1,185 @@
+'''
+This file contains the server-side conversation store used by the chat.
+A conversation is the case prompt compiled from the questionnaire followed
+by the chat turns, kept per (user, case). The client only sends the new
+message; the history is looked up here.
+
+Conversations are held in a bounded in-memory LRU (by count and by size)
+and expire after a TTL of inactivity. With a spill bucket every change is
+also written to GCS, so any process can continue a conversation and an
+evicted one can be read back; a copy in memory is revalidated with a
+conditional read, which is a metadata round trip when it is current.
+'''
+# import packages
+import collections
+import json
+import threading
+import time
+from urllib.parse import quote
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+import google_storage_utility
+
+# newest messages kept after the case prompt; older ones are dropped
+MAX_MESSAGES = 200
+# attempts at appending when another process writes the same conversation
+APPEND_RETRIES = 5
+
+
+class ConversationStore:
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=24 * 3600,
+                 spill_bucket=None, spill_prefix="conversations"):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_bucket = spill_bucket
+        self.spill_prefix = spill_prefix.rstrip("/") + "/"
+        # (user, case) -> {"messages", "updated_at", "generation", "size"}
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._spill_reads = 0
+        self._evictions = 0
+
+    def _object_name(self, user, case):
+        return f"{self.spill_prefix}{quote(user, safe='')}/{quote(case or '_current', safe='')}.json"
+
+    def get(self, user, case):
+        '''Return the conversation's messages (a new list) or None'''
+        key = (user, case or "")
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if self.spill_bucket:
+            entry = self._revalidate(key, entry)
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return list(entry["messages"])
+
+    def start(self, user, case, prompt):
+        '''Begin a conversation on a case with its prompt, replacing any earlier one'''
+        key = (user, case or "")
+        messages = [{"role": "user", "content": prompt}]
+        generation = self._spill(key, messages, None, force=True)
+        self._remember(key, messages, generation)
+
+    def append(self, user, case, new_messages, restart=False):
+        '''
+        Add messages to a conversation; with restart the chat turns are
+        dropped first and only the case prompt is kept.
+        '''
+        key = (user, case or "")
+        for _ in range(APPEND_RETRIES):
+            with self._lock:
+                entry = self._entries.get(key)
+            if self.spill_bucket:
+                entry = self._revalidate(key, entry)
+            if entry is None:
+                return False
+            messages = entry["messages"][:1] if restart else list(entry["messages"])
+            messages += new_messages
+            if len(messages) > MAX_MESSAGES + 1:
+                messages = messages[:1] + messages[-MAX_MESSAGES:]
+            try:
+                generation = self._spill(key, messages, entry.get("generation"))
+            except PreconditionFailed:
+                # written by another process meanwhile, append to that version
+                continue
+            self._remember(key, messages, generation)
+            return True
+        raise RuntimeError("Could not save the conversation, too many concurrent writes")
+
+    def forget(self, user, case):
+        key = (user, case or "")
+        with self._lock:
+            self._drop(key)
+        if self.spill_bucket:
+            try:
+                google_storage_utility.delete_cs_file(self.spill_bucket, self._object_name(*key))
+            except NotFound:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "spill_reads": self._spill_reads,
+                "evictions": self._evictions,
+                "spill": bool(self.spill_bucket),
+            }
+
+    def _expired(self, entry):
+        return self.ttl and time.time() - entry["updated_at"] > self.ttl
+
+    def _remember(self, key, messages, generation, updated_at=None):
+        size = len(json.dumps(messages))
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = {
+                "messages": messages,
+                "updated_at": updated_at or time.time(),
+                "generation": generation,
+                "size": size,
+            }
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                if oldest == key:
+                    break
+                self._drop(oldest)
+                self._evictions += 1
+        with self._lock:
+            return self._entries.get(key)
+
+    def _drop(self, key):
+        # called with the lock held
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    def _spill(self, key, messages, generation, force=False):
+        # write the conversation to GCS; returns its generation, None without a spill bucket
+        if not self.spill_bucket:
+            return None
+        record = {"messages": messages, "updated_at": time.time()}
+        return google_storage_utility.write_cs_object(
+            self.spill_bucket, self._object_name(*key), json.dumps(record),
+            if_generation_match=None if force else (generation or 0))
+
+    def _revalidate(self, key, entry):
+        # return the current version of a conversation, reading GCS only if it changed
+        generation = entry["generation"] if entry is not None else None
+        try:
+            content, new_generation = google_storage_utility.read_cs_object(
+                self.spill_bucket, self._object_name(*key), if_generation_not_match=generation)
+        except NotFound:
+            with self._lock:
+                self._drop(key)
+            return None
+        except Exception:
+            # the bucket is unreachable, carry on with the copy in memory
+            return entry
+        if content is None:
+            return entry
+        with self._lock:
+            self._spill_reads += 1
+        record = json.loads(content)
+        if self.ttl and time.time() - record.get("updated_at", 0) > self.ttl:
+            with self._lock:
+                self._drop(key)
+            return None
+        return self._remember(key, record["messages"], new_generation, record.get("updated_at"))
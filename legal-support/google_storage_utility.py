@@ -1,39 +1,214 @@
 '''
 This file contains utilities to upload and download files from a google bucket
+
+All helpers share one lazily created storage client (and so one pooled,
+keep-alive HTTP session) plus cached bucket handles, instead of building a
+new storage.Client() on every call. google.cloud.storage itself is only
+imported when the client is first needed, which keeps it out of cold starts.
+Timeouts and retries are configurable through environment variables and
+every operation records its latency. Reads and listings are always retried;
+uploads, writes and deletes only when they carry a generation precondition,
+as retrying them otherwise could repeat a write that already happened.
 '''
 # import packages
-from google.cloud import storage
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+import collections
+import functools
 import os
+import threading
+import time
 
 # set key credentials file path
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join("keys", "big-data-trial-0892438f38f4.json")
 
+# per-request timeout in seconds and overall retry deadline in seconds
+GCS_TIMEOUT = float(os.environ.get("GCS_TIMEOUT", "30"))
+GCS_RETRY_DEADLINE = float(os.environ.get("GCS_RETRY_DEADLINE", "60"))
+# size of the keep-alive connection pool shared by all request threads
+GCS_POOL_SIZE = int(os.environ.get("GCS_POOL_SIZE", "32"))
+
+_retry_policy = None
+_conditional_retry_policy = None
+_client = None
+_client_lock = threading.Lock()
+_buckets = {}
+
+# operation name -> {"count", "errors", "total", "max"}
+_stats = collections.defaultdict(lambda: {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+_stats_lock = threading.Lock()
+# functions called as observer(operation, seconds, ok) after every operation
+_observers = []
+
+
+def _retry():
+    # for idempotent calls: reads and listings
+    global _retry_policy
+    if _retry_policy is None:
+        from google.cloud.storage.retry import DEFAULT_RETRY
+        _retry_policy = DEFAULT_RETRY.with_timeout(GCS_RETRY_DEADLINE)
+    return _retry_policy
+
+
+def _retry_if_generation_specified():
+    # for writes and deletes: only retried when a generation precondition makes them idempotent
+    global _conditional_retry_policy
+    if _conditional_retry_policy is None:
+        from google.cloud.storage.retry import ConditionalRetryPolicy, is_generation_specified
+        _conditional_retry_policy = ConditionalRetryPolicy(_retry(), is_generation_specified, ["query_params"])
+    return _conditional_retry_policy
+
+
+def _written_by_us(blob, data):
+    '''
+    Generation of blob if it holds exactly data, else None. A conditional
+    write that is retried after its first attempt succeeded fails its
+    precondition against its own result; this tells that apart from a write
+    made by somebody else.
+    '''
+    try:
+        content = blob.download_as_bytes(raw_download=True, timeout=GCS_TIMEOUT, retry=_retry())
+    except NotFound:
+        return None
+    return blob.generation if content == data else None
+
+
+def _build_client():
+    import google.auth
+    from google.cloud import storage
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+
+    credentials, project = google.auth.default(
+        scopes=["https://www.googleapis.com/auth/devstorage.full_control"])
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=GCS_POOL_SIZE, pool_maxsize=GCS_POOL_SIZE)
+    session.mount("https://", adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
+
+
+def get_client():
+    '''Return the shared storage client, creating it on first use'''
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def get_bucket(bucket_name):
+    '''Return a cached bucket handle (no API call is made)'''
+    bucket = _buckets.get(bucket_name)
+    if bucket is None:
+        bucket = get_client().bucket(bucket_name)
+        _buckets[bucket_name] = bucket
+    return bucket
+
+
+def reset_client():
+    '''Drop the shared client and bucket handles, e.g. after a fork'''
+    global _client
+    with _client_lock:
+        _client = None
+        _buckets.clear()
+
+
+def _record(operation, seconds, ok):
+    with _stats_lock:
+        entry = _stats[operation]
+        entry["count"] += 1
+        entry["total"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        if not ok:
+            entry["errors"] += 1
+    for observer in _observers:
+        observer(operation, seconds, ok)
+
+
+def add_observer(observer):
+    '''Call observer(operation, seconds, ok) after every storage operation'''
+    _observers.append(observer)
+
+
+def _timed(operation):
+    # decorator recording latency and errors of a storage operation
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                _record(operation, time.perf_counter() - start, ok)
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    '''Latency stats per operation, times in milliseconds'''
+    with _stats_lock:
+        return {
+            operation: {
+                "count": entry["count"],
+                "errors": entry["errors"],
+                "avg_ms": entry["total"] / entry["count"] * 1000 if entry["count"] else 0.0,
+                "max_ms": entry["max"] * 1000,
+            }
+            for operation, entry in _stats.items()
+        }
+
+
 # define function that creates the bucket
-def create_bucket(bucket_name, storage_class='STANDARD', location='us-central1'): 
-    storage_client = storage.Client()
+@_timed("create_bucket")
+def create_bucket(bucket_name, storage_class='STANDARD', location='us-central1'):
+    storage_client = get_client()
 
     bucket = storage_client.bucket(bucket_name)
     bucket.storage_class = storage_class
-   
-    bucket = storage_client.create_bucket(bucket, location=location) 
+
+    bucket = storage_client.create_bucket(bucket, location=location, timeout=GCS_TIMEOUT, retry=_retry())
     # for dual-location buckets add data_locations=[region_1, region_2]
-    
+    _buckets[bucket_name] = bucket
+
     return f'Bucket {bucket.name} successfully created.'
 
 # define function that uploads a file from the bucket
-def upload_cs_file(bucket_name, source_file_name, destination_file_name): 
-    storage_client = storage.Client()
-
-    bucket = storage_client.bucket(bucket_name)
+@_timed("upload")
+def upload_cs_file(bucket_name, source_file_name, destination_file_name, metadata=None, content_encoding=None,
+                   if_generation_match=None):
+    '''
+    Upload a file and return the new generation. With if_generation_match the
+    upload only succeeds if the object is still at that generation (0 means
+    it must not exist yet); otherwise PreconditionFailed is raised.
+    '''
+    bucket = get_bucket(bucket_name)
 
     blob = bucket.blob(destination_file_name)
-    blob.upload_from_filename(source_file_name)
+    if metadata:
+        # custom metadata is returned by listings, so it can be shown without downloading
+        blob.metadata = metadata
+    if content_encoding:
+        # the file is compressed (see storage_codec), GCS stores it as is
+        blob.content_encoding = content_encoding
+    try:
+        blob.upload_from_filename(source_file_name, if_generation_match=if_generation_match,
+                                  timeout=GCS_TIMEOUT, retry=_retry_if_generation_specified())
+    except PreconditionFailed:
+        with open(source_file_name, "rb") as f:
+            generation = _written_by_us(bucket.blob(destination_file_name), f.read())
+        if generation is None:
+            raise
+        return generation
 
-    return True
+    # the new generation (always truthy) so callers can track object versions
+    return blob.generation
 
+@_timed("upload_directory")
 def upload_directory_to_cs(bucket_name, source_folder, destination_blob_prefix=""):
-    client = storage.Client()
-    bucket = client.get_bucket(bucket_name)
+    bucket = get_bucket(bucket_name)
 
     for root, _, files in os.walk(source_folder):
         for file in files:
@@ -43,36 +218,108 @@ def upload_directory_to_cs(bucket_name, source_folder, destination_blob_prefix="
             blob_path = os.path.join(destination_blob_prefix, relative_path).replace("\\", "/")
 
             blob = bucket.blob(blob_path)
-            blob.upload_from_filename(local_path)
+            blob.upload_from_filename(local_path, timeout=GCS_TIMEOUT, retry=_retry_if_generation_specified())
             print(f"Uploaded {local_path} to gs://{bucket_name}/{blob_path}")
 
 # define function that list files in the bucket
-def list_cs_files(bucket_name): 
-    storage_client = storage.Client()
+@_timed("list")
+def list_cs_files(bucket_name):
+    storage_client = get_client()
 
-    file_list = storage_client.list_blobs(bucket_name)
+    file_list = storage_client.list_blobs(bucket_name, timeout=GCS_TIMEOUT, retry=_retry())
     file_list = [file.name for file in file_list]
 
     return file_list
 
+# define function that lists one page of objects under a prefix
+@_timed("list_page")
+def list_cs_page(bucket_name, prefix, delimiter="/", page_size=100, page_token=None):
+    '''
+    Return (objects, next_page_token) for the objects directly under prefix.
+    Each object is a dict with name, size, updated (ISO 8601), generation
+    and metadata.
+    '''
+    iterator = get_client().list_blobs(
+        bucket_name,
+        prefix=prefix,
+        delimiter=delimiter,
+        page_size=page_size,
+        page_token=page_token,
+        fields="items(name,size,updated,generation,metadata),prefixes,nextPageToken",
+        timeout=GCS_TIMEOUT,
+        retry=_retry(),
+    )
+    page = next(iterator.pages, None)
+    objects = []
+    for blob in page or []:
+        objects.append({
+            "name": blob.name,
+            "size": blob.size,
+            "updated": blob.updated.isoformat() if blob.updated else None,
+            "generation": blob.generation,
+            "metadata": blob.metadata or {},
+        })
+    return objects, iterator.next_page_token
+
+# define function that reads a small object into memory
+@_timed("read")
+def read_cs_object(bucket_name, file_name, if_generation_not_match=None):
+    '''
+    Return (content bytes, generation); raises google.api_core.exceptions.NotFound.
+    With if_generation_not_match, returns (None, that generation) without
+    transferring the content if the object is still at that generation.
+    '''
+    bucket = get_bucket(bucket_name)
+
+    blob = bucket.blob(file_name)
+    try:
+        content = blob.download_as_bytes(if_generation_not_match=if_generation_not_match,
+                                         timeout=GCS_TIMEOUT, retry=_retry())
+    except NotModified:
+        return None, if_generation_not_match
+
+    return content, blob.generation
+
+# define function that writes a small object from memory
+@_timed("write")
+def write_cs_object(bucket_name, file_name, data, content_type="application/json", if_generation_match=None):
+    '''
+    Upload data and return the new generation. With if_generation_match the
+    write only succeeds if the object is still at that generation (0 means it
+    must not exist yet); otherwise google.api_core.exceptions.PreconditionFailed
+    is raised.
+    '''
+    bucket = get_bucket(bucket_name)
+
+    blob = bucket.blob(file_name)
+    try:
+        blob.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match,
+                                timeout=GCS_TIMEOUT, retry=_retry_if_generation_specified())
+    except PreconditionFailed:
+        sent = data.encode("utf-8") if isinstance(data, str) else data
+        generation = _written_by_us(bucket.blob(file_name), sent)
+        if generation is None:
+            raise
+        return generation
+
+    return blob.generation
+
 # define function that downloads a file from the bucket
+@_timed("download")
 def download_cs_file(bucket_name, file_name, destination_file_name):
-    storage_client = storage.Client()
-
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_bucket(bucket_name)
 
     blob = bucket.blob(file_name)
-    blob.download_to_filename(destination_file_name)
+    blob.download_to_filename(destination_file_name, timeout=GCS_TIMEOUT, retry=_retry())
 
     return True
 
 # delete a file from the bucket
+@_timed("delete")
 def delete_cs_file(bucket_name, file_name):
-    storage_client = storage.Client()
-
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_bucket(bucket_name)
 
     blob = bucket.blob(file_name)
-    blob.delete()
+    blob.delete(timeout=GCS_TIMEOUT, retry=_retry_if_generation_specified())
 
     return True
@@ -0,0 +1,79 @@
+'''
+This file contains helpers for JSON responses: payloads that only change
+with a version (the questionnaires) are encoded and gzipped once and served
+with an ETag, so a client holding the current version gets a 304; and every
+other JSON response above a size threshold is gzipped when the client
+accepts it.
+'''
+# import packages
+import gzip
+import hashlib
+import os
+
+from flask import Response, current_app, request
+from werkzeug.http import quote_etag
+
+# JSON bodies smaller than this are sent uncompressed
+GZIP_MIN_BYTES = int(os.environ.get("JSON_GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+
+
+class EncodedPayload:
+    '''A JSON body encoded once, with its gzipped form and ETag'''
+
+    def __init__(self, payload, etag):
+        # same bytes as jsonify()
+        self.body = current_app.json.response(payload).get_data()
+        self.gzipped = gzip.compress(self.body, 9) if len(self.body) >= GZIP_MIN_BYTES else None
+        self.etag = etag
+
+
+def versioned_etag(version, *parts):
+    '''ETag of a payload derived from a content version and whatever else shapes it'''
+    key = ":".join(str(p) for p in (version,) + parts)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:20]
+
+
+def cached_json(cache, key, etag, build):
+    '''
+    Response for the payload build() returns, encoded once per key and kept
+    in cache (a dict owned by the versioned object, so it goes away with it).
+    Answers 304 when the client sent the ETag.
+    '''
+    encoded = cache.get(key)
+    if encoded is None:
+        encoded = cache[key] = EncodedPayload(build(), etag)
+
+    use_gzip = encoded.gzipped is not None and request.accept_encodings.quality("gzip") > 0
+    # the gzipped body is a different representation, so it gets its own ETag
+    etag = f"{encoded.etag}-gzip" if use_gzip else encoded.etag
+    headers = {
+        "ETag": quote_etag(etag),
+        # per-user authorised content: browsers may keep it but must revalidate
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(encoded.gzipped, mimetype="application/json", headers=headers)
+    return Response(encoded.body, mimetype="application/json", headers=headers)
+
+
+def compress_response(response):
+    '''after_request hook gzipping JSON responses above GZIP_MIN_BYTES'''
+    if (response.mimetype != "application/json"
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or request.accept_encodings.quality("gzip") <= 0):
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,166 @@
+'''
+This file contains a content-addressed cache for LLM chat completions.
+Entries are keyed on a hash of the model and the normalised messages, kept in
+an in-memory LRU and, optionally, persisted as small JSON files next to the
+user's data so they survive restarts.
+'''
+# import packages
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def normalise_messages(messages):
+    # only role and content influence the completion; whitespace at the ends and
+    # line ending style must not produce different keys
+    normalised = []
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = content.replace("\r\n", "\n").strip()
+        normalised.append({"role": str(message.get("role", "")).strip().lower(), "content": content})
+    return normalised
+
+
+def reply_size(reply):
+    # bytes a reply is counted as against max_bytes
+    if isinstance(reply, str):
+        return len(reply.encode("utf-8"))
+    return len(json.dumps(reply, ensure_ascii=False).encode("utf-8"))
+
+
+def cache_key(model, messages):
+    payload = json.dumps({"model": model, "messages": normalise_messages(messages)},
+                         sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    '''
+    The in-memory tier holds at most max_entries replies and max_bytes of
+    reply text (the least recently used go first; a single reply larger than
+    max_bytes is not kept), each for ttl seconds. When persist_dir is set,
+    entries are also written to persist_dir/<user>/llm_cache/ and at most
+    max_disk_entries files are kept per user.
+    '''
+
+    def __init__(self, max_entries=256, ttl=7 * 24 * 3600, persist_dir=None, max_disk_entries=200,
+                 max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.persist_dir = persist_dir
+        self.max_disk_entries = max_disk_entries
+        # key -> (stored_at, reply, size)
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def _disk_dir(self, user):
+        return os.path.join(self.persist_dir, user, "llm_cache")
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def get(self, key, user=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry[0]):
+                    self._discard(key)
+                    self._counters["expired"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return entry[1]
+
+        if self.persist_dir and user:
+            entry = self._read_disk(user, key)
+            if entry is not None:
+                with self._lock:
+                    self._store_memory(key, entry)
+                    self._counters["disk_hits"] += 1
+                return entry[1]
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, key, reply, user=None):
+        entry = (time.time(), reply)
+        with self._lock:
+            self._store_memory(key, entry)
+            self._counters["stores"] += 1
+        if self.persist_dir and user:
+            try:
+                self._write_disk(user, key, entry)
+            except OSError:
+                pass
+
+    def _discard(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def _store_memory(self, key, entry):
+        size = reply_size(entry[1])
+        if key in self._entries:
+            self._discard(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = entry + (size,)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def _read_disk(self, user, key):
+        file_path = os.path.join(self._disk_dir(user), f"{key}.json")
+        try:
+            with open(file_path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(record["stored_at"]):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            return None
+        return (record["stored_at"], record["reply"])
+
+    def _write_disk(self, user, key, entry):
+        cache_dir = self._disk_dir(user)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = os.path.join(cache_dir, f"{key}.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"stored_at": entry[0], "reply": entry[1]}, f)
+        os.replace(tmp_path, os.path.join(cache_dir, f"{key}.json"))
+
+        files = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".json")]
+        if len(files) > self.max_disk_entries:
+            files.sort(key=os.path.getmtime)
+            for old in files[:len(files) - self.max_disk_entries]:
+                os.remove(old)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        for name in ("hits", "disk_hits", "misses", "stores", "evictions", "expired"):
+            stats.setdefault(name, 0)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["max_bytes"] = self.max_bytes
+        stats["ttl"] = self.ttl
+        stats["persistent"] = bool(self.persist_dir)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
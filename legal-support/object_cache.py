@@ -0,0 +1,218 @@
+'''
+This file contains a read-through cache of user objects stored in GCS.
+Local copies live under user_data/ as before. Each read sends a conditional
+request on the generation of the local copy, so unchanged objects are not
+downloaded again. The local store is kept under a byte budget by evicting
+the least recently used copies, and local writes and deletes update the
+cache directly. Every local write bumps a per-object write sequence; a
+download that overlaps a write is discarded rather than replacing the newer
+local copy.
+'''
+# import packages
+import collections
+import contextlib
+import os
+import threading
+import time
+
+from google.api_core.exceptions import NotFound
+
+import google_storage_utility
+
+
+class ObjectCache:
+    '''
+    max_bytes bounds the total size of the local copies tracked here.
+    revalidate_after (seconds) lets a copy that was checked against GCS very
+    recently be served without another round trip; 0 always revalidates.
+    '''
+
+    def __init__(self, bucket_name, max_bytes=256 * 1024 * 1024, revalidate_after=0):
+        self.bucket_name = bucket_name
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        # object name -> {"path", "generation", "base_generation", "size", "checked_at", "pinned"};
+        # base_generation is the GCS generation a pinned copy was written over
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        # object name -> number of local writes and deletes, see local_write()
+        self._writes = collections.Counter()
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def fetch(self, object_name, local_path):
+        '''
+        Return the content of object_name, refreshing local_path from GCS only
+        if the object changed. If GCS cannot be reached, the local copy is
+        served when there is one. Returns None if the object does not exist.
+        '''
+        with self._lock:
+            entry = self._entries.get(object_name)
+            if entry is not None:
+                self._entries.move_to_end(object_name)
+            sequence = self._writes[object_name]
+        if entry is not None and not os.path.exists(local_path):
+            entry = None
+
+        if entry is not None and (entry["pinned"] or time.time() - entry["checked_at"] < self.revalidate_after):
+            # pinned copies are local writes that are not in GCS yet, they are the newest version
+            self._count("fresh_hits")
+            return self._read(local_path)
+
+        generation = entry["generation"] if entry is not None else None
+        try:
+            content, generation = google_storage_utility.read_cs_object(
+                self.bucket_name, object_name, if_generation_not_match=generation)
+        except NotFound:
+            with self._lock:
+                raced = self._raced(object_name, sequence)
+            if raced:
+                # created locally while reading, not uploaded yet
+                self._count("raced_downloads")
+                return self._read(local_path) if os.path.exists(local_path) else None
+            self.invalidate(object_name, local_path)
+            self._count("not_found")
+            return None
+        except Exception:
+            # storage unavailable: fall back to whatever is on disk
+            self._count("errors")
+            return self._read(local_path) if os.path.exists(local_path) else None
+
+        if content is None:
+            self._count("not_modified")
+            with self._lock:
+                entry["checked_at"] = time.time()
+            return self._read(local_path)
+
+        tmp_path = self._write_tmp(local_path, content)
+        with self._lock:
+            raced = self._raced(object_name, sequence)
+            if not raced:
+                os.replace(tmp_path, local_path)
+                self._counters["downloads"] += 1
+                evicted = self._track_locked(object_name, local_path, generation, len(content), pinned=False)
+        if raced:
+            # saved or deleted while downloading: the local copy is newer than what was read
+            os.remove(tmp_path)
+            self._count("raced_downloads")
+            return self._read(local_path) if os.path.exists(local_path) else None
+        self._remove_files(evicted)
+        return content
+
+    @contextlib.contextmanager
+    def local_write(self, object_name, local_path):
+        '''
+        Wrap a local write of object_name. Downloads that started earlier no
+        longer replace the local copy, which is pinned once written. Yields
+        the write sequence to hand to record_write with the upload's generation.
+        '''
+        with self._lock:
+            self._writes[object_name] += 1
+            sequence = self._writes[object_name]
+        yield sequence
+        self.record_write(object_name, local_path)
+
+    def record_write(self, object_name, local_path, generation=None, sequence=None):
+        '''
+        Register a local write of object_name. Pass the generation returned by
+        the upload; without one the copy is pinned (never evicted or replaced)
+        until a later call provides it. With sequence, the generation is only
+        applied if no local write happened since that sequence was taken.
+        Returns False if it was not applied for that reason.
+        '''
+        size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+        with self._lock:
+            if generation is not None and sequence is not None and self._writes[object_name] != sequence:
+                # a newer write is not uploaded yet, the copy stays pinned and is now based on this upload
+                entry = self._entries.get(object_name)
+                if entry is not None:
+                    entry["base_generation"] = generation
+                self._counters["stale_uploads"] += 1
+                return False
+            evicted = self._track_locked(object_name, local_path, generation, size, pinned=generation is None)
+        self._remove_files(evicted)
+        return True
+
+    def base_generation(self, object_name):
+        '''
+        Generation of object_name in GCS that the local copy was read at or,
+        for a local write, written over; 0 when the object is not known to
+        exist, as for a new one.
+        '''
+        with self._lock:
+            entry = self._entries.get(object_name)
+            return entry["base_generation"] if entry is not None else 0
+
+    def invalidate(self, object_name, local_path=None):
+        '''Forget object_name, removing the local copy if local_path is given'''
+        with self._lock:
+            # a download in progress must not bring a deleted object back
+            self._writes[object_name] += 1
+            entry = self._entries.pop(object_name, None)
+            if entry is not None:
+                self._bytes -= entry["size"]
+        if local_path and os.path.exists(local_path):
+            os.remove(local_path)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _read(self, local_path):
+        with open(local_path, "rb") as f:
+            return f.read()
+
+    def _raced(self, object_name, sequence):
+        # called with the lock held: was object_name written or deleted locally since sequence was taken
+        entry = self._entries.get(object_name)
+        return self._writes[object_name] != sequence or (entry is not None and entry["pinned"])
+
+    def _write_tmp(self, local_path, content):
+        # written to a temporary file first so readers never see a partial copy
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        tmp_path = f"{local_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        return tmp_path
+
+    def _track_locked(self, object_name, local_path, generation, size, pinned):
+        # called with the lock held; returns the paths of evicted copies to remove
+        evicted = []
+        old = self._entries.pop(object_name, None)
+        if old is not None:
+            self._bytes -= old["size"]
+        self._entries[object_name] = {
+            "path": local_path,
+            "generation": generation,
+            "base_generation": generation if generation is not None else (old["base_generation"] if old else 0),
+            "size": size,
+            "checked_at": time.time(),
+            "pinned": pinned,
+        }
+        self._bytes += size
+        for name in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                break
+            entry = self._entries[name]
+            if name == object_name or entry["pinned"]:
+                continue
+            del self._entries[name]
+            self._bytes -= entry["size"]
+            self._counters["evictions"] += 1
+            evicted.append(entry["path"])
+        return evicted
+
+    def _remove_files(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
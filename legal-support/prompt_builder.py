@@ -0,0 +1,220 @@
+'''
+This file contains the prompt building for case analyses and chat.
+It counts tokens, encodes the questionnaire answers as a compact table and
+fits a conversation into a per-request token budget: the case prompt and
+the newest turns are kept, older turns are condensed into a short note and,
+if that is not enough, truncated.
+'''
+# import packages
+import html
+import re
+import threading
+
+import summary_renderer
+
+# the tiktoken module once loaded, False if it is not installed (a word-based estimate is used then)
+_tiktoken = None
+
+# tokens added by the chat format for every message
+MESSAGE_OVERHEAD = 4
+# characters of each condensed turn kept in the note that replaces old turns
+CONDENSED_CHARS = 160
+# newest messages that are never condensed
+KEEP_RECENT = 4
+TRUNCATED = "\n[truncated]"
+
+_ENCODINGS = {}
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+# HTML tags only, so "< 50k" or "<3" in a text survives
+_TAG_RE = re.compile(r"</?[A-Za-z][A-Za-z0-9]*(?:\s[^<>]*)?/?>")
+_BREAK_RE = re.compile(r"<br\s*/?>|</p>|</li>|</tr>|</h\d>", re.IGNORECASE)
+
+
+def _load_tiktoken():
+    # imported on first use, it is slow to import
+    global _tiktoken
+    if _tiktoken is None:
+        try:
+            import tiktoken
+            _tiktoken = tiktoken
+        except ImportError:
+            _tiktoken = False
+    return _tiktoken
+
+
+def _encoding(model):
+    tiktoken = _load_tiktoken()
+    if not tiktoken:
+        return None
+    encoding = _ENCODINGS.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        _ENCODINGS[model] = encoding
+    return encoding
+
+
+def count_tokens(text, model="gpt-4.1"):
+    '''Number of tokens in text, exact with tiktoken and estimated without'''
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(_WORD_RE.findall(text))
+
+
+def count_message_tokens(messages, model="gpt-4.1"):
+    return sum(count_tokens(str(m.get("content") or ""), model) + MESSAGE_OVERHEAD for m in messages)
+
+
+def compact_content(text):
+    '''
+    Turn HTML (summaries and replies rendered by the UI) into plain text,
+    which carries the same information in far fewer tokens.
+    '''
+    if not isinstance(text, str) or "<" not in text:
+        return text
+    text = _BREAK_RE.sub("\n", text)
+    text = text.replace("</td>", " | ").replace("</th>", " | ")
+    text = html.unescape(_TAG_RE.sub("", text))
+    lines = [line.strip() for line in text.split("\n")]
+    return "\n".join(line for line in lines if line)
+
+
+def _cell(value):
+    return str(value).replace("\r", " ").replace("\n", " ").replace("|", "/").strip()
+
+
+def encode_answers(compiled, answers):
+    '''
+    Compact table of the answers: the section is written once as a heading,
+    the impact value only when it differs from the neutral 0.5 and the reason
+    only when given.
+    '''
+    lines = ["Question | Answer | Impact | Reason"]
+    current_section = None
+    for section, label, answer, impact, reason, _, _ in summary_renderer.answer_rows(compiled, answers):
+        if section != current_section:
+            lines.append(f"# {_cell(section)}")
+            current_section = section
+        row = [_cell(label), _cell(answer)]
+        if impact != 0.5 or reason:
+            row.append(_cell(impact))
+        if reason:
+            row.append(_cell(reason))
+        lines.append(" | ".join(row))
+    return "\n".join(lines)
+
+
+def case_prompt(compiled, answers, template=summary_renderer.DEFAULT_TEMPLATE, profile_text=""):
+    '''The case analysis prompt with the compact answer table'''
+    template = summary_renderer.get_template(template)
+    parts = []
+    if profile_text:
+        parts.append(f"Profile: {profile_text}")
+    parts += [f"- {line}" for line in template.context]
+    parts.append("- The table below reports the answers to the questionnaire. Impact is 0.5 (neutral) when omitted.")
+    parts += [f"  - {note}" for note in summary_renderer.COLUMN_NOTES]
+    parts.append(encode_answers(compiled, answers))
+    parts.append(template.text_tail)
+    return "\n".join(parts)
+
+
+def _condense(messages):
+    lines = [f"Earlier conversation, condensed ({len(messages)} messages):"]
+    for m in messages:
+        content = " ".join(str(m.get("content") or "").split())
+        if len(content) > CONDENSED_CHARS:
+            content = content[:CONDENSED_CHARS] + "..."
+        lines.append(f"- {m.get('role')}: {content}")
+    return {"role": "system", "content": "\n".join(lines)}
+
+
+def _truncate(message, max_tokens, model):
+    content = str(message.get("content") or "")
+    # a message cut before keeps one marker
+    if content.endswith(TRUNCATED):
+        content = content[:-len(TRUNCATED)]
+    # cut proportionally, then trim until it fits
+    while count_tokens(content, model) > max_tokens and content:
+        ratio = max_tokens / max(count_tokens(content, model), 1)
+        content = content[:int(len(content) * ratio * 0.95)]
+    return {**message, "content": content + TRUNCATED}
+
+
+def fit_messages(messages, budget, model="gpt-4.1"):
+    '''
+    Return (messages, report) where messages fit in budget tokens.
+    The first message (the case prompt) and the KEEP_RECENT newest ones are
+    kept; anything between them is replaced by a condensed note, and the
+    longest remaining messages are truncated if still over budget.
+    Markup is only compacted in generated content, the case prompt and the
+    replies; what the user typed is sent as written.
+    '''
+    compacted = [{"role": m.get("role"),
+                  "content": compact_content(m.get("content")) if i == 0 or m.get("role") != "user"
+                  else m.get("content")}
+                 for i, m in enumerate(messages)]
+    original_tokens = count_message_tokens(messages, model)
+    result = compacted
+    condensed = 0
+    truncated = 0
+
+    if budget and count_message_tokens(result, model) > budget and len(result) > KEEP_RECENT + 1:
+        middle = result[1:-KEEP_RECENT]
+        result = [result[0], _condense(middle)] + result[-KEEP_RECENT:]
+        condensed = len(middle)
+
+    total = count_message_tokens(result, model)
+    while budget and total > budget:
+        # shorten the longest message that is not the newest one
+        candidates = range(len(result) - 1) if len(result) > 1 else range(len(result))
+        longest = max(candidates, key=lambda i: count_tokens(str(result[i].get("content") or ""), model))
+        current = count_tokens(str(result[longest].get("content") or ""), model)
+        result[longest] = _truncate(result[longest], max(current - (total - budget), 1), model)
+        truncated += 1
+        new_total = count_message_tokens(result, model)
+        if new_total >= total:
+            # nothing left to cut, the budget is smaller than the fixed overhead
+            break
+        total = new_total
+
+    report = {
+        "original_prompt_tokens": original_tokens,
+        "prompt_tokens_estimate": count_message_tokens(result, model),
+        "condensed_messages": condensed,
+        "truncated_messages": truncated,
+        "budget": budget,
+    }
+    return result, report
+
+
+class TokenStats:
+    '''Running totals of tokens sent and received, and tokens saved by compaction'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.saved_tokens = 0
+
+    def record(self, report, usage):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += usage.get("prompt_tokens", report["prompt_tokens_estimate"])
+            self.completion_tokens += usage.get("completion_tokens") or 0
+            self.saved_tokens += max(report["original_prompt_tokens"] - report["prompt_tokens_estimate"], 0)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "saved_prompt_tokens": self.saved_tokens,
+                "exact_counts": bool(_load_tiktoken()),
+            }
@@ -0,0 +1,148 @@
+'''
+This file contains the dependency graph of the conditional questions of a
+questionnaire. A question with "Conditional on question" set to
+"parent_id,'value'" is shown only when its parent is shown and answered
+with that value. The graph is compiled once per workbook: conditions are
+parsed once, cycles and conditions on unknown questions are detected and
+dropped (the question is then always shown), questions are put in an order
+where every parent comes before its children, and the depth of every
+question is computed. Visibility of a full answer set is then one pass.
+'''
+
+# answer keys that belong to a question but are not the answer itself
+ANSWER_SUFFIXES = ("_slider", "_explanation")
+
+
+def parse_condition(raw):
+    '''
+    "question_id,'value'" -> ("question_id", "value"); "question_id" ->
+    ("question_id", None), meaning any non-empty answer. None if empty.
+    '''
+    if raw is None:
+        return None
+    raw = str(raw).strip()
+    if not raw or raw.lower() == "nan":
+        return None
+    parent, sep, value = raw.partition(",")
+    value = value.strip().strip("'\"") if sep else None
+    return parent.strip(), value
+
+
+def _answered(value):
+    return value is not None and str(value).strip() != ""
+
+
+class QuestionGraph:
+
+    def __init__(self, questions):
+        '''
+        questions: (id, condition, mandatory, is_label) in questionnaire order,
+        condition as returned by parse_condition
+        '''
+        ids = [str(qid) for qid, _, _, _ in questions]
+        known = set(ids)
+        self.mandatory = frozenset(str(qid) for qid, _, mandatory, is_label in questions
+                                   if mandatory and not is_label)
+        # question id -> (parent id, required value or None)
+        self.conditions = {}
+        # question ids whose condition was dropped -> reason
+        self.dropped = {}
+        for qid, condition, _, _ in questions:
+            if condition is None:
+                continue
+            if condition[0] not in known:
+                self.dropped[str(qid)] = f"conditional on unknown question {condition[0]}"
+                continue
+            self.conditions[str(qid)] = condition
+
+        self.cycles = self._break_cycles(ids)
+
+        # parents before children, otherwise in questionnaire order; depth 1 for unconditional questions
+        self.order = []
+        self.levels = {}
+        for qid in ids:
+            chain = []
+            node = qid
+            while node is not None and node not in self.levels:
+                chain.append(node)
+                condition = self.conditions.get(node)
+                node = condition[0] if condition else None
+            for node in reversed(chain):
+                condition = self.conditions.get(node)
+                self.levels[node] = self.levels[condition[0]] + 1 if condition else 1
+                self.order.append(node)
+        self.order = tuple(self.order)
+
+    def _break_cycles(self, ids):
+        # every question has at most one parent, so a cycle is found by following parents
+        cycles = []
+        state = {}  # id -> "active" while on the current path, "done" after
+        for start in ids:
+            path = []
+            node = start
+            while node is not None and node not in state:
+                state[node] = "active"
+                path.append(node)
+                condition = self.conditions.get(node)
+                node = condition[0] if condition else None
+            if node is not None and state[node] == "active":
+                cycle = path[path.index(node):]
+                # drop the condition of the member asked first, its parent cannot come before it
+                first = min(cycle, key=ids.index)
+                del self.conditions[first]
+                self.dropped[first] = "conditional cycle: " + " -> ".join(cycle + [cycle[0]])
+                cycles.append(cycle)
+            for member in path:
+                state[member] = "done"
+        return cycles
+
+    def condition_of(self, qid):
+        return self.conditions.get(str(qid))
+
+    def level(self, qid):
+        return self.levels.get(str(qid), 1)
+
+    def evaluate(self, answers):
+        '''
+        One pass over the questions: returns (visible ids, missing mandatory
+        ids), both in dependency order.
+        '''
+        visible = []
+        shown = set()
+        missing = []
+        for qid in self.order:
+            condition = self.conditions.get(qid)
+            if condition is not None:
+                parent, value = condition
+                if parent not in shown:
+                    continue
+                answer = answers.get(parent)
+                if value is None:
+                    if not _answered(answer):
+                        continue
+                elif answer is None or str(answer).strip() != value:
+                    continue
+            visible.append(qid)
+            shown.add(qid)
+            if qid in self.mandatory and not _answered(answers.get(qid)):
+                missing.append(qid)
+        return visible, missing
+
+    def visible_answers(self, answers):
+        '''answers without the entries (answer, slider, explanation) of hidden questions'''
+        if not self.conditions:
+            return answers
+        visible, _ = self.evaluate(answers)
+        hidden = set(self.order).difference(visible)
+        if not hidden:
+            return answers
+        result = {}
+        for key, value in answers.items():
+            base = key
+            for suffix in ANSWER_SUFFIXES:
+                if key.endswith(suffix) and key[:-len(suffix)] in hidden:
+                    base = key[:-len(suffix)]
+                    break
+            if base not in hidden:
+                result[key] = value
+        return result
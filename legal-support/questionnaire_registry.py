@@ -0,0 +1,331 @@
+'''
+This file contains an in-process registry of the questionnaire workbooks.
+Each workbook is parsed once and the result is kept in memory; it is only
+parsed again when the file on disk changes. QuestionnaireIndex maps the
+questionnaire types (questionnaires/<type>/questions.xlsx) to workbooks.
+'''
+# import packages
+import ast
+import hashlib
+import io
+import os
+import threading
+import time
+
+from question_graph import QuestionGraph, parse_condition
+
+QUESTIONS_FILE = "questions.xlsx"
+# version of the shape of the payloads served from a workbook, part of their ETags; bump it whenever
+# fields are added, removed or computed differently, so clients holding an old ETag get the new body
+# 2: question levels, self-referencing conditions dropped
+PAYLOAD_VERSION = 2
+
+# path -> CompiledQuestionnaire
+_ENTRIES = {}
+_LOCK = threading.Lock()
+
+
+class CompiledQuestionnaire:
+    '''
+    Parsed content of one questions.xlsx workbook. The payloads are shared
+    between requests, so callers must treat them as read-only.
+    '''
+
+    def __init__(self, path, version, signature, sections, questions, sections_by_number, graph):
+        self.path = path
+        # short content hash, changes only when the workbook content changes
+        self.version = version
+        # (mtime, size) of the file when it was last checked
+        self.signature = signature
+        # shape served by app.py: [{"section_number", "title", "questions"}]
+        self.sections = sections
+        # shape served by /api/questionnaire/<type>: flat list + grouping by section
+        self.questions = questions
+        self.sections_by_number = sections_by_number
+        # conditional question dependencies: levels, visibility, missing mandatory answers
+        self.graph = graph
+        # encoded response bodies by shape, filled in by the routes
+        self.encoded = {}
+
+    def sections_payload(self):
+        return {"sections": self.sections}
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _build_sections(sections_df, questions_df):
+    import pandas as pd
+    sections = []
+    for _, section in sections_df.iterrows():
+        sec_num = section["Section number"]
+        section_questions = questions_df[questions_df["Section"] == sec_num].sort_values(by="Question number")
+
+        questions = []
+        for _, q in section_questions.iterrows():
+            q = {
+                "id": q["Id"],
+                "label": q["Label"],
+                "type": q["Type"].lower().strip(),
+                "parameters": ast.literal_eval(q["Parameters"]) if pd.notna(q["Parameters"]) else None,
+                "conditional_on": str(q["Conditional on question"]) if pd.notna(q["Conditional on question"]) else None,
+                "mandatory": str(q["Mandatory"]).strip().lower() == "yes",
+                "slider": str(q["Needs a slider"]).strip().lower() == "yes",
+                "default_slider_value": float(q["Default value of slider"]) if pd.notna(q["Default value of slider"]) else None,
+                "level": 1
+            }
+
+            questions.append(q)
+
+        sections.append({
+            "section_number": sec_num,
+            "title": section["Title"],
+            "questions": questions
+        })
+    return sections
+
+
+def _build_questions(df):
+    import pandas as pd
+    sections = {}
+    questions = []
+
+    for index, row in df.iterrows():
+        # Skip empty rows
+        if pd.isna(row.get('Question number')) and pd.isna(row.get('Label')):
+            continue
+
+        # Extract data from Excel columns
+        question_number = row.get('Question number')
+        section = row.get('Section', '')
+        question_id = row.get('Id', f'q_{index}')
+        label = row.get('Label', '')
+        question_type = row.get('Type', 'Short text')
+        parameters = row.get('Parameters', '')
+        conditional_on = row.get('Conditional on question', '')
+        mandatory = row.get('Mandatory', 'Yes')
+        needs_slider = row.get('Needs a slider', 'Yes')
+        default_slider_value = row.get('Default value of slider', 0.5)
+
+        # Parse conditional logic
+        # Format: "question_id,'value'" or just "question_id"
+        condition = parse_condition(conditional_on) if pd.notna(conditional_on) else None
+        conditional_question_id, conditional_value = condition or (None, None)
+
+        # Parse parameters for Multiple Choice
+        options = []
+        if pd.notna(parameters) and str(parameters).strip():
+            param_str = str(parameters).strip()
+            # Check if it's a list format
+            if param_str.startswith('[') and param_str.endswith(']'):
+                try:
+                    options = ast.literal_eval(param_str)
+                except (ValueError, SyntaxError):
+                    options = []
+
+        # Determine if this is a display-only label
+        is_label = str(question_type).lower() == 'label'
+
+        # Build question object
+        question = {
+            'id': str(question_id) if pd.notna(question_id) else f'q_{index}',
+            'questionNumber': int(question_number) if pd.notna(question_number) else None,
+            'section': int(section) if pd.notna(section) else None,
+            'label': str(label) if pd.notna(label) else '',
+            'type': str(question_type).lower() if pd.notna(question_type) else 'short text',
+            'parameters': str(parameters) if pd.notna(parameters) else '',
+            'options': options,
+            'conditionalQuestionId': conditional_question_id,
+            'conditionalValue': conditional_value,
+            'mandatory': str(mandatory).lower() in ['yes', 'true', '1'] if pd.notna(mandatory) else False,
+            'needsSlider': str(needs_slider).lower() in ['yes', 'true', '1'] if pd.notna(needs_slider) else False,
+            'defaultSliderValue': float(default_slider_value) if pd.notna(default_slider_value) else 0.5,
+            'isLabel': is_label,
+            'answer': '',
+            'severity': float(default_slider_value) if pd.notna(default_slider_value) else 0.5
+        }
+
+        questions.append(question)
+
+        # Group by section
+        section_key = int(section) if pd.notna(section) else 0
+        if section_key not in sections:
+            sections[section_key] = []
+        sections[section_key].append(question)
+
+    return questions, sections
+
+
+def _build_graph(sections, questions):
+    '''
+    Dependency graph of the conditional questions. Conditions that are cycles
+    or refer to unknown questions are dropped from both shapes, so the client
+    and the server agree on what is shown; the depth of every question is
+    filled in as its level.
+    '''
+    if sections:
+        rows = [(q["id"], parse_condition(q["conditional_on"]), q["mandatory"], q["type"] == "label")
+                for section in sections for q in section["questions"]]
+    else:
+        rows = [(q["id"], (q["conditionalQuestionId"], q["conditionalValue"]) if q["conditionalQuestionId"] else None,
+                 q["mandatory"], q["isLabel"])
+                for q in questions]
+    graph = QuestionGraph(rows)
+
+    for section in sections:
+        for q in section["questions"]:
+            if q["id"] in graph.dropped:
+                q["conditional_on"] = None
+            q["level"] = graph.level(q["id"])
+    for q in questions:
+        if q["id"] in graph.dropped:
+            q["conditionalQuestionId"] = q["conditionalValue"] = None
+    return graph
+
+
+def _compile(path, content, version, signature):
+    # pandas is imported on the first parse, not when the app starts
+    import pandas as pd
+    # read every sheet in a single pass over the workbook
+    sheets = pd.read_excel(io.BytesIO(content), sheet_name=None)
+    first_sheet = next(iter(sheets.values()))
+
+    if "Sections" in sheets and "Questions" in sheets:
+        sections = _build_sections(sheets["Sections"], sheets["Questions"])
+    else:
+        sections = []
+    questions, sections_by_number = _build_questions(first_sheet)
+    graph = _build_graph(sections, questions)
+
+    return CompiledQuestionnaire(path, version, signature, sections, questions, sections_by_number, graph)
+
+
+def compile_workbook(path):
+    '''Parse a workbook without touching the cache'''
+    signature = _file_signature(path)
+    with open(path, "rb") as f:
+        content = f.read()
+    version = hashlib.sha256(content).hexdigest()[:16]
+    return _compile(path, content, version, signature)
+
+
+def get_questionnaire(path):
+    '''
+    Return the CompiledQuestionnaire for path, parsing the workbook only if it
+    is not cached yet or its mtime/size changed. A touched file whose content
+    hash is unchanged keeps its cached entry.
+    Raises FileNotFoundError if the workbook does not exist.
+    '''
+    path = os.path.abspath(path)
+    signature = _file_signature(path)
+    entry = _ENTRIES.get(path)
+    if entry is not None and entry.signature == signature:
+        return entry
+
+    with _LOCK:
+        entry = _ENTRIES.get(path)
+        if entry is not None and entry.signature == signature:
+            return entry
+        with open(path, "rb") as f:
+            content = f.read()
+        version = hashlib.sha256(content).hexdigest()[:16]
+        if entry is not None and entry.version == version:
+            entry.signature = signature
+            return entry
+        entry = _compile(path, content, version, signature)
+        _ENTRIES[path] = entry
+        return entry
+
+
+def clear():
+    '''Drop every cached workbook'''
+    with _LOCK:
+        _ENTRIES.clear()
+
+
+def questionnaire_id(name):
+    '''Normalised questionnaire type: "Personal injury case" -> "personal_injury_case"'''
+    return str(name).strip().lower().replace(" ", "_")
+
+
+class QuestionnaireIndex:
+    '''
+    Index of <root>/*/questions.xlsx by questionnaire type. A type resolves
+    by its folder name or id ("Personal injury case", "personal_injury_case")
+    or by the id without the "_case" suffix ("personal_injury"); no type
+    means default_path. The folders are scanned when the index is created
+    and again when their modification times change, checked at most every
+    check_interval seconds.
+    '''
+
+    def __init__(self, root, default_path=None, check_interval=2.0):
+        self.root = os.path.abspath(root)
+        self.default_path = os.path.abspath(default_path) if default_path else None
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        # (directory signature, type -> path, listing), replaced as a whole
+        self._state = (None, {}, [])
+        self.refresh(force=True)
+
+    def _dir_signature(self):
+        try:
+            folders = sorted(os.scandir(self.root), key=lambda e: e.name)
+            return (os.stat(self.root).st_mtime_ns,) + tuple(
+                (e.name, e.stat().st_mtime_ns) for e in folders if e.is_dir())
+        except FileNotFoundError:
+            return ()
+
+    def refresh(self, force=False):
+        '''Rescan the folders if they changed since the last scan'''
+        with self._lock:
+            self._checked_at = time.time()
+            signature = self._dir_signature()
+            if not force and signature == self._state[0]:
+                return
+            paths = {}
+            listing = []
+            for entry in signature[1:]:
+                folder = entry[0]
+                path = os.path.join(self.root, folder, QUESTIONS_FILE)
+                if not os.path.isfile(path):
+                    continue
+                qid = questionnaire_id(folder)
+                listing.append({"id": qid, "name": folder.replace("_", " ").title(), "path": folder})
+                paths[qid] = path
+            # short aliases never shadow a full id
+            for qid, path in list(paths.items()):
+                if qid.endswith("_case"):
+                    paths.setdefault(qid[:-len("_case")], path)
+            self._state = (signature, paths, listing)
+
+    def _current(self):
+        if time.time() - self._checked_at >= self.check_interval:
+            self.refresh()
+        return self._state
+
+    def resolve(self, questionnaire_type=None):
+        '''Path of the workbook of a questionnaire type, or None if there is none'''
+        if not questionnaire_type:
+            return self.default_path
+        return self._current()[1].get(questionnaire_id(questionnaire_type))
+
+    def get(self, questionnaire_type=None):
+        '''
+        CompiledQuestionnaire of a questionnaire type.
+        Raises KeyError for an unknown type.
+        '''
+        path = self.resolve(questionnaire_type)
+        if path is None:
+            raise KeyError(questionnaire_type)
+        try:
+            return get_questionnaire(path)
+        except FileNotFoundError:
+            # removed since the last scan
+            self.refresh(force=True)
+            raise KeyError(questionnaire_type)
+
+    def list(self):
+        return list(self._current()[2])
@@ -0,0 +1,172 @@
+'''
+This file contains the request latency instrumentation.
+Named phases inside a request (questionnaire loading, GCS calls, password
+hashing, OpenAI calls) are timed, returned to the caller in a Server-Timing
+header and aggregated into histograms served in the Prometheus text format
+at /metrics.
+
+It is off unless REQUEST_TIMING=1. When off, phase() returns a shared no-op
+context manager, timed() returns the function unchanged and no request hooks
+or GCS observer are installed.
+'''
+# import packages
+import bisect
+import contextlib
+import functools
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("REQUEST_TIMING") == "1"
+
+# histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NOOP = contextlib.nullcontext()
+# phases of the request handled by the current thread: name -> [seconds, count]
+_current = threading.local()
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+# (metric, labels) -> Histogram
+_histograms = {}
+_lock = threading.Lock()
+_observed_modules = set()
+
+
+def observe(metric, labels, seconds):
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def record_phase(name, seconds):
+    '''Add a finished phase to the current request (if any) and to the histograms'''
+    phases = getattr(_current, "phases", None)
+    if phases is not None:
+        entry = phases.get(name)
+        if entry is None:
+            phases[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+    observe("phase_duration_seconds", {"phase": name}, seconds)
+
+
+@contextlib.contextmanager
+def _phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+def phase(name):
+    '''Context manager timing a phase of the current request'''
+    return _phase(name) if ENABLED else _NOOP
+
+
+def timed(name):
+    '''Decorator timing every call of a function as a phase'''
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _server_timing(phases, total):
+    items = []
+    for name, (seconds, count) in phases.items():
+        item = f"{name};dur={seconds * 1000:.1f}"
+        if count > 1:
+            item += f';desc="{count} calls"'
+        items.append(item)
+    items.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(items)
+
+
+def render_metrics():
+    '''All histograms in the Prometheus text exposition format'''
+    with _lock:
+        snapshot = [(metric, labels, list(h.counts), h.total, h.count)
+                    for (metric, labels), h in sorted(_histograms.items())]
+    lines = []
+    described = set()
+    for metric, labels, counts, total, count in snapshot:
+        if metric not in described:
+            lines.append(f"# TYPE {metric} histogram")
+            described.add(metric)
+        label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            sep = "," if label_text else ""
+            lines.append(f'{metric}_bucket{{{label_text}{sep}le="{le}"}} {cumulative}')
+        suffix = f"{{{label_text}}}" if label_text else ""
+        lines.append(f"{metric}_sum{suffix} {total}")
+        lines.append(f"{metric}_count{suffix} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app, storage_module=None):
+    '''
+    Install the request hooks and the /metrics route on a Flask app, and
+    time every call of storage_module (google_storage_utility) as a phase.
+    Does nothing when instrumentation is disabled.
+    '''
+    if not ENABLED:
+        return
+    from flask import Response, request
+
+    if storage_module is not None and storage_module.__name__ not in _observed_modules:
+        _observed_modules.add(storage_module.__name__)
+        storage_module.add_observer(lambda operation, seconds, ok: record_phase(f"gcs.{operation}", seconds))
+
+    @app.before_request
+    def start_timing():
+        _current.phases = {}
+        _current.started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        phases = getattr(_current, "phases", None)
+        if phases is None:
+            return response
+        total = time.perf_counter() - _current.started
+        response.headers["Server-Timing"] = _server_timing(phases, total)
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        observe("request_duration_seconds",
+                {"route": route, "method": request.method, "status": str(response.status_code)}, total)
+        return response
+
+    @app.teardown_request
+    def stop_timing(exc):
+        _current.phases = None
+
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics)
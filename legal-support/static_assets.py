@@ -0,0 +1,131 @@
+'''
+This file contains the static asset layer that serves the built React app
+(client/dist). The directory is indexed once, with a content hash per file
+as its ETag and the .br/.gz variants written by the build (see
+client/scripts/precompress.js), so serving a file needs no lookups on disk
+beyond opening it. Files are streamed by send_file, with Range and
+conditional requests. Content-hashed files under assets/ are cached by
+browsers for a year as immutable; everything else is revalidated with its
+ETag and answered with 304 when unchanged.
+'''
+# import packages
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from flask import request, send_file
+
+# Vite names built assets like index-Bglnybt_.js
+HASHED_NAME_RE = re.compile(r"-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Content-Encoding -> suffix of the precompressed variant, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+INDEX_FILE = "index.html"
+
+
+class Asset:
+
+    def __init__(self, path, rel_path, etag, mimetype, cache_control, variants):
+        self.path = path
+        self.rel_path = rel_path
+        self.etag = etag
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        # Content-Encoding -> path of the precompressed file
+        self.variants = variants
+
+
+class StaticAssets:
+    '''
+    Index of the files under root. The directory is scanned again only when
+    its modification time (or that of assets/) changes, checked at most every
+    check_interval seconds, e.g. after npm run build on a running server.
+    '''
+
+    def __init__(self, root, check_interval=5.0):
+        self.root = os.path.abspath(root)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        # (directory signature, rel path -> Asset), replaced as a whole
+        self._state = (None, {})
+        self.refresh(force=True)
+
+    def _dir_signature(self):
+        signature = []
+        for path in (self.root, os.path.join(self.root, "assets")):
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh(self, force=False):
+        with self._lock:
+            self._checked_at = time.time()
+            signature = self._dir_signature()
+            if not force and signature == self._state[0]:
+                return
+            assets = {}
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    if name.endswith((".br", ".gz")):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    rel_path = os.path.relpath(path, self.root).replace(os.sep, "/")
+                    assets[rel_path] = self._index_file(path, rel_path, filenames)
+            self._state = (signature, assets)
+
+    def _index_file(self, path, rel_path, siblings):
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:20]
+        mtime = os.stat(path).st_mtime_ns
+        variants = {}
+        for encoding, suffix in ENCODINGS:
+            name = os.path.basename(path) + suffix
+            # a variant older than its original is left over from an earlier build
+            if name in siblings and os.stat(path + suffix).st_mtime_ns >= mtime:
+                variants[encoding] = path + suffix
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        hashed = rel_path.startswith("assets/") and HASHED_NAME_RE.search(rel_path)
+        return Asset(path, rel_path, digest, mimetype, IMMUTABLE if hashed else REVALIDATE, variants)
+
+    def _assets(self):
+        if time.time() - self._checked_at >= self.check_interval:
+            self.refresh()
+        return self._state[1]
+
+    def get(self, rel_path):
+        return self._assets().get(rel_path)
+
+    def response(self, rel_path):
+        '''
+        Response for the file at rel_path, or for index.html if there is no
+        such file (client-side routes). None if index.html is missing too.
+        '''
+        assets = self._assets()
+        asset = assets.get(rel_path) if rel_path else None
+        if asset is None:
+            asset = assets.get(INDEX_FILE)
+            if asset is None:
+                return None
+        return self._send(asset)
+
+    def _send(self, asset):
+        accepted = request.accept_encodings
+        encoding = next((e for e, _ in ENCODINGS if e in asset.variants and accepted.quality(e) > 0), None)
+        path = asset.variants[encoding] if encoding else asset.path
+        # every representation has its own strong ETag; If-None-Match, If-Range and Range are
+        # answered by send_file (ranges of a precompressed variant are ranges of its bytes)
+        etag = f"{asset.etag}-{encoding}" if encoding else asset.etag
+        response = send_file(path, mimetype=asset.mimetype, download_name=os.path.basename(asset.path),
+                             etag=etag, conditional=True)
+        response.headers["Cache-Control"] = asset.cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
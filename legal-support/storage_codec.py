@@ -0,0 +1,128 @@
+'''
+This file contains the storage format of saved cases and profiles.
+Documents are serialised with orjson when it is installed (json otherwise)
+and compressed with zstd or gzip. gzip is recorded as the object's
+Content-Encoding in GCS; zstd objects are stored as opaque bytes without
+one, since the storage client only decodes (and checksums) gzip and br
+itself, and an HTTP stack that transparently decodes zstd would make
+checksums of downloads fail. Decoding looks at the content itself (the gzip
+and zstd magic numbers), so objects written before compression was added,
+and gzip objects that GCS already decompressed while downloading, are read
+the same way.
+
+STORAGE_COMPRESSION selects "zstd", "gzip" or "none"; the default is zstd
+when the zstandard package is installed and gzip otherwise.
+'''
+# import packages
+import gzip
+import json
+import os
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# objects smaller than this are stored uncompressed, the headers would outweigh the gain
+MIN_COMPRESS_BYTES = 256
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 6
+
+_orjson = None
+_zstd = None
+
+
+def _load_orjson():
+    # optional, a faster drop-in for json.dumps / json.loads
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson
+
+
+def _load_zstd():
+    global _zstd
+    if _zstd is None:
+        try:
+            import zstandard
+            _zstd = zstandard
+        except ImportError:
+            _zstd = False
+    return _zstd
+
+
+def default_compression():
+    setting = os.environ.get("STORAGE_COMPRESSION", "").strip().lower()
+    if setting in ("gzip", "none"):
+        return setting
+    if setting == "zstd" or not setting:
+        return "zstd" if _load_zstd() else "gzip"
+    raise ValueError(f"Unknown STORAGE_COMPRESSION: {setting}")
+
+
+def dumps(document):
+    '''Compact JSON bytes'''
+    orjson = _load_orjson()
+    if orjson:
+        try:
+            return orjson.dumps(document, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which json handles
+            pass
+    return json.dumps(document, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(data):
+    orjson = _load_orjson()
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # json accepts a little more, e.g. NaN written by older versions
+            pass
+    return json.loads(data)
+
+
+def compress(data, compression=None):
+    '''(compressed bytes, Content-Encoding or None)'''
+    compression = compression or default_compression()
+    if compression == "none" or len(data) < MIN_COMPRESS_BYTES:
+        return data, None
+    if compression == "zstd":
+        zstd = _load_zstd()
+        if not zstd:
+            raise RuntimeError("zstd compression needs the zstandard package")
+        # no Content-Encoding, see above
+        return zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(data), None
+    return gzip.compress(data, GZIP_LEVEL, mtime=0), "gzip"
+
+
+def decompress(data):
+    '''Stored bytes in any encoding -> the plain bytes'''
+    if data[:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[:4] == ZSTD_MAGIC:
+        zstd = _load_zstd()
+        if not zstd:
+            raise RuntimeError("This object is zstd compressed, install the zstandard package to read it")
+        # written by compress(), so the frame header holds the content size
+        return zstd.ZstdDecompressor().decompress(data)
+    return data
+
+
+def encode_json(document, compression=None):
+    '''(bytes to store, Content-Encoding or None)'''
+    return compress(dumps(document), compression)
+
+
+def decode_json(data):
+    return loads(decompress(data))
+
+
+def encode_text(text, compression=None):
+    return compress(text.encode("utf-8"), compression)
+
+
+def decode_text(data):
+    return decompress(data).decode("utf-8")
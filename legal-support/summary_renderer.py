@@ -0,0 +1,190 @@
+'''
+This file contains the case summary renderer used to build the prompt for
+the case analysis. Every questionnaire has a template whose fixed parts are
+assembled once; the answer table is rendered straight from a question index
+that is built once per questionnaire version. Output is HTML (the format the
+UI shows) or a compact plain text table.
+'''
+# import packages
+import html
+import threading
+
+HEADERS = ['Section', 'Question', 'Answer', 'Impact Value', 'Impact Reason']
+
+COLUMN_NOTES = [
+    "Section: the name of the section in the questionnaire",
+    "Question: the question asked",
+    "Answer: the answer",
+    "Impact value: a number from 0 to 1 that indicates how favorable the answer to this question is in the context of obtaining a settlement, with 0 being very unfavorable, 0.5 neutral, and 1 being very favorable. This field is optional and a value of 0.5 indicates that the lawyer did not provide a value, possibly expressing an opinion of neutrality",
+    "Impact reason: the reason why the impact value is the one selected by the lawyer. This field is optional",
+]
+
+FINAL_NOTE = "IMPORTANT: Just produce the document, without anything else, like \"certainly! Here it is\" etc"
+
+
+class SummaryTemplate:
+    '''
+    The fixed text around the answer table. The HTML and text renderings of
+    those parts are built once, when the template is created.
+    '''
+
+    def __init__(self, name, context, outputs):
+        self.name = name
+        self.context = context
+        self.outputs = outputs
+
+        head = ["<ul>"]
+        head += [f"<li>{line}</li>" for line in context]
+        head.append("<li>The table below reports the answers to the questionnaire. The columns are as follows:</li>")
+        head.append("<ul>")
+        head += [f"<li>{note}</li>" for note in COLUMN_NOTES]
+        head.append("</ul>")
+        head.append("</ul>")
+        self.html_head = "\n".join(head)
+
+        tail = ["Your output should be: ", "<ol>"]
+        tail += [f"<li>{line}</li>" for line in outputs]
+        tail.append("</ol>")
+        tail.append(FINAL_NOTE)
+        self.html_tail = "\n".join(tail)
+
+        head = [f"- {line}" for line in context]
+        head.append("- The table below reports the answers to the questionnaire, one row per answer, columns separated by |:")
+        head += [f"  - {note}" for note in COLUMN_NOTES]
+        self.text_head = "\n".join(head)
+
+        tail = ["Your output should be:"]
+        tail += [f"{i}. {line}" for i, line in enumerate(outputs, 1)]
+        tail.append(FINAL_NOTE)
+        self.text_tail = "\n".join(tail)
+
+
+TEMPLATES = {
+    "discrimination": SummaryTemplate(
+        "discrimination",
+        [
+            "I need to evaluate a discrimination case. Together with the client, the lawyer filled out a questionnarie that describes the case",
+            "We are in the state of New York",
+        ],
+        [
+            "Summary of the case and assessment with citations to prior cases",
+            "Which statutes is this claim under, which common law cases is it under",
+            "Listing the weaknesses and strengths",
+            "Breakdown of the computation of the damages",
+            "Settlement recommendation",
+            "What court or agency (eg, human right agency)",
+        ],
+    ),
+    "personal_injury": SummaryTemplate(
+        "personal_injury",
+        [
+            "I need to evaluate a personal injury case. Together with the client, the lawyer filled out a questionnarie that describes the case",
+            "We are in the state of New York",
+        ],
+        [
+            "Summary of the case and assessment with citations to prior cases",
+            "Which theories of liability apply (eg, negligence, premises liability) and which statutes and common law cases support them",
+            "Listing the weaknesses and strengths",
+            "Breakdown of the computation of the damages",
+            "Settlement recommendation",
+            "What court the claim should be filed in",
+        ],
+    ),
+}
+DEFAULT_TEMPLATE = "discrimination"
+
+# (questionnaire path, version) -> question index
+_INDEXES = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def get_template(name):
+    return TEMPLATES.get(name) or TEMPLATES[DEFAULT_TEMPLATE]
+
+
+def question_index(compiled):
+    '''
+    Questions of a CompiledQuestionnaire in display order, as tuples of
+    (id, section title, label, escaped section title, escaped label).
+    '''
+    key = (compiled.path, compiled.version)
+    index = _INDEXES.get(key)
+    if index is None:
+        index = tuple(
+            (str(q.get("id")), str(section["title"]), str(q["label"]),
+             html.escape(str(section["title"])), html.escape(str(q["label"])))
+            for section in compiled.sections
+            for q in section.get("questions", [])
+        )
+        with _INDEX_LOCK:
+            # drop indexes of older versions of the same workbook
+            for old in [k for k in _INDEXES if k[0] == compiled.path]:
+                del _INDEXES[old]
+            _INDEXES[key] = index
+    return index
+
+
+def _impact_value(answers, qid):
+    value = answers.get(f"{qid}_slider")
+    if value is None:
+        return 0.5
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.5
+
+
+def answer_rows(compiled, answers):
+    '''
+    Yield (section, question, answer, impact value, impact reason, escaped
+    section, escaped question) for every answered question.
+    '''
+    for qid, section, label, section_html, label_html in question_index(compiled):
+        if qid not in answers:
+            continue  # exclude the empty answers from the table
+        explanation = answers.get(f"{qid}_explanation") or ''
+        yield (section, label, f"{answers[qid]}", _impact_value(answers, qid), f"{explanation}",
+               section_html, label_html)
+
+
+def render_html(compiled, answers, template=DEFAULT_TEMPLATE, profile_text=""):
+    template = get_template(template)
+    esc = html.escape
+    parts = []
+    if profile_text:
+        parts.append(f"<h2>Profile</h2><p>{esc(profile_text)}</p>")
+    parts.append(template.html_head)
+    parts.append('<table border="1" class="dataframe">')
+    parts.append("<thead><tr>" + "".join(f"<th>{h}</th>" for h in HEADERS) + "</tr></thead>")
+    parts.append("<tbody>")
+    for _, _, answer, impact, reason, section_html, label_html in answer_rows(compiled, answers):
+        parts.append(f"<tr><td>{section_html}</td><td>{label_html}</td><td>{esc(answer)}</td>"
+                     f"<td>{impact}</td><td>{esc(reason)}</td></tr>")
+    parts.append("</tbody>")
+    parts.append("</table>")
+    parts.append(template.html_tail)
+    return "\n".join(parts)
+
+
+def _cell(value):
+    # keep one row per line and the column separator unambiguous
+    return str(value).replace("\r", " ").replace("\n", " ").replace("|", "/")
+
+
+def render_text(compiled, answers, template=DEFAULT_TEMPLATE, profile_text=""):
+    template = get_template(template)
+    parts = []
+    if profile_text:
+        parts.append(f"Profile: {profile_text}")
+    parts.append(template.text_head)
+    parts.append(" | ".join(HEADERS))
+    for section, label, answer, impact, reason, _, _ in answer_rows(compiled, answers):
+        parts.append(" | ".join((_cell(section), _cell(label), _cell(answer), _cell(impact), _cell(reason))))
+    parts.append(template.text_tail)
+    return "\n".join(parts)
+
+
+def render(compiled, answers, template=DEFAULT_TEMPLATE, profile_text="", fmt="html"):
+    if fmt == "text":
+        return render_text(compiled, answers, template, profile_text)
+    return render_html(compiled, answers, template, profile_text)
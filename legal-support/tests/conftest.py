@@ -0,0 +1,73 @@
+'''
+Shared fixtures. Storage is the in-process fake from benchmarks/fake_gcs.py,
+installed for one test at a time.
+
+Run from the legal-support directory:
+    python -m pytest tests
+'''
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import case_manifest  # noqa: E402
+import fake_gcs  # noqa: E402
+import google_storage_utility  # noqa: E402
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    '''
+    A FakeStorage standing in for google_storage_utility during the test,
+    including the functions case_manifest imported from it
+    '''
+    fake = fake_gcs.FakeStorage()
+    for name, operation in fake_gcs.FUNCTIONS.items():
+        fn = google_storage_utility._timed(operation)(getattr(fake, name))
+        for module in (google_storage_utility, case_manifest):
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, fn)
+    return fake
+
+
+class Gate:
+    '''
+    Wraps a storage function so that a call blocks in the middle: started is
+    set once it is running, and it carries on when release() is called.
+    before runs ahead of the wrapped call, after it (with its result).
+    '''
+
+    def __init__(self, fn, block="after"):
+        self.fn = fn
+        self.block = block
+        self.started = threading.Event()
+        self._released = threading.Event()
+
+    def release(self):
+        self._released.set()
+
+    def __call__(self, *args, **kwargs):
+        if self.block == "before":
+            self.started.set()
+            assert self._released.wait(5), "gate never released"
+            return self.fn(*args, **kwargs)
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            self.started.set()
+            assert self._released.wait(5), "gate never released"
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    '''gate(name, block="after") holds calls of google_storage_utility.<name> until released'''
+    def install(name, block="after"):
+        wrapper = Gate(getattr(google_storage_utility, name), block)
+        monkeypatch.setattr(google_storage_utility, name, wrapper)
+        return wrapper
+    return install
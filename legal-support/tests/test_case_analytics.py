@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+import case_analytics
+import questionnaire_registry
+
+
+@pytest.fixture(scope="module")
+def compiled():
+    return questionnaire_registry.get_questionnaire(questionnaire_registry.QUESTIONS_FILE)
+
+
+def slider_question(compiled):
+    return next(q["id"] for section in compiled.sections for q in section["questions"]
+                if q.get("slider") and not q.get("conditional_on"))
+
+
+class Cases:
+    def __init__(self, qid):
+        self.qid = qid
+        self.users = {}
+        self.listed = []
+
+    def add(self, user, name, value):
+        self.users.setdefault(user, {})[name] = {"answers": {self.qid: "x", f"{self.qid}_slider": value}}
+
+    def listing(self, user):
+        self.listed.append(user)
+        return [{"name": name} for name in self.users.get(user, {})]
+
+    def read(self, user, names):
+        return [(name, self.users.get(user, {}).get(name)) for name in names]
+
+
+def test_least_recently_queried_users_are_evicted(compiled):
+    qid = slider_question(compiled)
+    cases = Cases(qid)
+    analytics = case_analytics.CaseAnalytics(cases.listing, cases.read, max_users=2)
+    for user in ("ann", "bob", "cy"):
+        cases.add(user, "case", 0.5)
+    analytics.aggregate("ann", compiled)
+    analytics.aggregate("bob", compiled)
+    analytics.aggregate("ann", compiled)
+    analytics.aggregate("cy", compiled)
+    stats = analytics.stats()
+    assert (stats["users"], stats["evictions"]) == (2, 1)
+    # bob's columns were dropped, ann's were not
+    analytics.aggregate("ann", compiled)
+    assert cases.listed == ["ann", "bob", "cy"]
+    analytics.aggregate("bob", compiled)
+    assert cases.listed == ["ann", "bob", "cy", "bob"]
+
+
+def test_saves_are_written_into_the_built_columns(compiled):
+    qid = slider_question(compiled)
+    cases = Cases(qid)
+    analytics = case_analytics.CaseAnalytics(cases.listing, cases.read)
+    cases.add("ann", "one", 0.2)
+    assert analytics.aggregate("ann", compiled)["impact"][qid]["count"] == 1
+    analytics.update("ann", "two", {"answers": {qid: "x", f"{qid}_slider": 0.4}})
+    analytics.update("bob", "one", {"answers": {qid: "x", f"{qid}_slider": 0.4}})
+    assert analytics.aggregate("ann", compiled)["impact"][qid]["mean"] == pytest.approx(0.3)
+    analytics.remove("ann", "one")
+    assert analytics.aggregate("ann", compiled)["impact"][qid]["count"] == 1
+
+
+def test_a_user_query_does_not_wait_for_another_users(compiled, monkeypatch):
+    qid = slider_question(compiled)
+    cases = Cases(qid)
+    analytics = case_analytics.CaseAnalytics(cases.listing, cases.read)
+    for user in ("ann", "bob"):
+        cases.add(user, "case", 0.5)
+        analytics.aggregate(user, compiled)
+
+    # ann's aggregation is held in the middle
+    started, release = threading.Event(), threading.Event()
+    ann = analytics._tables["ann"][compiled.path]
+    aggregate = ann.aggregate
+
+    def slow(**query):
+        started.set()
+        assert release.wait(5)
+        return aggregate(**query)
+
+    monkeypatch.setattr(ann, "aggregate", slow)
+    thread = threading.Thread(target=analytics.aggregate, args=("ann", compiled))
+    thread.start()
+    assert started.wait(5)
+    try:
+        assert analytics.aggregate("bob", compiled)["impact"][qid]["count"] == 1
+    finally:
+        release.set()
+        thread.join(5)
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+
+import pytest
+
+import case_documents
+import object_cache
+import storage_codec
+import upload_queue
+
+USER = "ann"
+
+
+class Instance:
+    '''One app instance's case storage, wired like app.py: cache, write-behind uploads, versioned documents'''
+
+    def __init__(self, root, delay=0.0):
+        self.root = root
+        self.delay = delay
+        self.cache = object_cache.ObjectCache("bucket")
+        self.uploader = upload_queue.WriteBehindUploader(
+            "bucket", on_uploaded=self.uploaded, base_generation=self.cache.base_generation,
+            on_conflict=self.conflict)
+        self.cases = case_documents.CaseDocuments(self.read, self.write)
+
+    def paths(self, user, filename):
+        return f"prefix/user_data/{user}/{filename}.json", os.path.join(self.root, user, f"{filename}.json")
+
+    def read(self, user, filename):
+        object_name, local_path = self.paths(user, filename)
+        content = self.cache.fetch(object_name, local_path)
+        return storage_codec.decode_json(content) if content is not None else None
+
+    def write(self, user, filename, document, conditional=False):
+        object_name, local_path = self.paths(user, filename)
+        content, encoding = storage_codec.encode_json(document)
+        with self.cache.local_write(object_name, local_path) as sequence:
+            upload_queue.durable_write(local_path, content)
+        self.uploader.enqueue(object_name, local_path, delay=self.delay, content_encoding=encoding,
+                              sequence=sequence, conditional=conditional)
+
+    def uploaded(self, object_name, local_path, generation, metadata, sequence):
+        self.cache.record_write(object_name, local_path, generation, sequence)
+
+    def conflict(self, object_name, local_path, metadata):
+        self.cache.invalidate(object_name)
+        self.cases.lost(USER, os.path.basename(object_name)[:-len(".json")])
+
+
+def stored(storage, filename):
+    return storage_codec.decode_json(storage.objects[f"prefix/user_data/{USER}/{filename}.json"][0])
+
+
+def replace(value):
+    return [{"op": "replace", "path": "/answers/q", "value": value}]
+
+
+def test_patch_applies_ops_and_bumps_the_version(storage, tmp_path):
+    instance = Instance(str(tmp_path))
+    instance.cases.save(USER, "case", {"q": "a"}, None)
+    document = instance.cases.patch(USER, "case", 1, replace("b"))
+    assert document == {"answers": {"q": "b"}, "clientInfo": None, "version": 2}
+    assert instance.uploader.flush(5)
+    assert stored(storage, "case") == document
+
+
+def test_concurrent_patches_at_the_same_version(storage, tmp_path, monkeypatch):
+    instance = Instance(str(tmp_path))
+    instance.cases.save(USER, "case", {"q": "a"}, None)
+    # slow writes, so the second patch arrives while the first one holds the case
+    write = instance.cases.write
+    monkeypatch.setattr(instance.cases, "write", lambda *args: (time.sleep(0.05), write(*args)))
+    barrier = threading.Barrier(2)
+    results = []
+
+    def patch(value):
+        barrier.wait()
+        try:
+            results.append(instance.cases.patch(USER, "case", 1, replace(value))["answers"]["q"])
+        except case_documents.VersionConflict as e:
+            results.append(e.version)
+
+    threads = [threading.Thread(target=patch, args=(value,)) for value in ("tab 1", "tab 2")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    # one patch wins, the other is told the case is now at version 2
+    winners = [r for r in results if isinstance(r, str)]
+    assert len(winners) == 1 and winners[0] in ("tab 1", "tab 2")
+    assert [r for r in results if not isinstance(r, str)] == [2]
+    winner = winners[0]
+    assert instance.uploader.flush(5)
+    assert stored(storage, "case") == {"answers": {"q": winner}, "clientInfo": None, "version": 2}
+
+
+def test_patch_at_an_old_version_conflicts(storage, tmp_path):
+    instance = Instance(str(tmp_path))
+    instance.cases.save(USER, "case", {"q": "a"}, None)
+    instance.cases.patch(USER, "case", 1, replace("b"))
+    with pytest.raises(case_documents.VersionConflict) as conflict:
+        instance.cases.patch(USER, "case", 1, replace("c"))
+    assert conflict.value.version == 2
+
+
+def test_write_losing_to_another_instance_is_not_uploaded(storage, tmp_path):
+    first = Instance(str(tmp_path / "first"), delay=0.2)
+    second = Instance(str(tmp_path / "second"))
+    first.cases.save(USER, "case", {"q": "a"}, None)
+    assert first.uploader.flush(5)
+
+    # both instances accept a patch at version 1; the second one uploads first
+    first.cases.patch(USER, "case", 1, replace("first"))
+    second.cases.patch(USER, "case", 1, replace("second"))
+    assert second.uploader.flush(5)
+    assert first.uploader.flush(5)
+
+    assert stored(storage, "case") == {"answers": {"q": "second"}, "clientInfo": None, "version": 2}
+    assert first.uploader.stats()["conflicts"] == 1
+    # the first instance's client is told to reload, and can carry on from the stored case
+    with pytest.raises(case_documents.VersionConflict):
+        first.cases.patch(USER, "case", 2, replace("again"))
+    assert first.cases.load(USER, "case")["answers"] == {"q": "second"}
+    first.cases.patch(USER, "case", 2, replace("after reload"))
+    assert first.uploader.flush(5)
+    assert stored(storage, "case")["answers"] == {"q": "after reload"}
+
+
+def test_unversioned_save_overwrites_a_write_made_elsewhere(storage, tmp_path):
+    first = Instance(str(tmp_path / "first"), delay=0.2)
+    second = Instance(str(tmp_path / "second"))
+    first.cases.save(USER, "case", {"q": "a"}, None)
+    assert first.uploader.flush(5)
+
+    # the first instance saves without a version while the second one's patch is uploaded
+    second.cases.patch(USER, "case", 1, replace("second"))
+    first.cases.save(USER, "case", {"q": "first"}, None)
+    assert second.uploader.flush(5)
+    assert first.uploader.flush(5)
+
+    assert stored(storage, "case")["answers"] == {"q": "first"}
+    assert first.uploader.stats()["conflicts"] == 0
+
+
+def test_unversioned_save_coalesced_with_a_patch_is_not_dropped(storage, tmp_path):
+    first = Instance(str(tmp_path / "first"), delay=0.2)
+    second = Instance(str(tmp_path / "second"))
+    first.cases.save(USER, "case", {"q": "a"}, None)
+    assert first.uploader.flush(5)
+
+    # both writes of the first instance go up as one upload, after the second instance's
+    first.cases.save(USER, "case", {"q": "saved"}, None)
+    first.cases.patch(USER, "case", 2, replace("patched"))
+    second.cases.patch(USER, "case", 1, replace("second"))
+    assert second.uploader.flush(5)
+    assert first.uploader.flush(5)
+
+    assert stored(storage, "case")["answers"] == {"q": "patched"}
@@ -0,0 +1,39 @@
+import json
+
+import case_manifest
+
+PREFIX = "prefix/user_data/ann/"
+
+
+def listed(page_size=100):
+    return [entry["name"] for entry in case_manifest.list_cases("bucket", PREFIX, page_size, use_manifest=True)[0]]
+
+
+def test_first_manifest_write_keeps_existing_cases(storage):
+    # cases saved before the manifest was turned on
+    for name in ("alpha", "beta"):
+        storage.put(PREFIX + f"{name}.json", json.dumps({"answers": {}}))
+    storage.put(PREFIX + "profile.txt", "profile")
+
+    storage.put(PREFIX + "gamma.json", json.dumps({"answers": {}}))
+    assert case_manifest.record_case("bucket", PREFIX, case_manifest.case_entry("gamma", 10, None, None))
+    assert listed() == ["alpha", "beta", "gamma"]
+    manifest, _ = case_manifest.read_manifest("bucket", PREFIX)
+    assert manifest["cases"]["gamma"]["size"] == 10
+
+
+def test_first_forget_keeps_existing_cases(storage):
+    for name in ("alpha", "beta"):
+        storage.put(PREFIX + f"{name}.json", json.dumps({"answers": {}}))
+    assert case_manifest.forget_case("bucket", PREFIX, "beta")
+    assert listed() == ["alpha"]
+
+
+def test_record_updates_an_existing_manifest(storage):
+    storage.put(PREFIX + "alpha.json", json.dumps({"answers": {}}))
+    assert listed() == ["alpha"]
+    # another save is recorded without listing the folder again
+    listings = storage.calls.get("list_cs_page", 0)
+    assert case_manifest.record_case("bucket", PREFIX, case_manifest.case_entry("beta", 1, None, None))
+    assert storage.calls.get("list_cs_page", 0) == listings
+    assert listed() == ["alpha", "beta"]
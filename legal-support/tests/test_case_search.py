@@ -0,0 +1,56 @@
+import case_search
+
+USER = "ann"
+
+
+class Cases:
+    '''Stored cases of one user, in the shapes CaseSearch reads them'''
+
+    def __init__(self):
+        self.documents = {}
+        self.generations = {}
+        self.reads = 0
+
+    def put(self, name, text):
+        self.documents[name] = {"answers": {"q": text}}
+        self.generations[name] = self.generations.get(name, 0) + 1
+
+    def listing(self, user):
+        return [{"name": name, "generation": generation, "updated": None}
+                for name, generation in self.generations.items()]
+
+    def read(self, user, name):
+        self.reads += 1
+        return self.documents.get(name)
+
+    def search(self, **kwargs):
+        return case_search.CaseSearch(lambda user: None, lambda user, data: None, self.listing, self.read,
+                                      persist_delay=0, **kwargs)
+
+
+def names(results):
+    return sorted(result["filename"] for result in results)
+
+
+def test_changes_without_a_loaded_index_are_not_kept():
+    cases = Cases()
+    search = cases.search()
+    for i in range(100):
+        cases.put(f"case-{i}", "whiplash")
+        search.update(USER, f"case-{i}", cases.documents[f"case-{i}"])
+        search.remove("someone-else", f"case-{i}")
+    assert search.stats()["pending_users"] == 0
+    # the listing covers them when the index is loaded
+    assert len(search.search(USER, "whiplash", limit=200)) == 100
+
+
+def test_case_uploaded_after_the_load_is_found_by_the_next_search():
+    cases = Cases()
+    search = cases.search(reconcile_after=3600)
+    cases.put("old", "whiplash")
+    # saved locally while no index is loaded, not listed until its upload lands
+    search.update(USER, "new", {"answers": {"q": "whiplash"}})
+    assert names(search.search(USER, "whiplash")) == ["old"]
+    cases.put("new", "whiplash")
+    search.uploaded(USER, "new", cases.generations["new"], None)
+    assert names(search.search(USER, "whiplash")) == ["new", "old"]
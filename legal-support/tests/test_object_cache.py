@@ -0,0 +1,77 @@
+import threading
+
+import object_cache
+import upload_queue
+
+OBJECT = "prefix/user_data/ann/case.json"
+
+
+def fetch_in_thread(cache, local_path):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(content=cache.fetch(OBJECT, local_path)))
+    thread.start()
+    return thread, result
+
+
+def test_fetch_reads_through_and_revalidates(storage, tmp_path):
+    cache = object_cache.ObjectCache("bucket")
+    local_path = str(tmp_path / "case.json")
+    storage.put(OBJECT, b"v1")
+    assert cache.fetch(OBJECT, local_path) == b"v1"
+    assert cache.fetch(OBJECT, local_path) == b"v1"
+    assert cache.stats()["downloads"] == 1
+    assert cache.stats()["not_modified"] == 1
+
+
+def test_download_overlapping_a_save_keeps_the_save(storage, gate, tmp_path):
+    cache = object_cache.ObjectCache("bucket")
+    local_path = str(tmp_path / "case.json")
+    storage.put(OBJECT, b"old")
+    # the read has the old bytes and is held before they are written locally
+    read = gate("read_cs_object")
+    thread, result = fetch_in_thread(cache, local_path)
+    assert read.started.wait(5)
+    with cache.local_write(OBJECT, local_path):
+        upload_queue.durable_write(local_path, b"new")
+    read.release()
+    thread.join(5)
+
+    assert result["content"] == b"new"
+    with open(local_path, "rb") as f:
+        assert f.read() == b"new"
+    assert cache.stats()["raced_downloads"] == 1
+    # still pinned: served locally without asking storage
+    reads = storage.calls["read_cs_object"]
+    assert cache.fetch(OBJECT, local_path) == b"new"
+    assert storage.calls["read_cs_object"] == reads
+
+
+def test_not_found_overlapping_a_new_case_keeps_it(storage, gate, tmp_path):
+    cache = object_cache.ObjectCache("bucket")
+    local_path = str(tmp_path / "case.json")
+    read = gate("read_cs_object")
+    thread, result = fetch_in_thread(cache, local_path)
+    assert read.started.wait(5)
+    with cache.local_write(OBJECT, local_path):
+        upload_queue.durable_write(local_path, b"created")
+    read.release()
+    thread.join(5)
+
+    assert result["content"] == b"created"
+    with open(local_path, "rb") as f:
+        assert f.read() == b"created"
+
+
+def test_download_overlapping_a_delete_does_not_restore_it(storage, gate, tmp_path):
+    cache = object_cache.ObjectCache("bucket")
+    local_path = str(tmp_path / "case.json")
+    storage.put(OBJECT, b"v1")
+    read = gate("read_cs_object")
+    thread, result = fetch_in_thread(cache, local_path)
+    assert read.started.wait(5)
+    cache.invalidate(OBJECT, local_path)
+    read.release()
+    thread.join(5)
+
+    assert result["content"] is None
+    assert not (tmp_path / "case.json").exists()
@@ -0,0 +1,18 @@
+import prompt_builder
+
+
+def test_markup_is_compacted_only_in_generated_content():
+    messages = [{"role": "user", "content": "<p>Case &amp; summary</p>"},
+                {"role": "assistant", "content": "<p>First <b>reply</b></p>"},
+                {"role": "user", "content": "Is <b>this</b> bold? Salary < 50k"}]
+    result, _ = prompt_builder.fit_messages(messages, None)
+    assert [m["content"] for m in result] == ["Case & summary", "First reply", "Is <b>this</b> bold? Salary < 50k"]
+
+
+def test_a_message_cut_twice_has_one_marker():
+    messages = [{"role": "user", "content": " ".join(["word"] * 500)},
+                {"role": "user", "content": "question"}]
+    result, report = prompt_builder.fit_messages(messages, 60)
+    assert report["truncated_messages"] >= 2
+    assert result[0]["content"].count("[truncated]") == 1
+    assert result[0]["content"].endswith(prompt_builder.TRUNCATED)
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import google_storage_utility
+import object_cache
+import upload_queue
+
+OBJECT = "prefix/user_data/ann/case.json"
+
+
+def test_writes_within_the_delay_are_coalesced(storage, tmp_path):
+    uploader = upload_queue.WriteBehindUploader("bucket")
+    local_path = str(tmp_path / "case.json")
+    for i in range(5):
+        upload_queue.durable_write(local_path, f"v{i}".encode())
+        uploader.enqueue(OBJECT, local_path, delay=0.2)
+    assert uploader.flush(5)
+    assert storage.calls["upload_cs_file"] == 1
+    assert storage.objects[OBJECT][0] == b"v4"
+
+
+def test_cancel_during_a_failing_upload_drops_it(storage, gate, monkeypatch, tmp_path):
+    def fail(*args, **kwargs):
+        raise ConnectionError("storage unavailable")
+
+    monkeypatch.setattr(google_storage_utility, "upload_cs_file", fail)
+    upload = gate("upload_cs_file", block="before")
+    uploader = upload_queue.WriteBehindUploader("bucket", base_delay=0.01)
+    local_path = str(tmp_path / "case.json")
+    upload_queue.durable_write(local_path, b"v1")
+    uploader.enqueue(OBJECT, local_path)
+    assert upload.started.wait(5)
+
+    # the case is deleted while its upload is running; that upload then fails
+    cancelled = threading.Thread(target=uploader.cancel, args=(OBJECT,))
+    cancelled.start()
+    time.sleep(0.05)
+    upload.release()
+    cancelled.join(5)
+
+    time.sleep(0.1)
+    stats = uploader.stats()
+    assert not uploader.is_pending(OBJECT)
+    assert (stats["pending"], stats["failed"], stats["retries"]) == (0, 0, 0)
+
+
+def test_upload_landing_before_a_newer_write_is_queued_keeps_it_pinned(storage, gate, tmp_path):
+    cache = object_cache.ObjectCache("bucket")
+
+    def uploaded(object_name, local_path, generation, metadata, sequence):
+        cache.record_write(object_name, local_path, generation, sequence)
+
+    uploader = upload_queue.WriteBehindUploader("bucket", on_uploaded=uploaded)
+    local_path = str(tmp_path / "case.json")
+    with cache.local_write(OBJECT, local_path) as sequence:
+        upload_queue.durable_write(local_path, b"v1")
+    upload = gate("upload_cs_file", block="before")
+    uploader.enqueue(OBJECT, local_path, sequence=sequence)
+    assert upload.started.wait(5)
+
+    # a second save writes the file; its upload lands before the save queues its own
+    with cache.local_write(OBJECT, local_path) as newer:
+        upload_queue.durable_write(local_path, b"v2")
+    upload.release()
+    assert uploader.flush(5)
+    assert cache.stats()["stale_uploads"] == 1
+
+    # GCS is changed behind our back; the pinned copy must still win over it
+    storage.put(OBJECT, b"elsewhere")
+    assert cache.fetch(OBJECT, local_path) == b"v2"
+
+    uploader.enqueue(OBJECT, local_path, sequence=newer)
+    assert uploader.flush(5)
+    assert storage.objects[OBJECT][0] == b"v2"
+    assert cache.base_generation(OBJECT) == storage.objects[OBJECT][1]
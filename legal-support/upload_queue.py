@@ -0,0 +1,256 @@
+'''
+This file contains a write-behind uploader for user objects.
+Routes write the local file durably and return; a background thread uploads
+the file to GCS. Repeated writes to the same object before it is uploaded
+are coalesced into one upload, failed uploads are retried with exponential
+backoff, and pending uploads are flushed when the process exits.
+Conditional uploads only replace the generation the local copy was based
+on; when another instance wrote the object in between, the upload is
+dropped and reported as a conflict instead of overwriting that write.
+'''
+# import packages
+import atexit
+import logging
+import os
+import threading
+import time
+
+from google.api_core.exceptions import PreconditionFailed
+
+import google_storage_utility
+
+logger = logging.getLogger(__name__)
+
+
+def durable_write(path, data):
+    '''Write data (str or bytes) to path atomically and fsync it'''
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class WriteBehindUploader:
+    '''
+    on_uploaded(object_name, local_path, generation, metadata, sequence) is
+    called after a successful upload, unless a newer write of the same object
+    is already waiting (that one will report instead). sequence is the value
+    given to enqueue, so the hook can tell whether the object was written
+    again since.
+    base_generation(object_name) gives the generation a conditional upload
+    must replace, read when the upload starts; if the object is at another
+    one, on_conflict(object_name, local_path, metadata) is called and the
+    upload and any write coalesced into it are dropped.
+    '''
+
+    def __init__(self, bucket_name, on_uploaded=None, max_attempts=8, base_delay=0.5, max_delay=60.0,
+                 base_generation=None, on_conflict=None):
+        self.bucket_name = bucket_name
+        self.on_uploaded = on_uploaded
+        self.base_generation = base_generation
+        self.on_conflict = on_conflict
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # object name -> task, waiting to be uploaded
+        self._pending = {}
+        # object name -> task, gave up after max_attempts
+        self._failed = {}
+        self._in_flight = set()
+        # in-flight objects that were cancelled while uploading, never queued again
+        self._cancelled = set()
+        self._uploaded = 0
+        self._coalesced = 0
+        self._retries = 0
+        self._conflicts = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def enqueue(self, object_name, local_path, metadata=None, delay=0.0, content_encoding=None, sequence=None,
+                conditional=False):
+        '''
+        Upload local_path as object_name. With delay, the upload waits that
+        many seconds so that further writes within the window are coalesced
+        into it; a later write never pushes an earlier deadline back.
+        content_encoding is set on the object when the file is compressed;
+        sequence is handed back to on_uploaded. conditional uploads check the
+        generation, see the class; coalesced with an unconditional write the
+        upload is unconditional, as that write must not be dropped.
+        '''
+        due = time.time() + delay if delay else 0.0
+        with self._cond:
+            previous = self._pending.get(object_name)
+            if previous is not None:
+                self._coalesced += 1
+            failed = self._failed.pop(object_name, None)
+            self._cancelled.discard(object_name)
+            self._pending[object_name] = {
+                "local_path": local_path,
+                "metadata": metadata,
+                "content_encoding": content_encoding,
+                "sequence": sequence,
+                "conditional": conditional and all(task["conditional"] for task in (previous, failed) if task),
+                # lag is measured from the oldest write that is not uploaded yet
+                "enqueued_at": previous["enqueued_at"] if previous else time.time(),
+                "attempts": 0,
+                "next_attempt_at": min(previous["next_attempt_at"], due) if previous else due,
+                "last_error": None,
+            }
+            self._ensure_worker()
+            self._cond.notify_all()
+
+    def is_pending(self, object_name):
+        with self._cond:
+            return object_name in self._pending or object_name in self._in_flight or object_name in self._failed
+
+    def cancel(self, object_name, timeout=10):
+        '''
+        Drop queued uploads of object_name, e.g. because it is being deleted,
+        and wait for an upload already in progress to finish so it cannot
+        recreate the object afterwards.
+        '''
+        deadline = time.time() + timeout
+        with self._cond:
+            self._pending.pop(object_name, None)
+            self._failed.pop(object_name, None)
+            if object_name in self._in_flight:
+                # if that upload fails it must not be retried
+                self._cancelled.add(object_name)
+            while object_name in self._in_flight and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+
+    def retry_failed(self):
+        '''Queue every failed upload again'''
+        with self._cond:
+            for object_name, task in self._failed.items():
+                task["attempts"] = 0
+                task["next_attempt_at"] = 0.0
+                self._pending.setdefault(object_name, task)
+            self._failed.clear()
+            self._ensure_worker()
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        '''Wait until nothing is pending or in flight; returns True if drained'''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            for task in self._pending.values():
+                task["next_attempt_at"] = 0.0
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stats(self):
+        with self._cond:
+            oldest = min((task["enqueued_at"] for task in self._pending.values()), default=None)
+            return {
+                "pending": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "failed": len(self._failed),
+                "uploaded": self._uploaded,
+                "coalesced": self._coalesced,
+                "retries": self._retries,
+                "conflicts": self._conflicts,
+                "oldest_pending_age": time.time() - oldest if oldest else 0.0,
+                "failed_objects": {name: task["last_error"] for name, task in self._failed.items()},
+            }
+
+    def _ensure_worker(self):
+        # called with the lock held; started lazily so forking servers don't inherit it
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._work, name="write-behind-uploader", daemon=True)
+            self._thread.start()
+
+    def _next_task(self):
+        # called with the lock held; returns (object_name, task) or waits
+        while True:
+            now = time.time()
+            due = [(task["next_attempt_at"], name) for name, task in self._pending.items()
+                   if name not in self._in_flight]
+            if due:
+                next_at, name = min(due)
+                if next_at <= now:
+                    return name, self._pending.pop(name)
+                self._cond.wait(next_at - now)
+            else:
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                object_name, task = self._next_task()
+                self._in_flight.add(object_name)
+            conflict = False
+            try:
+                if_generation_match = None
+                if task["conditional"] and self.base_generation:
+                    if_generation_match = self.base_generation(object_name)
+                generation = google_storage_utility.upload_cs_file(
+                    self.bucket_name, task["local_path"], object_name, metadata=task["metadata"],
+                    content_encoding=task.get("content_encoding"), if_generation_match=if_generation_match)
+                error = None
+            except PreconditionFailed as e:
+                generation = None
+                error = e
+                conflict = True
+            except Exception as e:
+                generation = None
+                error = e
+
+            with self._cond:
+                superseded = object_name in self._pending
+                if error is None:
+                    self._uploaded += 1
+                elif conflict:
+                    # conditional writes waiting behind this one were made over the same, now outdated copy;
+                    # an unconditional one still overwrites
+                    logger.warning("%s was changed elsewhere, dropping the local write: %s", object_name, error)
+                    self._conflicts += 1
+                    if superseded and self._pending[object_name]["conditional"]:
+                        self._pending.pop(object_name)
+                    superseded = False
+                elif object_name in self._cancelled:
+                    logger.info("dropping failed upload of cancelled %s: %s", object_name, error)
+                elif superseded:
+                    # the waiting write carries this one's content, and must not be dropped where it could not be
+                    self._pending[object_name]["conditional"] &= task["conditional"]
+                else:
+                    task["attempts"] += 1
+                    task["last_error"] = str(error)
+                    if task["attempts"] >= self.max_attempts:
+                        logger.error("giving up uploading %s: %s", object_name, error)
+                        self._failed[object_name] = task
+                    else:
+                        self._retries += 1
+                        delay = min(self.base_delay * 2 ** (task["attempts"] - 1), self.max_delay)
+                        task["next_attempt_at"] = time.time() + delay
+                        self._pending[object_name] = task
+
+            if error is None and not superseded and self.on_uploaded:
+                try:
+                    self.on_uploaded(object_name, task["local_path"], generation, task["metadata"],
+                                     task.get("sequence"))
+                except Exception:
+                    logger.exception("post-upload hook failed for %s", object_name)
+            if conflict and self.on_conflict:
+                try:
+                    self.on_conflict(object_name, task["local_path"], task["metadata"])
+                except Exception:
+                    logger.exception("conflict hook failed for %s", object_name)
+
+            # the object stays in flight until its hook ran, see cancel()
+            with self._cond:
+                self._in_flight.discard(object_name)
+                self._cancelled.discard(object_name)
+                self._cond.notify_all()
+
+    def register_shutdown_flush(self, timeout=30):
+        atexit.register(self.flush, timeout)
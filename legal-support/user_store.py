@@ -0,0 +1,176 @@
+'''
+This file contains the user account store.
+Each user is one small object (<prefix>/users/<username>.json), so a lookup
+reads one record instead of the whole user list, and concurrent signups on
+different instances cannot overwrite each other: records are created with
+a "must not exist" generation precondition and updated with a "still at
+this generation" one. Records are cached in a bounded in-memory LRU and
+refreshed in the background once they are older than the TTL, so a cached
+login never waits for the bucket. Unknown users are remembered for a few
+seconds only, since they may sign up on another instance at any time.
+'''
+# import packages
+import collections
+import json
+import threading
+import time
+from urllib.parse import quote
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+import google_storage_utility
+
+# attempts at a read-modify-write of a record when another writer races us
+UPDATE_RETRIES = 5
+
+
+class UserExistsError(Exception):
+    pass
+
+
+class UserStore:
+    '''
+    legacy_object is the old monolithic users.json ({username: password hash});
+    users found only there are migrated to their own record on first lookup.
+    '''
+
+    def __init__(self, bucket_name, prefix, legacy_object=None, max_entries=10000, ttl=300, negative_ttl=2):
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip("/") + "/users/"
+        self.legacy_object = legacy_object
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # username -> (record or None, generation, fetched_at)
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._legacy = None
+        self._legacy_lock = threading.Lock()
+
+    def _object_name(self, username):
+        return self.prefix + quote(username, safe="") + ".json"
+
+    def get(self, username):
+        '''Return the user's record ({"password_hash": ...}) or None'''
+        if not username or not isinstance(username, str):
+            return None
+        with self._lock:
+            cached = self._cache.get(username)
+            if cached is not None:
+                self._cache.move_to_end(username)
+        if cached is not None:
+            record, _, fetched_at = cached
+            age = time.time() - fetched_at
+            if record is None:
+                # unknown users are re-checked synchronously once the short negative TTL expires
+                if age < self.negative_ttl:
+                    return None
+            else:
+                if age >= self.ttl:
+                    self._refresh_in_background(username)
+                return record
+        return self._load(username)[0]
+
+    def password_hash(self, username):
+        record = self.get(username)
+        return record.get("password_hash") if record else None
+
+    def create(self, username, password_hash):
+        '''Create a user; raises UserExistsError if the name is taken anywhere'''
+        if self._legacy_users().get(username):
+            raise UserExistsError(username)
+        record = {"username": username, "password_hash": password_hash, "created_at": time.time()}
+        try:
+            generation = google_storage_utility.write_cs_object(
+                self.bucket_name, self._object_name(username), json.dumps(record), if_generation_match=0)
+        except PreconditionFailed:
+            raise UserExistsError(username)
+        self._remember(username, record, generation)
+        return record
+
+    def update(self, username, change):
+        '''
+        Apply change(record) -> record to an existing user with optimistic
+        concurrency, re-reading and retrying when another writer got there first.
+        '''
+        for _ in range(UPDATE_RETRIES):
+            record, generation = self._load(username)
+            if record is None:
+                raise KeyError(username)
+            record = change(dict(record))
+            try:
+                generation = google_storage_utility.write_cs_object(
+                    self.bucket_name, self._object_name(username), json.dumps(record),
+                    if_generation_match=generation)
+            except PreconditionFailed:
+                continue
+            self._remember(username, record, generation)
+            return record
+        raise RuntimeError(f"Could not update user {username}, too many concurrent writes")
+
+    def warm(self):
+        '''Load the legacy user list, e.g. from a warm-up request'''
+        self._legacy_users()
+
+    def _remember(self, username, record, generation):
+        with self._lock:
+            self._cache[username] = (record, generation, time.time())
+            self._cache.move_to_end(username)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _load(self, username):
+        try:
+            content, generation = google_storage_utility.read_cs_object(
+                self.bucket_name, self._object_name(username))
+            record = json.loads(content)
+        except NotFound:
+            record, generation = self._migrate_legacy(username)
+        self._remember(username, record, generation)
+        return record, generation
+
+    def _refresh_in_background(self, username):
+        with self._lock:
+            if username in self._refreshing:
+                return
+            self._refreshing.add(username)
+
+        def refresh():
+            try:
+                self._load(username)
+            except Exception:
+                # keep serving the cached record, the next stale hit retries
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(username)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _legacy_users(self):
+        if self.legacy_object is None:
+            return {}
+        with self._legacy_lock:
+            if self._legacy is None:
+                try:
+                    content, _ = google_storage_utility.read_cs_object(self.bucket_name, self.legacy_object)
+                    self._legacy = json.loads(content)
+                except NotFound:
+                    self._legacy = {}
+            return self._legacy
+
+    def _migrate_legacy(self, username):
+        password_hash = self._legacy_users().get(username)
+        if not password_hash:
+            return None, 0
+        record = {"username": username, "password_hash": password_hash, "created_at": None}
+        try:
+            generation = google_storage_utility.write_cs_object(
+                self.bucket_name, self._object_name(username), json.dumps(record), if_generation_match=0)
+        except PreconditionFailed:
+            # migrated concurrently, read the record that won
+            content, generation = google_storage_utility.read_cs_object(
+                self.bucket_name, self._object_name(username))
+            record = json.loads(content)
+        return record, generation